@@ -0,0 +1,94 @@
+import asyncio
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from pythonosc import osc_server
+
+
+class AsyncRuntime:
+    """
+    Runs all inputs (OSC servers, notifier clients, timers) on one asyncio event loop.
+
+    Handlers wrapped with serialized() are put into a single command queue and
+    executed one after another, in arrival order, on one worker thread. They may
+    block (mod-host socket, subprocesses) without stalling the event loop.
+    Other blocking calls can be offloaded explicitly with offload().
+    """
+    def __init__(self):
+        self._log = logging.getLogger('musicbox.AsyncRuntime')
+        self.loop = asyncio.new_event_loop()
+        self._commands = asyncio.Queue()
+        self._command_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='musicbox-command')
+        self._blocking_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='musicbox-blocking')
+        self._startup = []  # coroutines to run when the loop starts
+        self._transports = []
+        self.commands_handled = 0
+        self.max_queue_length = 0
+
+    def serialized(self, fn):
+        """Wrap a handler so calls (from any thread) are queued to the command handler"""
+        def enqueue(*args):
+            self.loop.call_soon_threadsafe(self._enqueue, fn, args)
+        return enqueue
+
+    def submit(self, fn, *args):
+        """Queue a single call to the command handler"""
+        self.loop.call_soon_threadsafe(self._enqueue, fn, args)
+
+    def _enqueue(self, fn, args):
+        self._commands.put_nowait((fn, args))
+        self.max_queue_length = max(self.max_queue_length, self._commands.qsize())
+
+    async def _command_worker(self):
+        while True:
+            fn, args = await self._commands.get()
+            try:
+                await self.loop.run_in_executor(self._command_executor, fn, *args)
+            except Exception:
+                self._log.exception('Command {!s}{!r} failed'.format(getattr(fn, '__name__', fn), args))
+            self.commands_handled += 1
+
+    def offload(self, fn, *args):
+        """Run a blocking function outside of the event loop (returns an awaitable)"""
+        return self.loop.run_in_executor(self._blocking_executor, fn, *args)
+
+    def add_osc_server(self, dispatcher, port):
+        """Serve an OSC dispatcher on a UDP port on the event loop"""
+        async def start():
+            server = osc_server.AsyncIOOSCUDPServer(('0.0.0.0', port), dispatcher, self.loop)
+            transport, _ = await server.create_serve_endpoint()
+            self._transports.append(transport)
+            self._log.info('Serving OSC on port {:d}'.format(port))
+        self._startup.append(start())
+
+    def add_startup(self, coro):
+        """Run a coroutine (e.g. starting a server) when the loop starts"""
+        self._startup.append(coro)
+
+    def call_every(self, interval, fn):
+        """Queue fn to the command handler every interval seconds"""
+        def tick():
+            self._enqueue(fn, ())
+            self.loop.call_later(interval, tick)
+        self.loop.call_soon_threadsafe(self.loop.call_later, interval, tick)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        for coro in self._startup:
+            self.loop.run_until_complete(coro)
+        self._startup = []
+        worker = self.loop.create_task(self._command_worker())
+        try:
+            self.loop.run_forever()
+        finally:
+            for transport in self._transports:
+                transport.close()
+            worker.cancel()
+            self.loop.run_until_complete(asyncio.gather(worker, return_exceptions=True))
+            self._command_executor.shutdown(wait=True)
+            self._blocking_executor.shutdown(wait=False)
+            self._log.info('Handled {:d} commands (max queue length {:d})'.format(
+                self.commands_handled, self.max_queue_length))
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
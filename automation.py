@@ -0,0 +1,239 @@
+import logging
+import math
+import threading
+import time
+
+try:
+    import numpy  # optional, evaluates all automated parameters with array operations
+except ImportError:
+    numpy = None
+
+
+SHAPES = ('sine', 'triangle', 'square', 'saw')  # LFO shapes (from low to high and back within a cycle)
+_RAMP = len(SHAPES)  # shape code of ramps (envelope segments): phase 0-1 from low to high, once
+RESOLUTION = 0.001  # changes below this fraction of the range of an automation aren't sent
+
+
+def _wave(shape, phase):
+    """
+    Position (0-1) of a shape at a phase (in cycles).
+
+    >>> [round(_wave(SHAPES.index('sine'), p), 2) for p in (0, 0.25, 0.5)], _wave(_RAMP, 1.5)
+    ([0.0, 0.5, 1.0], 1.0)
+    """
+    if shape == _RAMP:
+        return min(phase, 1.0)
+    frac = phase % 1.0
+    if shape == 0:  # sine
+        return 0.5 - 0.5 * math.cos(2 * math.pi * frac)
+    if shape == 1:  # triangle
+        return 1.0 - abs(2.0 * frac - 1.0)
+    if shape == 2:  # square
+        return 1.0 if frac >= 0.5 else 0.0
+    return frac  # saw
+
+
+def _waves(shape, phase):
+    """_wave() of arrays of shapes and phases"""
+    frac = phase % 1.0
+    return numpy.select(
+        [shape == 0, shape == 1, shape == 2, shape == 3],
+        [0.5 - 0.5 * numpy.cos(2 * numpy.pi * frac), 1.0 - numpy.abs(2.0 * frac - 1.0),
+         (frac >= 0.5).astype(float), frac],
+        numpy.minimum(phase, 1.0))
+
+
+class AutomationEngine:
+    """
+    Drives parameters (targets, e.g. (stompbox, parameter index)) with LFOs,
+    ramps and envelopes on a fixed control-rate clock.
+
+    Each automation is a row of a column store (shape, phase, rate, range, last
+    sent value). A tick advances the phases of all rows and evaluates their
+    values at once (with numpy: a few array operations, independent of the
+    number of targets), so many modulated parameters cost about as much as one.
+    Rates are cycles per second, or beats per cycle (tempo-synced, the tempo is
+    read every tick). Values that moved less than RESOLUTION of their range
+    since they were last sent are skipped; all other values of a tick are passed
+    to apply() in one call (e.g. one mod-host batch).
+
+    >>> sent = []
+    >>> engine = AutomationEngine(sent.append, tempo=lambda: 120)
+    >>> engine.lfo('a', 'square', 0.0, 1.0, beats=4)
+    >>> engine.ramp('b', 0.0, 10.0, 0.5)
+    >>> for _ in range(3):
+    ...     engine.tick(0.25)
+    >>> sent
+    [[('a', 0.0), ('b', 5.0)], [('b', 10.0)]]
+    >>> engine.targets(), engine.stats()['ticks']
+    (['a'], 3)
+    """
+    def __init__(self, apply, tempo=None, rate=30, resolution=RESOLUTION, vectorized=None):
+        self._log = logging.getLogger('musicbox.AutomationEngine')
+        self._apply = apply  # callable(list of (target, value)), called once per tick with changes
+        self._tempo = tempo or (lambda: 120)  # callable returning the tempo in BPM (tempo-synced rates)
+        self.interval = 1.0 / rate  # seconds between ticks
+        self._resolution = resolution
+        self._np = numpy if vectorized is None or vectorized else None
+        if vectorized and numpy is None:
+            raise ImportError('Vectorized automation needs numpy')
+        self._lock = threading.Lock()
+        self._targets = []  # target per row
+        self._columns = {name: self._column([]) for name in
+                         ('shape', 'phase', 'hz', 'beats', 'low', 'high', 'last')}
+        self._segments = {}  # target -> remaining envelope segments [(duration, value, synced)]
+        self._previous_tick = None
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.ticks = 0
+        self.sent = 0  # values passed to apply()
+        self.skipped = 0  # values not sent because they didn't move
+        self.failed = 0  # ticks whose apply() raised
+
+    def _column(self, values):
+        return self._np.array(values, dtype=float) if self._np else list(values)
+
+    def _add(self, target, shape, low, high, hz=0.0, beats=0.0, phase=0.0):
+        """Add or replace (a new row) the automation of a target, with the lock held"""
+        if (hz > 0) == (beats > 0):
+            raise ValueError('Give either a positive rate (hz) or a number of beats')
+        self._remove([target])
+        row = {'shape': shape, 'phase': phase, 'hz': hz, 'beats': beats, 'low': low, 'high': high, 'last': math.nan}
+        self._targets.append(target)
+        for name, column in self._columns.items():
+            self._columns[name] = self._np.append(column, row[name]) if self._np else column + [row[name]]
+
+    def _remove(self, targets):
+        """Remove the rows of targets, with the lock held"""
+        rows = [i for i, t in enumerate(self._targets) if t in targets]
+        if not rows:
+            return
+        for target in targets:
+            self._segments.pop(target, None)
+        self._targets = [t for i, t in enumerate(self._targets) if i not in rows]
+        for name, column in self._columns.items():
+            self._columns[name] = self._np.delete(column, rows) if self._np else \
+                [v for i, v in enumerate(column) if i not in rows]
+
+    def lfo(self, target, shape, low, high, hz=0.0, beats=0.0, phase=0.0):
+        """Oscillate between low and high, hz cycles per second or one cycle per beats (tempo-synced)"""
+        if shape not in SHAPES:
+            raise ValueError('Unknown LFO shape {!r}'.format(shape))
+        with self._lock:
+            self._add(target, SHAPES.index(shape), low, high, hz, beats, phase)
+
+    def envelope(self, target, start, points, synced=False):
+        """
+        Linear segments from start through points [(duration, value)], durations in
+        seconds (or beats if synced). The automation ends at the last value.
+        """
+        if not points:
+            raise ValueError('Envelope without points')
+        segments = [(duration, value, synced) for duration, value in points]
+        with self._lock:
+            self._start_segment(target, start, segments)
+
+    def ramp(self, target, start, end, duration, synced=False):
+        """Linear ramp from start to end in duration seconds (or beats if synced)"""
+        self.envelope(target, start, [(duration, end)], synced)
+
+    def _start_segment(self, target, start, segments):
+        duration, value, synced = segments[0]
+        if duration <= 0:
+            raise ValueError('Segment duration has to be positive')
+        self._add(target, _RAMP, start, value, 0.0 if synced else 1.0 / duration, duration if synced else 0.0)
+        if len(segments) > 1:
+            self._segments[target] = segments[1:]
+
+    def clear(self, target=None):
+        """Stop the automation of a target (or of all targets), parameters keep their last value"""
+        with self._lock:
+            self._remove(list(self._targets) if target is None else [target])
+
+    def targets(self):
+        with self._lock:
+            return list(self._targets)
+
+    def tick(self, dt=None):
+        """Advance all automations by dt seconds (default: time since the last tick) and send changed values"""
+        now = time.monotonic()
+        if dt is None:
+            dt = now - self._previous_tick if self._previous_tick is not None else self.interval
+        self._previous_tick = now
+
+        with self._lock:
+            self.ticks += 1
+            if not self._targets:
+                return
+            bpm = float(self._tempo())
+            moved, done = self._evaluate_vector(dt, bpm) if self._np else self._evaluate(dt, bpm)
+            changes = [(self._targets[i], value) for i, value in moved]
+            self.sent += len(changes)
+            self.skipped += len(self._targets) - len(changes)
+            self._finish(done)
+
+        if changes:
+            try:
+                self._apply(changes)
+            except Exception:
+                self.failed += 1
+                self._log.exception('Failed to apply %d automated values', len(changes))
+
+    def _evaluate(self, dt, bpm):
+        """Advance the phases, returns [(row, value)] of moved values and the rows of finished ramps"""
+        c = self._columns
+        moved, done = [], []
+        for i, shape in enumerate(c['shape']):
+            beats = c['beats'][i]
+            c['phase'][i] += (bpm / 60.0 / beats if beats > 0 else c['hz'][i]) * dt
+            low, high = c['low'][i], c['high'][i]
+            value = low + (high - low) * _wave(shape, c['phase'][i])
+            if not abs(value - c['last'][i]) <= self._resolution * abs(high - low):  # always true for NaN
+                c['last'][i] = value
+                moved.append((i, value))
+            if shape == _RAMP and c['phase'][i] >= 1.0:
+                done.append(i)
+        return moved, done
+
+    def _evaluate_vector(self, dt, bpm):
+        """_evaluate() with array operations"""
+        np, c = self._np, self._columns
+        beats = c['beats']
+        c['phase'] += np.where(beats > 0, bpm / 60.0 / np.where(beats > 0, beats, 1.0), c['hz']) * dt
+        low, high = c['low'], c['high']
+        values = low + (high - low) * _waves(c['shape'], c['phase'])
+        rows = np.flatnonzero(~(np.abs(values - c['last']) <= self._resolution * np.abs(high - low)))
+        c['last'][rows] = values[rows]
+        done = np.flatnonzero((c['shape'] == _RAMP) & (c['phase'] >= 1.0))
+        return [(int(i), float(values[i])) for i in rows], [int(i) for i in done]
+
+    def _finish(self, rows):
+        """Continue finished ramps with their next envelope segment or remove them, with the lock held"""
+        if not rows:
+            return
+        finished = [(self._targets[i], self._columns['high'][i]) for i in rows]
+        segments = {target: self._segments.pop(target, None) for target, _ in finished}
+        self._remove([target for target, _ in finished])
+        for target, value in finished:
+            if segments[target]:
+                self._start_segment(target, float(value), segments[target])
+
+    def stats(self):
+        return {'targets': len(self._targets), 'vectorized': self._np is not None, 'ticks': self.ticks,
+                'sent': self.sent, 'skipped': self.skipped, 'failed': self.failed}
+
+    def start(self):
+        """Run ticks in a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.tick()
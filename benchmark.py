@@ -0,0 +1,275 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import benchmark_fakes
+
+from osc_record import OscCounter, OscReplayer, read_log
+
+
+def summarize(samples):
+    """
+    Summary of durations in seconds (milliseconds in the result).
+
+    >>> summarize([0.001, 0.002, 0.003, 0.004])
+    {'n': 4, 'min_ms': 1.0, 'median_ms': 3.0, 'p95_ms': 4.0, 'max_ms': 4.0}
+    """
+    if not samples:
+        return {'n': 0}
+    samples = sorted(samples)
+    return {'n': len(samples),
+            'min_ms': round(samples[0] * 1000, 3),
+            'median_ms': round(samples[len(samples) // 2] * 1000, 3),
+            'p95_ms': round(samples[min(int(len(samples) * 0.95), len(samples) - 1)] * 1000, 3),
+            'max_ms': round(samples[-1] * 1000, 3)}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Benchmark:
+    """
+    Runs the main code paths of MusicBox offline: mod-host, klick, sooperlooper,
+    lv2info/lv2ls and JACK are replaced by the stand-ins of benchmark_fakes, so
+    results are comparable between commits (and machines without audio hardware).
+    Each benchmark records durations in seconds in self.results[name].
+    With a replay log (see osc_record) the recorded OSC inputs are sent to the
+    booted MusicBox instead of running the benchmarks.
+    """
+    def __init__(self, repeat=50, clients=4):
+        self._log = logging.getLogger('musicbox.Benchmark')
+        self._repeat = repeat
+        self._clients = clients
+        self.results = {}  # name -> list of durations
+        self.counts = {}  # name -> value (e.g. mod-host commands per switch)
+        self.replay_results = None
+
+        self._tmp = tempfile.TemporaryDirectory(prefix='musicbox-bench-')
+        benchmark_fakes.install_fake_tools(os.path.join(self._tmp.name, 'bin'))
+        os.environ['PATH'] = os.path.join(self._tmp.name, 'bin') + os.pathsep + os.environ.get('PATH', '')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self._tmp.name, 'cache')  # cold plugin cache
+        os.environ['LV2_PATH'] = os.path.join(self._tmp.name, 'lv2')  # no bundles: metadata comes from lv2info
+        os.makedirs(os.environ['LV2_PATH'])
+        benchmark_fakes.install_fake_jack()
+        self._modhost = benchmark_fakes.FakeModHost().start()
+        self._musicbox = None
+
+    def run(self, replay=None, speed=1.0):
+        try:
+            self.bench_boot()
+            if replay:
+                self.replay(read_log(replay), speed)
+            else:
+                self.bench_load_preset()
+                self.bench_activate_preset()
+                self.bench_slider()
+                self.bench_stomp_toggle()
+                self.bench_automation()
+                self.bench_notifier()
+        finally:
+            if self._musicbox:
+                self._musicbox._shutdown()
+                self._musicbox._metronome.quit()
+            self._modhost.stop()
+            self._tmp.cleanup()
+        return self.report()
+
+    def _record(self, name, duration):
+        self.results.setdefault(name, []).append(duration)
+
+    def bench_boot(self):
+        """MusicBox() until the startup orchestrator finished (first preset built, helpers ready)"""
+        import musicbox
+        start = time.perf_counter()
+        self._musicbox = musicbox.MusicBox()
+        self._record('boot', time.perf_counter() - start)
+
+    def bench_load_preset(self):
+        """Build each preset file, with a cold (lv2info) and a warm plugin info cache"""
+        from plugin import get_plugin_cache
+        filenames = self._musicbox._presets.filenames()
+        for cache in ('cold', 'warm'):
+            for filename in filenames:
+                if cache == 'cold':
+                    get_plugin_cache().invalidate()
+                start = time.perf_counter()
+                self._musicbox._load_preset(filename)
+                self._record('load_preset_' + cache, time.perf_counter() - start)
+
+    def bench_activate_preset(self):
+        """Switch between the presets of the default bank (all built), mod-host commands are answered immediately"""
+        mb = self._musicbox
+        positions = list(range(1, mb._presets.bank_size(0))) or [0]
+        for position in positions:
+            mb._activate_preset(position)  # build all presets first
+        commands = 0
+        for i in range(self._repeat):
+            since = self._modhost.mark()
+            start = time.perf_counter()
+            mb._activate_preset(positions[i % len(positions)])
+            self._record('activate_preset', time.perf_counter() - start)
+            commands += self._modhost.mark() - since
+        self.counts['modhost_commands_per_switch'] = commands / self._repeat
+
+    def bench_slider(self):
+        """cb_slider until mod-host received the param_set (includes waiting for the next control rate tick)"""
+        mb = self._musicbox
+        mb._activate_preset(1 if mb._presets.bank_size(0) > 1 else 0)
+        for i in range(self._repeat):
+            since = self._modhost.mark()
+            start = time.perf_counter()
+            mb.cb_slider(1, float((i * 97) % 1024))
+            arrival = self._modhost.wait_for('param_set', since)
+            if arrival is None:
+                self._log.warning('No param_set for slider 1 (no parameter mapped?)')
+                return
+            self._record('slider_to_param_set', arrival - start)
+
+    def bench_stomp_toggle(self):
+        """cb_stomp_enable (toggle) until mod-host received the bypass command"""
+        for _ in range(self._repeat):
+            since = self._modhost.mark()
+            start = time.perf_counter()
+            self._musicbox.cb_stomp_enable(1, 'enable')
+            arrival = self._modhost.wait_for('bypass', since)
+            if arrival is not None:
+                self._record('stomp_toggle_to_bypass', arrival - start)
+
+    def bench_automation(self):
+        """Automation tick (evaluation and one mod-host batch) with 1 and up to 12 modulated parameters"""
+        mb = self._musicbox
+        mb._activate_preset(1 if mb._presets.bank_size(0) > 1 else 0)
+        params = [(stomp, i, p) for stomp, node in enumerate(mb._pedalboard.graph.nodes)
+                  for i, p in enumerate(node.effect.params)]
+        if not params:
+            self._log.warning('No parameters to automate')
+            return
+        for count in (1, 12):
+            mb._automation.clear()
+            for stomp, i, p in params[:count]:
+                mb._automation.lfo((stomp, i), 'sine', p.minimum, p.maximum, hz=1.0)
+            name = 'automation_tick_{:d}_params'.format(min(count, len(params)))
+            for _ in range(self._repeat):
+                start = time.perf_counter()
+                mb._automation.tick()
+                self._record(name, time.perf_counter() - start)
+        mb._automation.clear()
+
+    def bench_notifier(self):
+        """Notifier update until all connected (legacy) clients received it"""
+        import notifier
+        clients = [socket.create_connection(('127.0.0.1', notifier.PORT)) for _ in range(self._clients)]
+        try:
+            time.sleep(0.2)  # snapshot sent to new clients
+            for c in clients:
+                c.setblocking(False)
+                try:
+                    while c.recv(65536):
+                        pass
+                except BlockingIOError:
+                    pass
+                c.setblocking(True)
+                c.settimeout(5)
+
+            for i in range(self._repeat):
+                marker = 'BENCH:{:d}\n'.format(i).encode()
+                start = time.perf_counter()
+                self._musicbox._notifier.update(marker.decode().rstrip('\n'))
+                for c in clients:
+                    buf = b''
+                    while marker not in buf:
+                        buf += c.recv(65536)
+                self._record('notifier_fan_out_{:d}_clients'.format(self._clients), time.perf_counter() - start)
+        finally:
+            for c in clients:
+                c.close()
+
+    def replay(self, records, speed=1.0, settle_time=0.5):
+        """
+        Send recorded OSC datagrams to the OSC server of MusicBox (at speed times the
+        recorded rate, 0: as fast as possible). Records throughput, drops (datagrams
+        sent but never received by the server) and the latency of the handlers.
+        """
+        from metrics import get_metrics
+        mb = self._musicbox
+        mb._activate_preset(1 if mb._presets.bank_size(0) > 1 else 0)
+        counter = OscCounter()
+        mb._osc_server.recorder = counter
+        mb._osc_server.start()
+        try:
+            get_metrics().reset()
+            replayer = OscReplayer(records, port=mb._osc_server.port, speed=speed)
+            duration = replayer.run()
+            sent = time.monotonic()
+
+            # Wait until the server and the handlers are done
+            def handled():
+                return counter.count, sum(s['count'] for s in get_metrics().snapshot().values())
+            last, deadline = None, time.monotonic() + 30
+            while time.monotonic() < deadline:
+                time.sleep(settle_time)
+                current = handled()
+                if current == last:
+                    break
+                last = current
+            drained = time.monotonic() - settle_time - sent
+        finally:
+            mb._osc_server.stop()
+
+        self.replay_results = {
+            'sent': replayer.sent,
+            'received': counter.count,
+            'dropped': replayer.sent - counter.count,
+            'send_duration_s': round(duration, 3),
+            'max_send_lag_ms': round(replayer.max_lag * 1000, 3),
+            'throughput_msg_s': round(counter.count / duration, 1) if duration else None,
+            'speed': speed,
+            'handlers': {name: s for name, s in get_metrics().snapshot().items()
+                         if name.startswith('cb_') or name in ('apply_slider', 'stomp.toggle', 'preset.switch')},
+        }
+        self._log.info('Replay handled {:.1f}s after the last message was sent'.format(drained))
+
+    def report(self):
+        from metrics import get_metrics
+        return {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': {name: summarize(samples) for name, samples in self.results.items()},
+            'counts': self.counts,
+            'metrics': get_metrics().snapshot(),  # histograms recorded by musicbox itself
+            'replay': self.replay_results,
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks of musicbox with fake mod-host, klick, '
+                                                 'sooperlooper, lv2info and JACK (JSON results)')
+    parser.add_argument('-n', '--repeat', type=int, default=50, help='iterations per benchmark')
+    parser.add_argument('-c', '--clients', type=int, default=4, help='notifier clients')
+    parser.add_argument('-o', '--output', help='JSON file (default: stdout)')
+    parser.add_argument('-r', '--replay', metavar='LOG', help='replay an OSC log (see osc_record) instead of the '
+                                                              'benchmarks')
+    parser.add_argument('-s', '--speed', type=float, default=1.0, help='replay speed factor (0: as fast as possible)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show musicbox log messages')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    report = Benchmark(args.repeat, args.clients).run(args.replay, args.speed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,273 @@
+import logging
+import os
+import socket
+import stat
+import sys
+import threading
+import time
+import types
+
+
+MODHOST_PORT = 5555
+
+# Static JACK port graph of the fake JACK server: (name, is_output)
+JACK_PORTS = [
+    ('system:capture_1', True), ('system:capture_2', True),
+    ('system:playback_1', False), ('system:playback_2', False),
+    ('klick:out', True),
+    ('sooperlooper:loop0_in_1', False), ('sooperlooper:loop0_out_1', True),
+]
+
+LV2 = 'http://lv2plug.in/ns/lv2core#'
+
+
+class FakeModHost:
+    """
+    mod-host stand-in: accepts the command and feedback connections, answers
+    every NUL-terminated command with "resp 0" and records the commands with
+    their arrival time (time.perf_counter()).
+    """
+    def __init__(self, port=MODHOST_PORT):
+        self._log = logging.getLogger('musicbox.FakeModHost')
+        self.port = port
+        self.commands = []  # list of (arrival time, command)
+        self._cond = threading.Condition()
+        self._servers = []
+        self._running = False
+
+    def start(self):
+        self._running = True
+        for port in (self.port, self.port + 1):  # commands, feedback
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind(('127.0.0.1', port))
+            server.listen(8)
+            self._servers.append(server)
+            threading.Thread(target=self._accept, args=(server, port == self.port), daemon=True).start()
+        return self
+
+    def stop(self):
+        self._running = False
+        for server in self._servers:
+            server.close()
+
+    def _accept(self, server, answer):
+        while self._running:
+            try:
+                client, _ = server.accept()
+            except OSError:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if answer:
+                threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client):
+        buf = b''
+        with client:
+            while self._running:
+                try:
+                    data = client.recv(65536)
+                except OSError:
+                    return
+                if not data:
+                    return
+                *commands, buf = (buf + data).split(b'\0')
+                now = time.perf_counter()
+                responses = []
+                with self._cond:
+                    for command in commands:
+                        command = command.decode('utf-8', 'replace')
+                        self.commands.append((now, command))
+                        responses.append(b'resp 0 0.0\0' if command == 'cpu_load' else b'resp 0\0')
+                    self._cond.notify_all()
+                client.sendall(b''.join(responses))
+
+    def mark(self):
+        """Index of the next command (for wait_for)"""
+        with self._cond:
+            return len(self.commands)
+
+    def wait_for(self, prefix, since=0, timeout=5):
+        """Arrival time of the first command starting with prefix recorded at or after index since, None on timeout"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                for arrival, command in self.commands[since:]:
+                    if command.startswith(prefix):
+                        return arrival
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+
+# ---------------------------------------------------------------------------
+# JACK
+# ---------------------------------------------------------------------------
+
+class _FakeJackError(Exception):
+    pass
+
+
+class _FakePort:
+    def __init__(self, name, is_output):
+        self.name = name
+        self.is_output = is_output
+        self.is_input = not is_output
+
+
+class _FakeJackClient:
+    """Client of a fake JACK server with a static port graph (connections are kept per client)"""
+    def __init__(self, name, no_start_server=False, **kwargs):
+        self.name = name
+        self._ports = {name: _FakePort(name, is_output) for name, is_output in JACK_PORTS}
+        self._connections = set()  # (output, input)
+        self._on_connect = None
+
+    def set_port_registration_callback(self, callback):
+        pass
+
+    def set_port_connect_callback(self, callback):
+        self._on_connect = callback
+
+    def activate(self):
+        pass
+
+    def deactivate(self):
+        pass
+
+    def close(self):
+        pass
+
+    def get_ports(self, *args, **kwargs):
+        return list(self._ports.values())
+
+    def get_all_connections(self, port):
+        name = port.name if isinstance(port, _FakePort) else port
+        return [self._ports[i if o == name else o] for o, i in self._connections if name in (o, i)]
+
+    def _change(self, connect, output, input_):
+        if output not in self._ports or input_ not in self._ports:
+            raise _FakeJackError('No such port')
+        (self._connections.add if connect else self._connections.discard)((output, input_))
+        if self._on_connect:
+            self._on_connect(self._ports[output], self._ports[input_], connect)
+
+    def connect(self, output, input_):
+        self._change(True, output, input_)
+
+    def disconnect(self, output, input_):
+        self._change(False, output, input_)
+
+
+def install_fake_jack():
+    """Install a fake `jack` module (JACK-Client API subset) in this process"""
+    module = types.ModuleType('jack')
+    module.JackError = _FakeJackError
+    module.JackOpenError = _FakeJackError
+    module.Client = _FakeJackClient
+    module.Port = _FakePort
+    sys.modules['jack'] = module
+    return module
+
+
+# ---------------------------------------------------------------------------
+# Executables (lv2info, lv2ls, klick, sooperlooper, killall)
+# ---------------------------------------------------------------------------
+
+def install_fake_tools(directory):
+    """
+    Write fake executables to directory (to be put first in PATH). They run this
+    module with the tool name as first argument.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for tool in ('lv2info', 'lv2ls', 'klick', 'sooperlooper', 'killall'):
+        path = os.path.join(directory, tool)
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\nexec "{}" "{}" {} "$@"\n'.format(sys.executable, os.path.abspath(__file__), tool))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def _plugin_database():
+    """Plugin data (mod-ui JSON format) of pluginsmanager's Lv2EffectBuilder: uri -> dict"""
+    from pluginsmanager.model.lv2.lv2_effect_builder import Lv2EffectBuilder
+    builder = Lv2EffectBuilder()
+    return {uri: plugin.json for uri, plugin in builder.plugins.items()}
+
+
+def render_lv2info(uri, plugin):
+    """lv2info output for a plugin of the pluginsmanager database (so parameters match the built effects)"""
+    lines = [uri,
+             '\tName:              {}'.format(plugin.get('name', uri)),
+             '\tClass:             {}'.format((plugin.get('category') or ['Plugin'])[0]),
+             '\tBundle:            file:///usr/lib/lv2/fake.lv2/']
+    ports = []
+    for port_type, type_uri in (('audio', 'AudioPort'), ('control', 'ControlPort')):
+        for direction, direction_uri in (('input', 'InputPort'), ('output', 'OutputPort')):
+            for port in plugin.get('ports', {}).get(port_type, {}).get(direction, []):
+                ports.append((port['index'], type_uri, direction_uri, port))
+    for index, type_uri, direction_uri, port in sorted(ports, key=lambda p: p[0]):
+        lines += ['\tPort {:d}:'.format(index),
+                  '\t\tType:        ' + LV2 + type_uri,
+                  '\t\t             ' + LV2 + direction_uri,
+                  '\t\tSymbol:      ' + port['symbol'],
+                  '\t\tName:        ' + port['name']]
+        ranges = port.get('ranges') or {}
+        for key in ('minimum', 'maximum', 'default'):
+            if key in ranges:
+                lines.append('\t\t{:<12} {:f}'.format(key.capitalize() + ':', float(ranges[key])))
+    return '\n'.join(lines) + '\n'
+
+
+def _lv2info(args):
+    plugins = _plugin_database()
+    if not args or args[0] not in plugins:
+        return 1
+    sys.stdout.write(render_lv2info(args[0], plugins[args[0]]))
+    return 0
+
+
+def _lv2ls(args):
+    for uri in sorted(_plugin_database()):
+        print(uri)
+    return 0
+
+
+def _osc_port(args, flag):
+    return int(args[args.index(flag) + 1])
+
+
+def _klick(args):
+    """klick OSC interface subset: answers pings and tempo queries"""
+    from pythonosc import osc_message, udp_client
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', _osc_port(args, '-o')))
+    tempo = 120
+    while True:
+        message = osc_message.OscMessage(sock.recv(65536))
+        if message.address == '/klick/quit':
+            return 0
+        elif message.address == '/klick/ping':
+            udp_client.SimpleUDPClient('127.0.0.1', int(message.params[0])).send_message('/klick/pong', [])
+        elif message.address == '/klick/simple/set_tempo':
+            tempo = message.params[0]
+        elif message.address == '/klick/simple/query':
+            udp_client.SimpleUDPClient('127.0.0.1', int(message.params[0])).send_message('/klick/simple/tempo', tempo)
+
+
+def _sooperlooper(args):
+    """Discards all OSC messages"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', _osc_port(args, '-p')))
+    while True:
+        sock.recv(65536)
+
+
+def _killall(args):
+    return 0
+
+
+if __name__ == '__main__':
+    tools = {'lv2info': _lv2info, 'lv2ls': _lv2ls, 'klick': _klick, 'sooperlooper': _sooperlooper, 'killall': _killall}
+    sys.exit(tools[sys.argv[1]](sys.argv[2:]))
@@ -0,0 +1,122 @@
+import math
+
+from array import array
+
+
+SLIDER_RANGE = 1024  # sliders send values 0-1023
+
+LV2 = 'http://lv2plug.in/ns/lv2core#'
+PPROPS = 'http://lv2plug.in/ns/ext/port-props#'
+
+# Tapers (curve from slider travel to parameter range)
+LINEAR = 0  # min + (max - min) * x
+LOG = 1  # exp(log(min) + (log(max) - log(min)) * x), for frequencies/times (min and max > 0)
+EXP = 2  # min + (max - min) * x^2, more resolution at the low end (e.g. gains)
+STEPPED = 3  # integer/toggle/enumeration ports: scale points or rounded linear values
+TAPERS = {'linear': LINEAR, 'log': LOG, 'exp': EXP, 'stepped': STEPPED}
+
+
+def taper_for_port(port):
+    """
+    Default taper from LV2 port properties.
+
+    >>> taper_for_port({'properties': [PPROPS + 'logarithmic'], 'minimum': 20.0, 'maximum': 20000.0})
+    1
+    >>> taper_for_port({'properties': [LV2 + 'toggled'], 'minimum': 0.0, 'maximum': 1.0})
+    3
+    """
+    props = port.get('properties') or []
+    if LV2 + 'integer' in props or LV2 + 'toggled' in props or LV2 + 'enumeration' in props:
+        return STEPPED
+    if PPROPS + 'logarithmic' in props and (port.get('minimum') or 0) > 0 and (port.get('maximum') or 0) > 0:
+        return LOG
+    return LINEAR
+
+
+class ControlMap:
+    """
+    Compiled slider -> parameter mapping of one plugin.
+
+    For each slider the parameter index, taper, scale and offset are stored in
+    arrays, so mapping a slider value is a table lookup plus a multiply-add.
+
+    `assignments` (from the preset's "sliders" list) assigns parameters to
+    sliders in order. An entry is a parameter symbol, a parameter index or a
+    dict {'param': <symbol or index>, 'taper': 'linear'|'log'|'exp'|'stepped',
+    'min': ..., 'max': ...}. Without assignments slider N controls parameter N.
+
+    >>> ports = [{'type': 'control', 'direction': 'input', 'symbol': 'gain', 'minimum': 0.0, 'maximum': 10.0},
+    ...          {'type': 'control', 'direction': 'input', 'symbol': 'freq', 'minimum': 20.0, 'maximum': 20000.0,
+    ...           'properties': [PPROPS + 'logarithmic']}]
+    >>> m = ControlMap(ports)
+    >>> m.map(1, 512)
+    (0, 5.0)
+    >>> round(m.map(2, 512)[1])
+    632
+    >>> m.map(3, 512) is None
+    True
+    >>> m = ControlMap(ports, ['freq', {'param': 'gain', 'taper': 'exp'}])
+    >>> m.map(1, 0)[0], round(m.map(1, 0)[1], 6), m.map(2, 512)
+    (1, 20.0, (0, 2.5))
+    """
+    def __init__(self, ports, assignments=None):
+        params = [p for p in ports if p.get('type') == 'control' and p.get('direction') == 'input']
+        symbols = {p['symbol']: i for i, p in enumerate(params)}
+
+        if assignments is None:
+            assignments = list(range(len(params)))
+
+        self._param = array('i')  # slider index -> parameter index
+        self._taper = array('b')
+        self._scale = array('d')
+        self._offset = array('d')
+        self._steps = []  # slider index -> list of values for stepped tapers (or None)
+
+        for a in assignments:
+            options = a if isinstance(a, dict) else {'param': a}
+            param = options['param']
+            index = symbols[param] if isinstance(param, str) else int(param)
+            port = params[index]
+            minimum = float(options.get('min', port.get('minimum') or 0.0))
+            maximum = float(options.get('max', port.get('maximum') or 1.0))
+            taper = TAPERS[options['taper']] if 'taper' in options else taper_for_port(port)
+            if taper == LOG and (minimum <= 0 or maximum <= 0):
+                taper = LINEAR
+
+            steps = None
+            if taper == LOG:
+                offset, scale = math.log(minimum), (math.log(maximum) - math.log(minimum)) / SLIDER_RANGE
+            elif taper == EXP:
+                offset, scale = minimum, (maximum - minimum) / SLIDER_RANGE ** 2
+            elif taper == STEPPED:
+                points = sorted(v for v, _ in port.get('scale_points') or [])
+                steps = points or [float(v) for v in range(int(math.ceil(minimum)), int(math.floor(maximum)) + 1)] \
+                    or [minimum]
+                offset, scale = 0.0, len(steps) / SLIDER_RANGE
+            else:
+                offset, scale = minimum, (maximum - minimum) / SLIDER_RANGE
+
+            self._param.append(index)
+            self._taper.append(taper)
+            self._scale.append(scale)
+            self._offset.append(offset)
+            self._steps.append(steps)
+
+    def __len__(self):
+        return len(self._param)
+
+    def map(self, slider_id, value):
+        """Map a slider (1-based) value (0-1023) to (parameter index, parameter value), None if unassigned"""
+        i = slider_id - 1
+        if not 0 <= i < len(self._param):
+            return None
+
+        taper = self._taper[i]
+        if taper == LINEAR:
+            return self._param[i], self._offset[i] + self._scale[i] * value
+        if taper == LOG:
+            return self._param[i], math.exp(self._offset[i] + self._scale[i] * value)
+        if taper == EXP:
+            return self._param[i], self._offset[i] + self._scale[i] * value * value
+        steps = self._steps[i]
+        return self._param[i], steps[min(int(self._scale[i] * value), len(steps) - 1)]
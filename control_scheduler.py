@@ -0,0 +1,87 @@
+import logging
+import threading
+
+
+class CoalescingScheduler:
+    """
+    Keeps the latest value per control (key) and delivers it at a fixed control rate.
+
+    Many updates of the same control between two ticks are coalesced into one
+    delivery of the last value, so the final value of a fast sweep is always
+    delivered. Values equal to the last delivered value of a control are skipped.
+
+    >>> delivered = []
+    >>> s = CoalescingScheduler(lambda k, v: delivered.append((k, v)))
+    >>> for v in (1, 2, 3):
+    ...     s.submit('a', v)
+    >>> s.submit('b', 7)
+    >>> s.tick()
+    >>> s.submit('b', 7)
+    >>> s.tick()
+    >>> delivered
+    [('a', 3), ('b', 7)]
+    >>> s.stats()
+    {'received': 5, 'delivered': 2, 'coalesced': 2, 'unchanged': 1, 'dropped': 0}
+    """
+    def __init__(self, deliver, rate=30):
+        self._log = logging.getLogger('musicbox.CoalescingScheduler')
+        self._deliver = deliver  # callable(key, value)
+        self.interval = 1.0 / rate  # seconds between ticks
+        self._lock = threading.Lock()
+        self._pending = {}  # key -> latest value (insertion ordered)
+        self._last = {}  # key -> last delivered value
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.received = 0  # submitted values
+        self.delivered = 0  # values passed to deliver()
+        self.coalesced = 0  # values replaced by a newer value before delivery
+        self.unchanged = 0  # values skipped because they equal the last delivered value
+        self.dropped = 0  # values that failed to be delivered
+
+    def submit(self, key, value):
+        with self._lock:
+            self.received += 1
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = value
+
+    def tick(self):
+        """Deliver the latest value of every control changed since the last tick"""
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+
+        for key, value in pending.items():
+            if key in self._last and self._last[key] == value:
+                self.unchanged += 1
+                continue
+            try:
+                self._deliver(key, value)
+            except Exception:
+                self.dropped += 1
+                self._log.exception('Failed to deliver {!r} = {!r}'.format(key, value))
+                continue
+            self._last[key] = value
+            self.delivered += 1
+
+    def stats(self):
+        return {'received': self.received, 'delivered': self.delivered, 'coalesced': self.coalesced,
+                'unchanged': self.unchanged, 'dropped': self.dropped}
+
+    def start(self):
+        """Run ticks in a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.tick()  # deliver final values
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.tick()
@@ -1,59 +1,152 @@
+import argparse
+import logging
+import threading
+import time
+import yaml
+
 from pythonosc import udp_client
 from rtmidi import RtMidiIn, RtMidiOut
 
 
+CC_MAP_FILE = 'footpedal.yaml'
+OSC_PORT = 5005  # port of the main program's OSC server
+LONG_PRESS_TIME = 0.5  # seconds
+
+ALL = 'all'  # layer active in every mode
+PRESS, LONG_PRESS, RELEASE = 0, 1, 2
+EVENTS = {'press': PRESS, 'long_press': LONG_PRESS, 'release': RELEASE}
+
+
+def load_cc_map(filename=CC_MAP_FILE):
+    """Load the footpedal section (controller, long_press_time, layers) of a YAML file"""
+    with open(filename, 'r') as f:
+        return yaml.safe_load(f)['footpedal']
+
+
+class CcMap:
+    """
+    Compiled CC -> action tables: one table of 128 entries per mode layer and event.
+
+    `layers` maps layer names to {cc: action}, an action is an OSC address
+    (on press) or a dict {'press'|'long_press'|'release': address}. Layer 'all'
+    is the base of every mode layer. `resolve(address)` returns the handler
+    for an address, it is called with the address when the action fires.
+
+    >>> m = CcMap({'all': {10: '/preset/1', 11: {'long_press': '/mode/stomp'}},
+    ...            'looper': {10: '/looper/undo'}}, lambda address: print)
+    >>> m.lookup('preset', PRESS, 10)[1], m.lookup('looper', PRESS, 10)[1], m.lookup('looper', LONG_PRESS, 11)[1]
+    ('/preset/1', '/looper/undo', '/mode/stomp')
+    >>> m.lookup('looper', PRESS, 11) is None
+    True
+    """
+    def __init__(self, layers, resolve):
+        self._tables = {}  # layer -> event -> list of 128 (handler, address) or None
+        base = self._compile(layers.get(ALL) or {}, resolve)
+        self._tables[ALL] = base
+        for layer, actions in layers.items():
+            if layer != ALL:
+                table = self._compile(actions or {}, resolve)
+                self._tables[layer] = [[own or inherited for own, inherited in zip(table[e], base[e])]
+                                       for e in range(len(EVENTS))]
+
+    @staticmethod
+    def _compile(actions, resolve):
+        table = [[None] * 128 for _ in EVENTS]
+        for cc, action in actions.items():
+            if not 0 <= int(cc) < 128:
+                raise ValueError('Invalid controller number {!r}'.format(cc))
+            for event, address in (action if isinstance(action, dict) else {'press': action}).items():
+                if address:
+                    table[EVENTS[event]][int(cc)] = (resolve(address), address)
+        return table
+
+    def lookup(self, layer, event, cc):
+        """(handler, address) of an event, None if nothing is mapped"""
+        return self._tables.get(layer, self._tables[ALL])[event][cc]
+
+
+class FootswitchDispatcher:
+    """
+    Turns CC values into press/long press/release events of the active mode layer.
+
+    A value > 0 is a press, 0 a release. Switches with a long press action fire
+    press on release (if released before long_press_time) or long press when
+    held; other switches fire press immediately.
+    """
+    def __init__(self, cc_map, long_press_time=LONG_PRESS_TIME):
+        self._log = logging.getLogger('musicbox.FootswitchDispatcher')
+        self.cc_map = cc_map
+        self.mode = ALL  # active layer
+        self._long_press_time = long_press_time
+        self._held = {}  # cc -> (layer, timer) of switches waiting for long press
+        self._lock = threading.Lock()
+
+    def handle(self, cc, value):
+        if value > 0:
+            if self.cc_map.lookup(self.mode, LONG_PRESS, cc):
+                timer = threading.Timer(self._long_press_time, self._long_press, (cc,))
+                with self._lock:
+                    self._held[cc] = (self.mode, timer)
+                timer.start()
+            else:
+                self._fire(self.mode, PRESS, cc)
+        else:
+            with self._lock:
+                layer, timer = self._held.pop(cc, (self.mode, None))
+            if timer is not None:
+                timer.cancel()
+                self._fire(layer, PRESS, cc)
+            self._fire(layer, RELEASE, cc)
+
+    def _long_press(self, cc):
+        with self._lock:
+            held = self._held.pop(cc, None)
+        if held:  # not released yet
+            self._fire(held[0], LONG_PRESS, cc)
+
+    def _fire(self, layer, event, cc):
+        entry = self.cc_map.lookup(layer, event, cc)
+        if entry:
+            handler, address = entry
+            self._log.debug('CC {:d} -> {}'.format(cc, address))
+            handler(address)
+
+
 class MidiToOsc:
     """
     Translates MIDI messages from a controller to OSC messages for the main program.
 
     Sets up MIDI and OSC connects, then everything is handled through a callback.
     Uses ALSA/RtMidi to receive MIDI messages. Assumes the OSC server is on localhost at the default port.
+    With `resolve` (address -> handler) the actions are dispatched in-process instead.
     """
-    def __init__(self, midi_controller):
+    def __init__(self, midi_controller, config=None, resolve=None):
+        config = config or load_cc_map()
+        self._osc_client = udp_client.SimpleUDPClient('127.0.0.1', OSC_PORT)
+        cc_map = CcMap(config['layers'], resolve or (lambda address: self._send_osc))
+        self._dispatcher = FootswitchDispatcher(cc_map, config.get('long_press_time', LONG_PRESS_TIME))
+
         self._midi_in, self._midi_out = RtMidiIn(), RtMidiOut()
         self._connect_midi(midi_controller)
         self._midi_in.setCallback(self._midi_message_cb)
-        self._osc_client = udp_client.SimpleUDPClient('127.0.0.1', 5005)
         self._osc_client.send_message('/ping', '1')
 
-        # This part needs to be configurable per mode/user config/DIP switches/etc
-        # At the moment, Arduino Micro MIDI device should do:
-        # --------------
-        # | 5  6  7  8 |
-        # | 1  2  3  4 |
-        # --------------
-        #    Press         Press         Press         Long
-        #    Preset        Stomp         Looper        Press
-        #    Mode          Mode          Mode
-        # 1) Preset 1[10]  Stomp1En[20]  Undo[30]     PresetMod[40]
-        # 2) Preset 2[11]  Stomp2En[21]  Record[31]   StompMode[41]
-        # 3) Preset 3[12]  Stomp3En[22]  Overdub[32]  LooperMod[42]
-        # 4) Preset 4[13]  Stomp4En[23]               Tuner[43]
-        # 5) Stomp1En[14]  Stomp5En[24]               Stomp1Sel[44]
-        # 6) Stomp2En[15]  Stomp6En[25]               Stomp2Sel[45]
-        # 7) Stomp3En[16]  Stomp7En[26]               Stomp3Sel[46]
-        # 8) Stomp4En[17]  TapTempo[27]               Stomp4Sel[47]
-        self._cc_osc_translation = {
-            # Presets
-            10: '/preset/1', 11: '/preset/2', 12: '/preset/3', 13: '/preset/4',
-            14: '/stomp/1/enable', 15: '/stomp/2/enable', 16: '/stomp/3/enable', 17: '/stomp/4/enable',
-
-            # Stompboxes
-            20: '/stomp/1/enable', 21: '/stomp/2/enable', 22: '/stomp/3/enable', 23: '/stomp/4/enable',
-            24: '/stomp/5/enable', 25: '/stomp/6/enable', 26: '/stomp/7/enable', 27: '/stomp/8/enable',
-
-            # Looper
-            30: '/looper/undo', 31: '/looper/record', 32: '/looper/overdub', 33: '/looper/mute_trigger',
-            34: '/looper/redo', 35: '/looper/insert', 36: '/looper/multiply', 37: '/looper/pause',
-
-            # Metronome
-            40: '/metronome/pause', 41: '/metronome/dec_bpm', 42: '/metronome/inc_bpm', 43: '/metronome/tap',
-            44: '', 45: '', 46: '', 47: '',
-
-            # Long press
-            100: '/mode/preset', 101: '/mode/stomp', 102: '/mode/looper', 103: '/mode/metronome',
-            104: '/stomp/1/select', 105: '/stomp/2/select', 106: '/stomp/3/select', 107: '/stomp/4/select'
-        }
+    @property
+    def midi_out(self):
+        """Open RtMidiOut to the controller (used for LED/BPM feedback)"""
+        return self._midi_out
+
+    @property
+    def mode(self):
+        return self._dispatcher.mode
+
+    @mode.setter
+    def mode(self, mode):
+        """Select the CC map layer (mode name, e.g. 'looper')"""
+        self._dispatcher.mode = mode
+
+    def _send_osc(self, address):
+        self._osc_client.send_message(address, '1')
 
     def _connect_midi(self, midi_controller):
         def find_port(ports, name):
@@ -77,9 +170,68 @@ class MidiToOsc:
         self._midi_out.openPort(arduino_port)
 
     def _midi_message_cb(self, msg):
-        cc, value = msg.getControllerNumber(), msg.getControllerValue()
-        osc_topic = self._cc_osc_translation.get(cc, None)
-        print('{} -> {} -> {}'.format(cc, '1' if value > 0 else '0', str(osc_topic)))
-        if osc_topic:
-            self._osc_client.send_message(osc_topic, '1')
-            print('sent.')
+        if msg.isController():
+            self._dispatcher.handle(msg.getControllerNumber(), msg.getControllerValue())
+
+
+def measure_latency(count=200):
+    """
+    Footswitch-to-handler latency of the in-process path and of the UDP path
+    (OSC message to a local OSC server), using synthetic CC events.
+    Returns {path: {'median_ms', 'p99_ms', 'max_ms', 'lost'}}.
+    """
+    from pythonosc import dispatcher, osc_server
+
+    arrived = threading.Event()
+    arrival = [0.0]
+
+    def handler(*args):
+        arrival[0] = time.perf_counter()
+        arrived.set()
+
+    def run(resolve):
+        footswitch = FootswitchDispatcher(CcMap({ALL: {1: '/probe'}}, resolve))
+        samples, lost = [], 0
+        for _ in range(count):
+            arrived.clear()
+            t0 = time.perf_counter()
+            footswitch.handle(1, 127)
+            if arrived.wait(1):
+                samples.append(arrival[0] - t0)
+            else:
+                lost += 1
+        samples.sort()
+        return {'median_ms': samples[len(samples) // 2] * 1000 if samples else None,
+                'p99_ms': samples[int(len(samples) * 0.99)] * 1000 if samples else None,
+                'max_ms': samples[-1] * 1000 if samples else None,
+                'lost': lost}
+
+    results = {'in_process': run(lambda address: handler)}
+
+    probe_dispatcher = dispatcher.Dispatcher()
+    probe_dispatcher.map('/probe', handler)
+    server = osc_server.ThreadingOSCUDPServer(('127.0.0.1', 0), probe_dispatcher)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = udp_client.SimpleUDPClient('127.0.0.1', server.server_address[1])
+    try:
+        results['udp'] = run(lambda address: lambda a: client.send_message(a, '1'))
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Footpedal MIDI to OSC bridge (for a separately running musicbox)')
+    parser.add_argument('--config', default=CC_MAP_FILE, help='YAML file with the CC map')
+    parser.add_argument('--measure-latency', type=int, metavar='N', help='measure dispatch latency with N events and exit')
+    args = parser.parse_args()
+
+    if args.measure_latency:
+        for path, result in measure_latency(args.measure_latency).items():
+            print('{}: {!s}'.format(path, result))
+    else:
+        config = load_cc_map(args.config)
+        MidiToOsc(config['controller'], config)
+        threading.Event().wait()  # everything is handled in the MIDI callback
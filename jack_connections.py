@@ -1,3 +1,6 @@
+import logging
+import threading
+
 from subprocess import check_call, check_output
 
 
@@ -20,18 +23,13 @@ def _parse(s):
     if s == '':
         return connections
 
-    lines = s.splitlines()
-    for i, line in enumerate(lines):
+    originating_port = None  # last line that is not indented
+    for line in s.splitlines():
         if line.startswith('   '):  # connected port
-            assert i > 0
-
-            # Find line above which is originating port
-            originating_port = [l for l in lines[:i] if not l.startswith(' ')][-1]
             assert originating_port
-
-            if originating_port not in connections:
-                connections[originating_port] = []
-            connections[originating_port].append(line.strip())
+            connections.setdefault(originating_port, []).append(line.strip())
+        else:
+            originating_port = line
 
     return connections
 
@@ -81,3 +79,145 @@ def connect(port_a, port_b):
 
 def disconnect(port_a, port_b):
     _jack_connect_disconnect('disconnect', port_a, port_b)
+
+
+class JackConnectionManager:
+    """
+    Manages JACK connections with an in-process JACK client (no jack_lsp/jack_connect processes).
+
+    Ports and connections are cached and kept up to date by JACK's port
+    registration and connect callbacks. reconcile() takes the desired set of
+    (output, input) connections and only applies the difference. Desired
+    connections of ports that don't exist yet are made as soon as the ports
+    are registered (e.g. when sooperlooper has started).
+    """
+    def __init__(self, name='musicbox'):
+        import jack
+        self._log = logging.getLogger('musicbox.JackConnectionManager')
+        self._jack_error = jack.JackError
+        self._lock = threading.RLock()
+        self._ports = set()  # port names
+        self._connections = set()  # (output, input) port names
+        self._desired = set()
+        self._managed = set()
+        self._pending = threading.Event()  # set when desired ports got registered
+        self._running = True
+
+        self._client = jack.Client(name, no_start_server=True)
+        self._client.set_port_registration_callback(self._port_registration)
+        self._client.set_port_connect_callback(self._port_connect)
+        self._client.activate()
+
+        with self._lock:
+            for port in self._client.get_ports():
+                self._ports.add(port.name)
+                if port.is_output:
+                    for other in self._client.get_all_connections(port):
+                        self._connections.add((port.name, other.name))
+
+        self._thread = threading.Thread(target=self._apply_pending, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._running = False
+        self._pending.set()
+        self._thread.join()
+        self._client.deactivate()
+        self._client.close()
+
+    # JACK callbacks (JACK's notification thread, must not call the JACK server)
+
+    def _port_registration(self, port, register):
+        with self._lock:
+            if register:
+                self._ports.add(port.name)
+                if any(port.name in c for c in self._desired):
+                    self._pending.set()
+            else:
+                self._ports.discard(port.name)
+                self._connections = {c for c in self._connections if port.name not in c}
+
+    def _port_connect(self, a, b, connect):
+        connection = (a.name, b.name) if a.is_output else (b.name, a.name)
+        with self._lock:
+            if connect:
+                self._connections.add(connection)
+            else:
+                self._connections.discard(connection)
+
+    # Cache
+
+    @property
+    def ports(self):
+        with self._lock:
+            return set(self._ports)
+
+    @property
+    def connections(self):
+        """Set of (output, input) port names"""
+        with self._lock:
+            return set(self._connections)
+
+    # Changes
+
+    def connect(self, output, input_):
+        self._change(True, output, input_)
+
+    def disconnect(self, output, input_):
+        self._change(False, output, input_)
+
+    def _change(self, connect, output, input_):
+        with self._lock:
+            if output not in self._ports or input_ not in self._ports:
+                raise ValueError('{} and {} must be valid ports'.format(output, input_))
+            if ((output, input_) in self._connections) == connect:
+                return False
+            (self._client.connect if connect else self._client.disconnect)(output, input_)
+            if connect:
+                self._connections.add((output, input_))
+            else:
+                self._connections.discard((output, input_))
+            return True
+
+    def reconcile(self, desired, managed=None):
+        """
+        Make the connections of the managed ports (default: all ports in desired)
+        equal to the desired set of (output, input) connections, in one pass:
+        only missing connections are made and only undesired ones removed.
+        Returns (connected, disconnected) lists.
+        """
+        desired = set(desired)
+        if managed is None:
+            managed = {port for connection in desired for port in connection}
+        with self._lock:
+            self._desired, self._managed = desired, set(managed)
+            return self._apply()
+
+    def _apply(self):
+        with self._lock:
+            remove = [c for c in self._connections
+                      if c not in self._desired and (c[0] in self._managed or c[1] in self._managed)]
+            add = [c for c in self._desired
+                   if c not in self._connections and c[0] in self._ports and c[1] in self._ports]
+            disconnected, connected = [], []
+            for changes, done, connect in ((remove, disconnected, False), (add, connected, True)):
+                for output, input_ in sorted(changes):
+                    try:
+                        self._change(connect, output, input_)
+                        done.append((output, input_))
+                    except self._jack_error as e:
+                        self._log.error('Failed to {} {} -> {}: {!s}'.format(
+                            'connect' if connect else 'disconnect', output, input_, e))
+
+            missing = len(self._desired) - len(self._desired & self._connections)
+            self._log.debug('Reconciled JACK connections: +{:d} -{:d} ({:d} waiting for ports)'.format(
+                len(connected), len(disconnected), missing))
+            return connected, disconnected
+
+    def _apply_pending(self):
+        while True:
+            self._pending.wait()
+            self._pending.clear()
+            if not self._running:
+                return
+            self._apply()
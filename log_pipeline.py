@@ -0,0 +1,127 @@
+import logging
+import queue
+import threading
+
+from collections import deque
+
+
+RING_SIZE = 1000  # formatted lines kept in memory
+QUEUE_SIZE = 10000  # records waiting for the writer, further records are dropped
+RATE = 50  # records per second and logger (sustained)
+BURST = 200  # records a logger can emit at once
+
+
+class AsyncLogHandler(logging.Handler):
+    """
+    Logging handler that never blocks the calling thread on formatting or I/O.
+
+    emit() only puts the record (message and arguments not formatted yet) into
+    a bounded queue; records beyond the queue size are dropped and counted.
+    Each logger is rate limited (token bucket: RATE per second, bursts of
+    BURST), suppressed records are reported by a summary record. A background
+    writer formats the records, keeps the latest lines in a ring buffer and
+    passes the records to the target handlers (e.g. file and console).
+
+    >>> handler = AsyncLogHandler([], rate=1, burst=2)
+    >>> log = logging.getLogger('musicbox.doctest')
+    >>> log.addHandler(handler); log.propagate = False
+    >>> for i in range(5):
+    ...     log.warning('message %d', i)
+    >>> handler.close()
+    >>> handler.lines(), handler.stats()['suppressed']
+    (['message 0', 'message 1'], 3)
+    """
+    def __init__(self, handlers, ring_size=RING_SIZE, queue_size=QUEUE_SIZE, rate=RATE, burst=BURST):
+        logging.Handler.__init__(self)
+        self._handlers = handlers
+        self._ring = deque(maxlen=ring_size)
+        self._queue = queue.Queue(queue_size)
+        self._rate = rate
+        self._burst = burst
+        self._buckets = {}  # logger name -> [tokens, last refill time, suppressed records]
+        self._bucket_lock = threading.Lock()
+        self.written = self.dropped = self.suppressed = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._write, name='musicbox-log-writer', daemon=True)
+        self._thread.start()
+
+    def _allow(self, name, now):
+        """Rate limit check, returns the number of records suppressed before this one (or None to suppress it)"""
+        with self._bucket_lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                bucket = self._buckets[name] = [self._burst, now, 0]
+            bucket[0] = min(self._burst, bucket[0] + (now - bucket[1]) * self._rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.suppressed += 1
+                return None
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+            return suppressed
+
+    def emit(self, record):
+        suppressed = self._allow(record.name, record.created)
+        if suppressed is None:
+            return
+        if suppressed:
+            self._put(logging.makeLogRecord({
+                'name': record.name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': 'Suppressed %d log records (rate limit)', 'args': (suppressed,)}))
+        self._put(record)
+
+    def _put(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            try:
+                self._ring.append(self.format(record))
+                for handler in self._handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+                self.written += 1
+            except Exception:
+                self.handleError(record)
+
+    def lines(self, count=None):
+        """Latest formatted lines (all in the ring buffer, or the last count)"""
+        lines = list(self._ring)
+        return lines[-count:] if count else lines
+
+    def stats(self):
+        return {'written': self.written, 'queued': self._queue.qsize(), 'dropped': self.dropped,
+                'suppressed': self.suppressed}
+
+    def close(self):
+        """Write all queued records and close the target handlers"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+            for handler in self._handlers:
+                handler.close()
+        logging.Handler.close(self)
+
+
+_pipeline = None
+
+
+def install_pipeline(logger, handlers, **kwargs):
+    """Log through an AsyncLogHandler writing to handlers, returns it"""
+    global _pipeline
+    _pipeline = AsyncLogHandler(handlers, **kwargs)
+    logger.addHandler(_pipeline)
+    return _pipeline
+
+
+def get_pipeline():
+    """The installed AsyncLogHandler, None if logging is synchronous"""
+    return _pipeline
@@ -1,25 +1,43 @@
 from pythonosc import udp_client
-from subprocess import check_call
+from supervisor import Helper
 
 
 class Looper:
     PORT = 9951
 
-    def __init__(self):
+    def __init__(self, supervisor, ready=None):
         self._osc = udp_client.SimpleUDPClient('127.0.0.1', self.PORT)
         self._current_loop = 0
+        self._enabled = False
+
+        # sooperlooper is kept running by the supervisor (instead of a systemd service started per mode change)
+        self._helper = supervisor.add(Helper('sooperlooper', ['sooperlooper', '-c', '1', '-t', '300', '-p', str(self.PORT)],
+                                             ready))
+
+    @property
+    def helper(self):
+        """Supervised sooperlooper process"""
+        return self._helper
 
     def _send_osc(self, cmd):
         self._osc.send_message('/sl/{:d}/hit'.format(self._current_loop), cmd)
 
     def enable(self, enable):
-        check_call(['systemctl', 'start' if enable else 'stop', 'sooperlooper'])
+        """
+        Doesn't start/stop sooperlooper (it stays warm), the audio is routed
+        to it only in looper mode (see MusicBox._set_mode).
+        """
+        self._enabled = enable
+
+    @property
+    def is_enabled(self):
+        return self._enabled
 
     def undo(self):
         self._send_osc('undo')
 
     def redo(self):
-        self._semd_osc('redo')
+        self._send_osc('redo')
 
     def record(self, insert=False):
         self._send_osc('insert' if insert else 'record')
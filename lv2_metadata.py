@@ -0,0 +1,597 @@
+"""
+Backends providing LV2 plugin metadata (name, class, bundle and port descriptors).
+
+All backends return the same info dict:
+
+    {'name': ..., 'class': ..., 'bundle': <bundle directory>,
+     'stereo_input': bool, 'stereo_output': bool,
+     'ports': [<port dict>, ...], 'parameters': [{<name>: {'Symbol', 'Minimum', 'Maximum', 'Default'}}, ...]}
+
+where each port dict has the keys index, symbol, name, direction ('input'/'output'),
+type ('audio', 'control', 'cv', 'atom', 'event' or None), minimum, maximum, default,
+scale_points (list of [value, label]), unit and properties (list of URIs).
+
+- TtlBackend reads manifest.ttl and the plugin's TTL files from the LV2 bundles directly
+- LilvBackend uses the lilv python bindings (if installed)
+- Lv2infoBackend runs lv2info and parses its output (fallback)
+"""
+import logging
+import os
+import re
+import subprocess
+
+from urllib.parse import unquote, urljoin, urlparse
+
+from metrics import get_metrics
+
+
+LV2 = 'http://lv2plug.in/ns/lv2core#'
+RDF = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+RDFS = 'http://www.w3.org/2000/01/rdf-schema#'
+DOAP = 'http://usefulinc.com/ns/doap#'
+UNITS = 'http://lv2plug.in/ns/extensions/units#'
+RDF_TYPE = RDF + 'type'
+
+DEFAULT_LV2_PATH = ['~/.lv2', '/usr/local/lib/lv2', '/usr/lib/lv2']
+
+PORT_TYPES = {
+    LV2 + 'AudioPort': 'audio',
+    LV2 + 'ControlPort': 'control',
+    LV2 + 'CVPort': 'cv',
+    'http://lv2plug.in/ns/ext/atom#AtomPort': 'atom',
+    'http://lv2plug.in/ns/ext/event#EventPort': 'event',
+}
+
+
+class PluginNotFound(KeyError):
+    pass
+
+
+def file_uri_to_path(uri):
+    if uri.startswith('file://'):
+        return unquote(urlparse(uri).path)
+    return uri
+
+
+def class_label(class_uri):
+    """
+    Human readable label of a plugin class URI.
+
+    >>> class_label('http://lv2plug.in/ns/lv2core#AmplifierPlugin')
+    'Amplifier'
+    >>> class_label('http://lv2plug.in/ns/lv2core#Plugin')
+    'Plugin'
+    """
+    name = class_uri.rsplit('#', 1)[-1].rsplit('/', 1)[-1]
+    if name.endswith('Plugin') and name != 'Plugin':
+        name = name[:-len('Plugin')]
+    return re.sub(r'(?<=[a-z])(?=[A-Z])', ' ', name)
+
+
+def make_plugin_info(name, plugin_class, bundle, ports):
+    """Build info dict (see module docstring) from a list of port dicts"""
+    ports = sorted(ports, key=lambda p: p['index'])
+    audio_in = [p for p in ports if p['type'] == 'audio' and p['direction'] == 'input']
+    audio_out = [p for p in ports if p['type'] == 'audio' and p['direction'] == 'output']
+
+    parameters = []
+    for p in ports:
+        if p['type'] != 'control' or p['direction'] != 'input':
+            continue
+        port_info = {'Symbol': p['symbol']}
+        for key, value in [('Minimum', p['minimum']), ('Maximum', p['maximum']), ('Default', p['default'])]:
+            if value is not None:
+                port_info[key] = float(value)
+        parameters.append({p['name'] or p['symbol']: port_info})
+
+    return {
+        'name': name,
+        'class': plugin_class,
+        'bundle': bundle,
+        'stereo_input': len(audio_in) >= 2,
+        'stereo_output': len(audio_out) >= 2,
+        'ports': ports,
+        'parameters': parameters,
+    }
+
+
+def _new_port(index):
+    return {'index': index, 'symbol': None, 'name': None, 'direction': None, 'type': None,
+            'minimum': None, 'maximum': None, 'default': None, 'scale_points': [], 'unit': None,
+            'properties': []}
+
+
+def _port_types(port, type_uris):
+    for t in type_uris:
+        if t == LV2 + 'InputPort':
+            port['direction'] = 'input'
+        elif t == LV2 + 'OutputPort':
+            port['direction'] = 'output'
+        elif t in PORT_TYPES:
+            port['type'] = PORT_TYPES[t]
+
+
+# ---------------------------------------------------------------------------
+# Turtle parser (subset sufficient for LV2 bundles)
+# ---------------------------------------------------------------------------
+
+class Literal(str):
+    """A string literal from a Turtle document (IRIs are plain str, blank nodes start with '_:')"""
+    pass
+
+
+_TOKEN_RE = re.compile(r'''
+    (?P<ws>\s+|\#[^\n]*)
+  | (?P<iri><[^>]*>)
+  | (?P<long_string>"""(?:[^"\\]|\\.|"(?!""))*"""|\'\'\'(?:[^'\\]|\\.|'(?!''))*\'\'\')
+  | (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+  | (?P<lang>@[a-zA-Z]+(?:-[a-zA-Z0-9]+)*)
+  | (?P<datatype>\^\^)
+  | (?P<number>[+-]?(?:\d*\.\d+(?:[eE][+-]?\d+)?|\d+(?:\.\d*)?[eE][+-]?\d+|\d+))
+  | (?P<bnode>_:[A-Za-z0-9_][\w.-]*)
+  | (?P<pname>(?:[A-Za-z][\w.-]*)?:(?:[\w%-]+(?:[.\w%-]*[\w%-])?)?)
+  | (?P<keyword>a\b|true\b|false\b|PREFIX\b|BASE\b|prefix\b|base\b)
+  | (?P<punct>[.;,\[\]()])
+''', re.VERBOSE)
+
+_ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', 'b': '\b', 'f': '\f', '"': '"', "'": "'", '\\': '\\'}
+
+
+def _unescape(s):
+    return re.sub(r'\\(u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|.)',
+                  lambda m: chr(int(m.group(1)[1:], 16)) if m.group(1)[0] in 'uU' and len(m.group(1)) > 1
+                  else _ESCAPES.get(m.group(1), m.group(1)), s)
+
+
+def _tokenize(text):
+    pos = 0
+    while pos < len(text):
+        m = _TOKEN_RE.match(text, pos)
+        if not m:
+            raise ValueError('Turtle syntax error at offset {:d}: {!r}'.format(pos, text[pos:pos + 20]))
+        pos = m.end()
+        kind = m.lastgroup
+        if kind != 'ws':
+            yield kind, m.group(kind)
+    yield 'eof', None
+
+
+class _TurtleParser:
+    def __init__(self, text, base):
+        self._tokens = _tokenize(text)
+        self._base = base or ''
+        self._prefixes = {}
+        self._bnode_count = 0
+        self.triples = []
+        self._next()
+
+    def _next(self):
+        self._kind, self._value = next(self._tokens)
+
+    def _expect(self, value):
+        if self._value != value:
+            raise ValueError('Turtle syntax error: expected {!r}, got {!r}'.format(value, self._value))
+        self._next()
+
+    def _new_bnode(self):
+        self._bnode_count += 1
+        return '_:genid{:d}'.format(self._bnode_count)
+
+    def _iri(self):
+        kind, value = self._kind, self._value
+        self._next()
+        if kind == 'iri':
+            return urljoin(self._base, value[1:-1])
+        if kind == 'pname':
+            prefix, local = value.split(':', 1)
+            if prefix not in self._prefixes:
+                raise ValueError('Undefined prefix {!r}'.format(prefix))
+            return self._prefixes[prefix] + local
+        raise ValueError('Turtle syntax error: expected IRI, got {!r}'.format(value))
+
+    def parse(self):
+        while self._kind != 'eof':
+            if self._value in ('@prefix', 'PREFIX', 'prefix'):
+                sparql_style = self._value != '@prefix'
+                self._next()
+                prefix = self._value[:-1]
+                self._next()
+                self._prefixes[prefix] = self._iri()
+                if not sparql_style:
+                    self._expect('.')
+            elif self._value in ('@base', 'BASE', 'base'):
+                sparql_style = self._value != '@base'
+                self._next()
+                self._base = self._iri()
+                if not sparql_style:
+                    self._expect('.')
+            else:
+                self._statement()
+        return self.triples
+
+    def _statement(self):
+        if self._value == '[':
+            subject = self._blank_node_property_list()
+            if self._value != '.':
+                self._predicate_object_list(subject)
+        else:
+            subject = self._subject()
+            self._predicate_object_list(subject)
+        self._expect('.')
+
+    def _subject(self):
+        if self._kind == 'bnode':
+            value = self._value
+            self._next()
+            return value
+        return self._iri()
+
+    def _predicate_object_list(self, subject):
+        while True:
+            if self._value == 'a':
+                self._next()
+                predicate = RDF_TYPE
+            else:
+                predicate = self._iri()
+            while True:
+                self.triples.append((subject, predicate, self._object()))
+                if self._value != ',':
+                    break
+                self._next()
+            if self._value != ';':
+                return
+            while self._value == ';':
+                self._next()
+            if self._value in ('.', ']'):
+                return
+
+    def _blank_node_property_list(self):
+        self._expect('[')
+        node = self._new_bnode()
+        if self._value != ']':
+            self._predicate_object_list(node)
+        self._expect(']')
+        return node
+
+    def _collection(self):
+        self._expect('(')
+        items = []
+        while self._value != ')':
+            items.append(self._object())
+        self._next()
+        return tuple(items)
+
+    def _object(self):
+        kind, value = self._kind, self._value
+        if value == '[':
+            return self._blank_node_property_list()
+        if value == '(':
+            return self._collection()
+        if kind in ('string', 'long_string'):
+            quote = 3 if kind == 'long_string' else 1
+            self._next()
+            literal = Literal(_unescape(value[quote:-quote]))
+            if self._kind == 'lang':
+                self._next()
+            elif self._kind == 'datatype':
+                self._next()
+                datatype = self._iri()
+                if datatype.endswith(('#integer', '#int', '#long')):
+                    return int(literal)
+                if datatype.endswith(('#decimal', '#double', '#float')):
+                    return float(literal)
+            return literal
+        if kind == 'number':
+            self._next()
+            return int(value) if re.match(r'^[+-]?\d+$', value) else float(value)
+        if value in ('true', 'false'):
+            self._next()
+            return value == 'true'
+        if kind == 'bnode':
+            self._next()
+            return value
+        return self._iri()
+
+
+def parse_turtle(text, base=None):
+    """
+    Parse a Turtle document into a list of (subject, predicate, object) triples.
+    IRIs are returned as str, literals as Literal/int/float/bool, blank nodes as '_:...'.
+
+    >>> t = parse_turtle('@prefix lv2: <http://lv2plug.in/ns/lv2core#> . <p> a lv2:Plugin ; lv2:port [ lv2:index 0 ] .', 'file:///b/')
+    >>> t[0]
+    ('file:///b/p', 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type', 'http://lv2plug.in/ns/lv2core#Plugin')
+    >>> t[1:]
+    [('_:genid1', 'http://lv2plug.in/ns/lv2core#index', 0), ('file:///b/p', 'http://lv2plug.in/ns/lv2core#port', '_:genid1')]
+    """
+    return _TurtleParser(text, base).parse()
+
+
+class Graph:
+    """Triples indexed by subject: subject -> predicate -> [objects]"""
+    def __init__(self, triples=()):
+        self._subjects = {}
+        self.add(triples)
+
+    def add(self, triples):
+        for s, p, o in triples:
+            self._subjects.setdefault(s, {}).setdefault(p, []).append(o)
+
+    def objects(self, subject, predicate):
+        return self._subjects.get(subject, {}).get(predicate, [])
+
+    def value(self, subject, predicate, default=None):
+        objects = self.objects(subject, predicate)
+        return objects[0] if objects else default
+
+    def subjects_with_type(self, type_uri):
+        return [s for s, props in self._subjects.items() if type_uri in props.get(RDF_TYPE, [])]
+
+
+def plugin_info_from_graph(graph, uri, bundle):
+    """
+    Extract info dict for plugin `uri` from a parsed Graph.
+
+    >>> ttl = '''@prefix lv2: <http://lv2plug.in/ns/lv2core#> .
+    ... @prefix doap: <http://usefulinc.com/ns/doap#> .
+    ... <urn:amp> a lv2:Plugin, lv2:AmplifierPlugin ; doap:name "Amp" ;
+    ...   lv2:port [ a lv2:AudioPort, lv2:InputPort ; lv2:index 0 ; lv2:symbol "in" ; lv2:name "In" ] ,
+    ...            [ a lv2:ControlPort, lv2:InputPort ; lv2:index 1 ; lv2:symbol "gain" ; lv2:name "Gain" ;
+    ...              lv2:default 0.5 ; lv2:minimum 0 ; lv2:maximum 1.0 ] .
+    ... '''
+    >>> info = plugin_info_from_graph(Graph(parse_turtle(ttl)), 'urn:amp', '/b')
+    >>> info['name'], info['class'], info['stereo_input']
+    ('Amp', 'Amplifier', False)
+    >>> info['parameters']
+    [{'Gain': {'Symbol': 'gain', 'Minimum': 0.0, 'Maximum': 1.0, 'Default': 0.5}}]
+    """
+    types = [t for t in graph.objects(uri, RDF_TYPE) if t != LV2 + 'Plugin']
+    plugin_class = class_label(types[0]) if types else 'Plugin'
+
+    ports = []
+    for node in graph.objects(uri, LV2 + 'port'):
+        port = _new_port(int(graph.value(node, LV2 + 'index', -1)))
+        port['symbol'] = str(graph.value(node, LV2 + 'symbol', '')) or None
+        port['name'] = str(graph.value(node, LV2 + 'name', '')) or port['symbol']
+        _port_types(port, graph.objects(node, RDF_TYPE))
+        for key in ('minimum', 'maximum', 'default'):
+            value = graph.value(node, LV2 + key)
+            port[key] = float(value) if value is not None else None
+        for sp in graph.objects(node, LV2 + 'scalePoint'):
+            port['scale_points'].append([float(graph.value(sp, RDF + 'value', 0)),
+                                         str(graph.value(sp, RDFS + 'label', ''))])
+        unit = graph.value(node, UNITS + 'unit')
+        port['unit'] = str(unit) if unit is not None else None
+        port['properties'] = [str(p) for p in graph.objects(node, LV2 + 'portProperty')]
+        ports.append(port)
+
+    return make_plugin_info(str(graph.value(uri, DOAP + 'name', '')), plugin_class, bundle, ports)
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+class TtlBackend:
+    """
+    Reads plugin metadata from the TTL files in the LV2 bundles (no subprocess).
+    Bundles are found in LV2_PATH (or the default LV2 directories).
+    """
+    def __init__(self, lv2_path=None):
+        self._log = logging.getLogger('musicbox.TtlBackend')
+        if lv2_path is None:
+            lv2_path = os.environ['LV2_PATH'].split(':') if os.environ.get('LV2_PATH') else DEFAULT_LV2_PATH
+        self._lv2_path = [os.path.expanduser(p) for p in lv2_path]
+        self._index = None  # plugin uri -> (bundle directory, [data files])
+
+    def _read_graph(self, filename, graph):
+        with open(filename, 'r', encoding='utf-8') as f:
+            graph.add(parse_turtle(f.read(), 'file://' + os.path.abspath(filename)))
+
+    def _build_index(self):
+        self._index = {}
+        for directory in self._lv2_path:
+            try:
+                bundles = sorted(os.listdir(directory))
+            except OSError:
+                continue
+            for bundle in bundles:
+                bundle_dir = os.path.join(directory, bundle)
+                manifest = os.path.join(bundle_dir, 'manifest.ttl')
+                if not os.path.isfile(manifest):
+                    continue
+                graph = Graph()
+                try:
+                    self._read_graph(manifest, graph)
+                except (OSError, ValueError) as e:
+                    self._log.warning('Skipping bundle {}: {!s}'.format(bundle_dir, e))
+                    continue
+                for uri in graph.subjects_with_type(LV2 + 'Plugin'):
+                    if uri in self._index:  # earlier LV2_PATH entries take precedence
+                        continue
+                    data_files = [manifest] + [file_uri_to_path(f) for f in graph.objects(uri, RDFS + 'seeAlso')]
+                    self._index[uri] = (bundle_dir, data_files)
+        self._log.info('Indexed {:d} LV2 plugins'.format(len(self._index)))
+
+    def list_plugins(self):
+        if self._index is None:
+            self._build_index()
+        return sorted(self._index.keys())
+
+    def load(self, uri):
+        if self._index is None:
+            self._build_index()
+        if uri not in self._index:
+            raise PluginNotFound(uri)
+
+        bundle_dir, data_files = self._index[uri]
+        graph = Graph()
+        for filename in data_files:
+            self._read_graph(filename, graph)
+        return plugin_info_from_graph(graph, uri, bundle_dir)
+
+
+class LilvBackend:
+    """Reads plugin metadata through the lilv python bindings"""
+    def __init__(self):
+        import lilv  # optional dependency, raises ImportError if not installed
+        self._lilv = lilv
+        self._world = lilv.World()
+        self._world.load_all()
+        self._plugins = self._world.get_all_plugins()
+
+    def _uri(self, uri):
+        return self._world.new_uri(uri)
+
+    def load(self, uri):
+        try:
+            plugin = self._plugins[self._uri(uri)]
+        except KeyError:
+            raise PluginNotFound(uri)
+
+        type_uris = {self._uri(t): t for t in [LV2 + 'InputPort', LV2 + 'OutputPort'] + list(PORT_TYPES.keys())}
+        unit_pred = self._uri(UNITS + 'unit')
+
+        ports = []
+        for i in range(plugin.get_num_ports()):
+            lport = plugin.get_port_by_index(i)
+            port = _new_port(i)
+            port['symbol'] = str(lport.get_symbol())
+            port['name'] = str(lport.get_name())
+            _port_types(port, [t for node, t in type_uris.items() if lport.is_a(node)])
+            default, minimum, maximum = lport.get_range()
+            for key, node in [('minimum', minimum), ('maximum', maximum), ('default', default)]:
+                port[key] = float(node) if node is not None else None
+            for sp in lport.get_scale_points() or []:
+                port['scale_points'].append([float(sp.get_value()), str(sp.get_label())])
+            unit = lport.get(unit_pred)
+            port['unit'] = str(unit) if unit is not None else None
+            port['properties'] = [str(p) for p in lport.get_properties()]
+            ports.append(port)
+
+        return make_plugin_info(str(plugin.get_name()), str(plugin.get_class().get_label()),
+                                file_uri_to_path(str(plugin.get_bundle_uri())), ports)
+
+
+_LV2INFO_KEY_RE = re.compile(r'^([A-Z][A-Za-z ]*):(?!//)\s*(.*)$')
+_LV2INFO_PORT_RE = re.compile(r'^Port (\d+):$')
+_LV2INFO_SCALE_POINT_RE = re.compile(r'^(\S+)\s*=\s*"(.*)"$')
+
+
+def parse_lv2info(output):
+    """
+    Parse lv2info output into an info dict (single pass over the lines).
+
+    >>> info = parse_lv2info('''http://x/amp
+    ...     Name:       Amp
+    ...     Class:      Amplifier
+    ...     Bundle:     file:///usr/lib/lv2/amp.lv2/
+    ...     Port 0:
+    ...         Type:       http://lv2plug.in/ns/lv2core#ControlPort
+    ...                     http://lv2plug.in/ns/lv2core#InputPort
+    ...         Symbol:     gain
+    ...         Name:       Gain
+    ...         Minimum:    0.000000
+    ...         Maximum:    1.000000
+    ...         Default:    0.500000
+    ...         Scale Points:
+    ...                     0.000000 = "Off"
+    ... ''')
+    >>> info['name'], info['bundle'], info['parameters']
+    ('Amp', '/usr/lib/lv2/amp.lv2/', [{'Gain': {'Symbol': 'gain', 'Minimum': 0.0, 'Maximum': 1.0, 'Default': 0.5}}])
+    >>> info['ports'][0]['scale_points']
+    [[0.0, 'Off']]
+    """
+    plugin = {'Name': '', 'Class': '', 'Bundle': None}
+    ports = []
+    port = None
+    key = None
+    port_types = []
+
+    for line in output.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        m = _LV2INFO_PORT_RE.match(line)
+        if m:
+            if port is not None:
+                _port_types(port, port_types)
+            port = _new_port(int(m.group(1)))
+            ports.append(port)
+            key, port_types = None, []
+            continue
+
+        m = _LV2INFO_KEY_RE.match(line)
+        if m:
+            key, value = m.group(1), m.group(2).strip()
+        else:
+            value = line  # continuation of previous key
+
+        if port is None:
+            if key in plugin and not plugin[key]:
+                plugin[key] = value
+            continue
+
+        if key == 'Type':
+            port_types.append(value)
+        elif key == 'Symbol':
+            port['symbol'] = value
+        elif key == 'Name':
+            port['name'] = value
+        elif key in ('Minimum', 'Maximum', 'Default'):
+            port[key.lower()] = float(value)
+        elif key == 'Properties' and value:
+            port['properties'].append(value)
+        elif key == 'Scale Points' and value:
+            sp = _LV2INFO_SCALE_POINT_RE.match(value)
+            if sp:
+                port['scale_points'].append([float(sp.group(1)), sp.group(2)])
+
+    if port is not None:
+        _port_types(port, port_types)
+
+    bundle = file_uri_to_path(plugin['Bundle']) if plugin['Bundle'] else None
+    return make_plugin_info(plugin['Name'], plugin['Class'], bundle, ports)
+
+
+class Lv2infoBackend:
+    """Runs lv2info and parses its text output"""
+    def load(self, uri):
+        try:
+            with get_metrics().time('lv2info'):
+                output = subprocess.check_output(['lv2info', uri]).decode('utf-8')
+        except subprocess.CalledProcessError:
+            raise PluginNotFound(uri)
+        return parse_lv2info(output)
+
+
+class MetadataChain:
+    """Tries a list of backends in order until one knows the plugin"""
+    def __init__(self, backends):
+        self._log = logging.getLogger('musicbox.MetadataChain')
+        self._backends = backends
+
+    def load(self, uri):
+        for backend in self._backends:
+            try:
+                info = backend.load(uri)
+            except PluginNotFound:
+                continue
+            except (OSError, ValueError) as e:
+                self._log.warning('{} failed for {}: {!s}'.format(type(backend).__name__, uri, e))
+                continue
+            info['backend'] = type(backend).__name__
+            return info
+        raise PluginNotFound(uri)
+
+
+def default_backend():
+    """lilv (if available), then TTL files, then lv2info as the last resort"""
+    backends = []
+    try:
+        backends.append(LilvBackend())
+    except ImportError:
+        pass
+    backends += [TtlBackend(), Lv2infoBackend()]
+    return MetadataChain(backends)
@@ -0,0 +1,145 @@
+import bisect
+import functools
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+BUCKETS_PER_DECADE = 4
+# Upper bounds of the histogram buckets in seconds: 10us to 10s (plus one overflow bucket)
+BOUNDS = tuple(1e-5 * 10 ** (i / BUCKETS_PER_DECADE) for i in range(6 * BUCKETS_PER_DECADE + 1))
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets (see BOUNDS). Recording a sample only
+    increments a counter (no allocation per sample, constant memory);
+    percentiles are the upper bound of the bucket they fall into (at most the
+    largest sample), i.e. they are precise to a factor of 10 ** (1 / BUCKETS_PER_DECADE).
+
+    >>> h = Histogram()
+    >>> for ms in (0.9, 0.9, 2, 50):
+    ...     h.record(ms / 1000)
+    >>> h.count, round(h.percentile(0.5) * 1000, 2), round(h.percentile(0.99) * 1000, 2)
+    (4, 1.0, 50.0)
+    """
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        i = bisect.bisect_left(BOUNDS, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, q):
+        """Estimated q-quantile (0 < q <= 1) in seconds, None without samples"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = max(1, int(q * self.count + 0.999999))
+            seen = 0
+            for i, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank:
+                    return min(BOUNDS[i], self.max) if i < len(BOUNDS) else self.max
+        return self.max
+
+    def summary(self):
+        """Count and mean/p50/p99/max in milliseconds"""
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 3)
+        return {'count': self.count, 'mean_ms': ms(self.total / self.count if self.count else None),
+                'p50_ms': ms(self.percentile(0.5)), 'p99_ms': ms(self.percentile(0.99)), 'max_ms': ms(self.max)}
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(BOUNDS) + 1)
+            self.count = 0
+            self.total = self.max = 0.0
+
+
+class Metrics:
+    """
+    Named latency histograms (created on first use).
+
+    >>> m = Metrics()
+    >>> handler = m.timed('cb_test', lambda uri: uri)
+    >>> handler('/test'), handler.__name__
+    ('/test', '<lambda>')
+    >>> with m.time('phase'):
+    ...     pass
+    >>> sorted(m.snapshot()), m.snapshot()['cb_test']['count']
+    (['cb_test', 'phase'], 1)
+    """
+    def __init__(self):
+        self._histograms = {}  # name -> Histogram
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram())
+        return histogram
+
+    def record(self, name, seconds):
+        self.histogram(name).record(seconds)
+
+    @contextmanager
+    def time(self, name):
+        histogram = self.histogram(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.record(time.perf_counter() - start)
+
+    def timed(self, name, func):
+        """Wrap func so that the duration of every call is recorded (also if it raises)"""
+        histogram = self.histogram(name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.record(time.perf_counter() - start)
+        return wrapper
+
+    def snapshot(self):
+        """{name: summary} of all histograms with samples"""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+        return {name: h.summary() for name, h in histograms if h.count}
+
+    def reset(self):
+        with self._lock:
+            histograms = list(self._histograms.values())
+        for h in histograms:
+            h.reset()
+
+    def __str__(self):
+        lines = ['{:<28} {:>7} {:>10} {:>10} {:>10} {:>10}'.format('latency', 'count', 'mean ms', 'p50 ms', 'p99 ms',
+                                                                   'max ms')]
+        for name, s in self.snapshot().items():
+            lines.append('{:<28} {:>7d} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                name, s['count'], s['mean_ms'], s['p50_ms'], s['p99_ms'], s['max_ms']))
+        return '\n'.join(lines)
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """Return the process-wide metrics"""
+    return _metrics
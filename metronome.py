@@ -1,48 +1,76 @@
-import subprocess
-import time
-
-from threading import Thread
+from supervisor import Helper
+from threading import Event, Thread
 from pythonosc import udp_client, dispatcher, osc_server
 
 
 class Metronome:
     PORT = 9959
 
-    def __init__(self):
+    def __init__(self, supervisor, serve_responses=True, ready=None):
         self._bpm = 120
-        subprocess.call(['killall', 'klick'])
-
-        # Start klick process in background
-        self._klick_process = subprocess.Popen(['klick', '-o', str(self.PORT), '-P'])
-        time.sleep(1)
-
+        self._volume = 0.5
         self._running = True
 
         # Communicate with klick via OSC
         self._klick_osc = udp_client.SimpleUDPClient('127.0.0.1', self.PORT)
 
-        # Set sensible default volume and max bpm
-        self._klick_osc.send_message('/klick/config/set_volume', 0.5)
-        self._klick_osc.send_message('/klick/simple/set_tempo_limit', 300)
+        # klick process is kept running by the supervisor, configured whenever it (re)started.
+        # Without a given readiness check klick is ready when it answers a ping (needs the response server).
+        self._pong = Event()
+        if ready is None and serve_responses:
+            ready = self.check_ready
+        self._supervisor = supervisor
+        self._helper = supervisor.add(Helper('klick', ['klick', '-o', str(self.PORT), '-P'], ready, self._configure))
 
-        # Start OSC server for receiving responses
+        # Start OSC server for receiving responses (unless served by someone else, e.g. AsyncRuntime)
         self._dispatcher = dispatcher.Dispatcher()
         self._dispatcher.map('/*', self._osc_response)
-        self._server = osc_server.ThreadingOSCUDPServer(('0.0.0.0', self.PORT + 1), self._dispatcher)
-        self._thread = Thread(target=self._server.serve_forever)
-        self._thread.start()
+        self._server = None
+        if serve_responses:
+            self._server = osc_server.ThreadingOSCUDPServer(('0.0.0.0', self.response_port), self._dispatcher)
+            self._thread = Thread(target=self._server.serve_forever)
+            self._thread.start()
+
+    @property
+    def dispatcher(self):
+        """OSC dispatcher handling responses from klick"""
+        return self._dispatcher
+
+    @property
+    def response_port(self):
+        return self.PORT + 1
+
+    @property
+    def helper(self):
+        """Supervised klick process"""
+        return self._helper
+
+    def _configure(self):
+        """Set sensible default volume and max bpm, restore tempo and state"""
+        self._pong.clear()  # a restarted klick has to answer a new ping
+        self._klick_osc.send_message('/klick/config/set_volume', self._volume)
+        self._klick_osc.send_message('/klick/simple/set_tempo_limit', 300)
+        self._klick_osc.send_message('/klick/simple/set_tempo', self._bpm)
+        self._klick_osc.send_message('/klick/metro/' + ('start' if self._running else 'stop'), [])
 
     def quit(self):
-        self._server.shutdown()
+        if self._server:
+            self._server.shutdown()
         self._klick_osc.send_message('/klick/quit', [])
-        self._klick_process.kill()
 
     def ping(self):
         self._klick_osc.send_message('/klick/ping', str(self.PORT + 1))
 
+    def check_ready(self):
+        """Readiness probe: True once klick answered a /klick/ping (sends a new ping otherwise)"""
+        if self._pong.is_set():
+            return True
+        self.ping()
+        return False
+
     def _osc_response(self, uri, *args):
         if uri == '/klick/pong':
-            pass
+            self._pong.set()
         elif uri == '/klick/simple/tempo':
             self._bpm = int(args[0])
 
@@ -77,4 +105,5 @@ class Metronome:
         self._klick_osc.send_message('/klick/metro/' + ('start' if enable else 'stop'), [])
 
     def set_volume(self, volume):
+        self._volume = volume
         self._klick_osc.send_message('/klick/config/set_volume', volume)
@@ -0,0 +1,136 @@
+import logging
+import queue
+import threading
+
+
+CONTROL_CHANGE = 0xB0
+LSB_OFFSET = 32  # controllers 32-63 are the LSBs of controllers 0-31
+
+
+def control_change(cc, value, channel=0):
+    """
+    MIDI message(s) for a control change. Values above 127 (e.g. BPM) are sent
+    as 14-bit controller: MSB on cc, LSB on cc + 32.
+
+    >>> control_change(1, 3)
+    [(176, 1, 3)]
+    >>> control_change(2, 200)
+    [(176, 2, 1), (176, 34, 72)]
+    """
+    status = CONTROL_CHANGE | (channel & 0x0f)
+    value = max(0, int(value))
+    if value < 0x80:
+        return [(status, cc, value)]
+    value = min(value, 0x3fff)
+    return [(status, cc, value >> 7), (status, cc + LSB_OFFSET, value & 0x7f)]
+
+
+class NullBackend:
+    """Records sent messages instead of sending them (no MIDI device, tests)"""
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+    def close(self):
+        pass
+
+
+class RtMidiBackend:
+    """Sends messages with an open RtMidiOut (e.g. the port MidiToOsc opened to the footpedal)"""
+    def __init__(self, midi_out):
+        from rtmidi import MidiMessage
+        self._midi_message = MidiMessage
+        self._out = midi_out
+
+    def send(self, message):
+        status, cc, value = message
+        self._out.sendMessage(self._midi_message.controllerEvent((status & 0x0f) + 1, cc, value))
+
+    def close(self):
+        pass
+
+
+class RawMidiBackend:
+    """
+    Writes to a raw MIDI device (e.g. /dev/snd/midiC1D0) or a virtual port's
+    byte stream. Uses running status: the status byte is left out if it is the
+    same as the one of the previous message.
+    """
+    def __init__(self, path):
+        self._file = open(path, 'wb', buffering=0)
+        self._status = None
+
+    def send(self, message):
+        if message[0] == self._status:
+            self._file.write(bytes(message[1:]))
+        else:
+            self._file.write(bytes(message))
+            self._status = message[0]
+
+    def close(self):
+        self._file.close()
+
+
+class MidiOutput:
+    """
+    Long-lived MIDI output for LED/BPM feedback to the footpedal.
+
+    control_change() only queues the message (thread-safe, doesn't block);
+    a worker thread sends it with the backend. Controller values equal to the
+    last value sent on the same controller are suppressed (see reset()).
+
+    >>> out = MidiOutput(NullBackend())
+    >>> out.control_change(1, 0); out.control_change(1, 0); out.control_change(1, 2)
+    >>> out.close()
+    >>> out.backend.sent, out.stats()
+    ([(176, 1, 0), (176, 1, 2)], {'sent': 2, 'suppressed': 1, 'failed': 0})
+    """
+    def __init__(self, backend):
+        self._log = logging.getLogger('musicbox.MidiOutput')
+        self.backend = backend
+        self._queue = queue.Queue()
+        self._last = {}  # (status, cc) -> last sent value
+        self.sent = self.suppressed = self.failed = 0
+        self._thread = threading.Thread(target=self._run, name='musicbox-midi-out', daemon=True)
+        self._thread.start()
+
+    def control_change(self, cc, value, channel=0):
+        for message in control_change(cc, value, channel):
+            self._queue.put(message)
+
+    def reset(self):
+        """Forget sent values, e.g. after the footpedal reconnected, so everything is sent again"""
+        self._queue.put('reset')
+
+    def stats(self):
+        return {'sent': self.sent, 'suppressed': self.suppressed, 'failed': self.failed}
+
+    def close(self):
+        """Send all queued messages and stop"""
+        self._queue.put(None)
+        self._thread.join()
+        self.backend.close()
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            if message == 'reset':
+                self._last = {}
+                continue
+
+            key = message[:2]
+            if self._last.get(key) == message[2]:
+                self.suppressed += 1
+                continue
+            try:
+                self.backend.send(message)
+            except Exception:
+                self.failed += 1
+                self._log.exception('Failed to send MIDI message {!r}'.format(message))
+                continue
+            self._last[key] = message[2]
+            self.sent += 1
@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from metrics import get_metrics
+
+
+RESPONSE_TIMEOUT = 5  # seconds to wait for all responses of a batch
+
+
+class ModHostBatchError(Exception):
+    def __init__(self, errors):
+        self.errors = errors  # list of (command, status)
+        Exception.__init__(self, '{:d} mod-host command(s) failed: {!s}'.format(len(errors), errors))
+
+
+def parse_responses(buf):
+    """
+    Split received bytes into complete mod-host responses (NUL-terminated
+    "resp <status>") and the remaining incomplete bytes.
+
+    >>> parse_responses(b'resp 0\\x00resp -1\\x00resp')
+    ([0, -1], b'resp')
+    """
+    *complete, rest = buf.split(b'\0')
+    statuses = []
+    for r in complete:
+        parts = r.decode('utf-8', 'replace').split()
+        statuses.append(int(parts[1]) if len(parts) >= 2 and parts[0] == 'resp' else -1)
+    return statuses, rest
+
+
+class ModHostTransport:
+    """
+    Replaces the send() of a pluginsmanager mod-host connection.
+
+    Outside of a batch every command is a blocking request/response round trip
+    (like the original connection). Inside `with transport.batch():` commands are
+    queued and sent to mod-host as one burst when the outermost batch ends.
+    The responses are collected by a reader thread; failed commands are raised
+    as ModHostBatchError when the batch is committed.
+    """
+    def __init__(self, connection):
+        self._log = logging.getLogger('musicbox.ModHostTransport')
+        self._socket = connection.client
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._queue = []  # queued commands of the current batch
+        self.round_trips = 0  # number of socket round trips (one per batch or unbatched command)
+        self._command_latency = get_metrics().histogram('modhost.command')
+        self._batch_latency = get_metrics().histogram('modhost.batch')
+
+    @classmethod
+    def install(cls, modhost):
+        """Wrap the command connection of a connected pluginsmanager ModHost"""
+        connection = modhost.host.connection
+        transport = cls(connection)
+        connection.send = transport.send
+        return transport
+
+    def send(self, message):
+        with self._lock:
+            if self._depth > 0:
+                self._queue.append(message)
+                return b'resp 0'  # real status is checked on commit
+            return self._send_now(message)
+
+    def _send_now(self, message):
+        start = time.perf_counter()
+        self._socket.sendall(self._encode(message))
+        buf = b''
+        while True:
+            statuses, buf = parse_responses(buf + self._socket.recv(1024))
+            if statuses:
+                self.round_trips += 1
+                self._command_latency.record(time.perf_counter() - start)
+                if statuses[0] < 0:
+                    self._log.error('mod-host command "{}" failed: {:d}'.format(message, statuses[0]))
+                return 'resp {:d}'.format(statuses[0]).encode()
+
+    @staticmethod
+    def _encode(message):
+        message = message.encode('utf-8') if isinstance(message, str) else message
+        return message if message.endswith(b'\0') else message + b'\0'
+
+    @contextmanager
+    def batch(self):
+        """Queue all commands sent within the block and send them as one burst at the end"""
+        with self._lock:
+            self._depth += 1
+            future = None
+            try:
+                yield self
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    # Also sent if the block raised: the pluginsmanager model has already been changed
+                    future = self.commit()
+            if future is not None:
+                future.result(RESPONSE_TIMEOUT)
+
+    def commit(self):
+        """
+        Send queued commands in one write. Returns a Future resolved by the reader
+        thread with the list of (command, status), or failing with ModHostBatchError.
+        """
+        with self._lock:
+            commands, self._queue = self._queue, []
+            future = Future()
+            if not commands:
+                future.set_result([])
+                return future
+
+            start = time.perf_counter()
+            reader = threading.Thread(target=self._read_responses, args=(commands, future), daemon=True)
+            reader.start()
+            self._socket.sendall(b''.join(self._encode(c) for c in commands))
+            self.round_trips += 1
+            self._log.debug('Sent batch of %d commands', len(commands))
+
+            # Don't send anything else before all responses of this batch are read
+            reader.join(RESPONSE_TIMEOUT)
+            self._batch_latency.record(time.perf_counter() - start)
+            if reader.is_alive():
+                future.set_exception(TimeoutError('mod-host did not answer all {:d} commands'.format(len(commands))))
+        return future
+
+    def _read_responses(self, commands, future):
+        statuses, buf = [], b''
+        try:
+            while len(statuses) < len(commands):
+                data = self._socket.recv(4096)
+                if not data:
+                    raise ConnectionError('mod-host closed the connection')
+                new_statuses, buf = parse_responses(buf + data)
+                statuses += new_statuses
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        results = list(zip(commands, statuses))
+        errors = [(c, s) for c, s in results if s < 0]
+        if future.done():
+            return
+        if errors:
+            future.set_exception(ModHostBatchError(errors))
+        else:
+            future.set_result(results)
@@ -1,36 +1,74 @@
+import argparse
 import enum
 import json
 import logging
 import time
-import yaml
 
-from footpedal import MidiToOsc
+from async_runtime import AsyncRuntime
+from automation import AutomationEngine
+from control_scheduler import CoalescingScheduler
+from footpedal import MidiToOsc, load_cc_map
+from jack_connections import JackConnectionManager
+from log_pipeline import get_pipeline, install_pipeline
 from looper import Looper
+from metrics import get_metrics
 from metronome import Metronome
-from midisend import midisend
-from notifier import TcpNotifier
+from midi_out import MidiOutput, NullBackend, RtMidiBackend
+from modhost_transport import ModHostTransport
+from notifier import AsyncTcpNotifier, LEGACY, TcpNotifier
+from osc_record import OscRecorder
 from osc_server import FootpedalOscServer
-from pedalboard_graph import PedalboardGraph
-from plugin import Lv2Plugin
+from plugin import get_plugin_cache
+from preset import build_graph, read_preset_file
+from preset_bundle import load_bundle
+from preset_library import PresetLibrary, index_banks
+from preset_watcher import PresetWatcher
+from preset_switch import PresetSwitcher, SYSTEM
+from startup import PhaseTimer, StartupOrchestrator, probe_jack, probe_tcp
+from state_model import ENCODINGS, StateModel, encode
+from supervisor import Supervisor
 
 from pluginsmanager.banks_manager import BanksManager
 from pluginsmanager.observer.mod_host.mod_host import ModHost  # TODO: add other observers
-from pluginsmanager.model.bank import Bank
 from pluginsmanager.model.pedalboard import Pedalboard
 from pluginsmanager.model.lv2.lv2_effect_builder import Lv2EffectBuilder
 from pluginsmanager.model.system.system_effect import SystemEffect
 
 
-logger = logging.getLogger('musicbox')
-logger.setLevel(logging.DEBUG)
-filehandler = logging.FileHandler('/var/log/musicbox.log')
-filehandler.setLevel(logging.DEBUG)
-filehandler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-logger.addHandler(filehandler)
-con_handler = logging.StreamHandler()
-con_handler.setLevel(logging.DEBUG)
-con_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-logger.addHandler(con_handler)
+LOG_FILE = '/var/log/musicbox.log'
+LOG_LINES = 50  # log lines sent for /log
+PRESET_CACHE_BUDGET = 64  # max. plugin instances of all built presets kept in memory
+PRESET_PREFETCH = 1  # neighbours (on each side) of the active preset built in the background
+MODHOST_PORT = 5555
+SLIDER_CONTROL_RATE = 30  # Hz, rate at which slider changes are sent to mod-host/klick
+STATE_DELTA_RATE = 30  # Hz, rate at which state deltas are sent to display clients
+AUTOMATION_CONTROL_RATE = 30  # Hz, rate at which automated parameters (LFOs, ramps, envelopes) are updated
+
+# JACK connections of sooperlooper (only connected in looper mode, mod-host connections are made by pluginsmanager)
+LOOPER_PORTS = ('sooperlooper:loop0_in_1', 'sooperlooper:loop0_out_1')
+LOOPER_ROUTES = {('system:capture_1', 'sooperlooper:loop0_in_1'), ('sooperlooper:loop0_out_1', 'system:playback_1')}
+
+
+def setup_logging(filename=LOG_FILE, synchronous=False):
+    """
+    Log everything to a file and the console (not done on import, e.g. by the benchmarks).
+    Unless synchronous, records are formatted and written by a background thread
+    (see log_pipeline), so slow writes (SD card) never delay the input handlers.
+    """
+    logger = logging.getLogger('musicbox')
+    logger.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    filehandler = logging.FileHandler(filename)
+    filehandler.setLevel(logging.DEBUG)
+    filehandler.setFormatter(formatter)
+    con_handler = logging.StreamHandler()
+    con_handler.setLevel(logging.DEBUG)
+    con_handler.setFormatter(formatter)
+    if synchronous:
+        logger.addHandler(filehandler)
+        logger.addHandler(con_handler)
+    else:
+        install_pipeline(logger, [filehandler, con_handler]).setFormatter(formatter)
 
 
 class Mode(enum.Enum):
@@ -43,62 +81,192 @@ class Mode(enum.Enum):
 class MusicBox:
     OSC_MODES = {'preset': Mode.PRESET, 'stomp': Mode.STOMP, 'looper': Mode.LOOPER, 'metronome': Mode.METRONOME}
 
-    def __init__(self):
+    def __init__(self, runtime=None, stats_file=None, record_file=None):
         self._log = logging.getLogger('musicbox.MusicBox')
+        self._runtime = runtime  # AsyncRuntime, or None for thread based servers
+        self._stats_file = stats_file  # JSON file the statistics are written to on shutdown
+        metrics = get_metrics()
 
         # Internal attributes
         self._selected_stompbox = 1  # 0 = global parameters, 1-8 = actual stompboxes
         self._current_mode = Mode.PRESET
-        self._last_slider_update_time = 0
 
-        # OSC inputs (footpedal)
-        try:
-            self._midi_to_osc = MidiToOsc('Arduino Micro')  # works via callbacks, so not blocking
-        except ValueError as e:
-            self._log.error('Failed to start Midi Footpedal: ' + str(e))
-
-        # OSC server (receives inputs)
-        self._osc_server = FootpedalOscServer(self.cb_mode, self.cb_preset, self.cb_stomp,
-                                              self.cb_looper, self.cb_metronome, self.cb_slider)
-
-        # mod-host LV2 host (output)
+        # Slider values are coalesced per (mode, slider) and applied at a fixed control rate
+        self._slider_scheduler = CoalescingScheduler(metrics.timed('apply_slider', self._apply_slider),
+                                                     rate=SLIDER_CONTROL_RATE)
+
+        # Parameter automation (LFOs, ramps, envelopes), tempo-synced shapes follow the metronome
+        self._automation = AutomationEngine(metrics.timed('automation.apply', self._apply_automation),
+                                            tempo=lambda: self._metronome.bpm, rate=AUTOMATION_CONTROL_RATE)
+
+        # State shown by display clients (versioned snapshot + deltas)
+        self._state = StateModel(self._publish_state_delta, rate=STATE_DELTA_RATE)
+
+        # OSC server (receives inputs from remote controllers), with AsyncRuntime all handlers run serialized in arrival order.
+        # The duration of every handler call is recorded (metrics "cb_*").
+        callbacks = [self.cb_mode, self.cb_preset, self.cb_stomp_enable, self.cb_looper, self.cb_metronome, self.cb_slider,
+                     self.cb_bank, self.cb_stats, self.cb_log, self.cb_automation]
+        callbacks = [metrics.timed(cb.__name__, cb) for cb in callbacks]
+        if self._runtime:
+            callbacks = [self._runtime.serialized(cb) for cb in callbacks]
+        self._osc_server = FootpedalOscServer(*callbacks)
+        if record_file:  # log of all OSC inputs, for replaying them (see osc_record)
+            self._osc_server.recorder = OscRecorder(record_file)
+
+        # mod-host LV2 host (output), connected once mod-host is ready
         self._banks_manager = BanksManager()
-        self._banks_manager.append(Bank('Bank 1'))  # TODO: load banks from stored files
-        self._modhost = ModHost('localhost')
-        self._modhost.connect()
-        self._banks_manager.register(self._modhost)
+        self._modhost = None
         self._pedalboard = None
-        self._log.info("STARTED mod-host client")
 
-        # Metronome output (using klick)
-        self._metronome = Metronome()
-        self._log.info("STARTED Metronome")
+        # Presets are indexed on disk and only built when used (see PresetLibrary)
+        self._bank = 0  # selected bank
+        self._preset_bundle = {}  # filename -> compiled preset (see preset_bundle)
+        self._presets = PresetLibrary(index_banks(), metrics.timed('preset.build', self._build_preset),
+                                      PRESET_CACHE_BUDGET, PRESET_PREFETCH)
+        self._preset_watcher = PresetWatcher(self._presets.filenames(), self._on_preset_file_changed)
+
+        # Set up by the startup components
+        self._midi_to_osc = None
+        self._midi_out = MidiOutput(NullBackend())
+        self._jack = None
+
+        # Helper processes (klick, sooperlooper) are kept running by the supervisor, ready when their JACK ports exist
+        self._supervisor = Supervisor()
+
+        # Metronome output (using klick), ready when it answers a ping (unless its responses are served by AsyncRuntime)
+        self._metronome = Metronome(self._supervisor, serve_responses=self._runtime is None,
+                                    ready=self._jack_client_ready('klick') if self._runtime else None)
 
         # Looper object (using sooperlooper)
-        self._looper = Looper()
-        self._log.info("STARTED Looper")
+        self._looper = Looper(self._supervisor, ready=self._jack_client_ready('sooperlooper'))
 
         # Notifiers
-        self._notifier = TcpNotifier()
+        if self._runtime:
+            self._notifier = AsyncTcpNotifier(self._runtime.loop)
+            self._runtime.add_startup(self._notifier.start())
+        else:
+            self._notifier = TcpNotifier()
+        self._notifier.on_subscribe = self._notifier_snapshot
         self._log.info("STARTED TcpNotifier")
 
-        # Initialize: set mode PRESET and load preset1
-        time.sleep(2)
+        # Start everything depending on other processes concurrently, each part as soon as
+        # what it needs is ready (instead of fixed sleeps). "presets" ready = first sound.
+        helpers = (self._metronome.helper, self._looper.helper)
+        startup = StartupOrchestrator()
+        startup.add('footpedal', start=self._start_footpedal, required=False)
+        startup.add('jack', probe=probe_jack())
+        startup.add('jack connections', start=self._start_jack_connections, after=['jack'])
+        startup.add('mod-host', probe=probe_tcp('localhost', MODHOST_PORT, b'cpu_load\0', b'resp'), after=['jack'])
+        startup.add('presets', start=self._start_modhost, after=['mod-host'])
+        startup.add('helpers', start=self._supervisor.start, probe=lambda: all(h.is_ready for h in helpers),
+                    after=['jack connections'], required=False)
+        startup.run()
+
+        # Initialize: set mode PRESET
         self._set_mode(Mode.PRESET)
-        for preset_id in range(4):
-            self._load_preset('preset{:02d}.yaml'.format(preset_id))
+        if self._runtime:
+            self._runtime.call_every(self._slider_scheduler.interval, self._slider_scheduler.tick)
+            self._runtime.call_every(self._state.interval, self._state.tick)
+            self._runtime.call_every(self._automation.interval, self._automation.tick)
+        else:
+            self._slider_scheduler.start()
+            self._automation.start()
+            self._state.start()
+        self._preset_watcher.start()
+
+    def _start_footpedal(self):
+        """Footpedal: MIDI events are dispatched to the input handlers directly (not via OSC),
+        MIDI output (feedback to the footpedal) uses the same port"""
+        try:
+            config = load_cc_map()
+            self._midi_to_osc = MidiToOsc(config['controller'], config, resolve=self._osc_server.resolve)
+            self._midi_out = MidiOutput(RtMidiBackend(self._midi_to_osc.midi_out))
+        except ValueError as e:
+            self._log.error('Failed to start Midi Footpedal: ' + str(e))
+
+    def _start_jack_connections(self):
+        """JACK connections (in-process client), optional"""
+        try:
+            self._jack = JackConnectionManager()
+        except Exception as e:
+            self._log.error('Failed to start JACK connection manager: ' + str(e))
+
+    def _start_modhost(self):
+        """Connect to mod-host and load the presets"""
+        self._modhost = ModHost('localhost', MODHOST_PORT)
+        self._modhost.connect()
+        self._modhost_transport = ModHostTransport.install(self._modhost)
+        self._banks_manager.register(self._modhost)
+        self._preset_switcher = PresetSwitcher(self._banks_manager, self._modhost, self._modhost_transport)
+        self._log.info("STARTED mod-host client")
+        self._load_presets()
+
+    def _jack_client_ready(self, client):
+        """Readiness check of a helper: JACK client has registered its ports (always ready without JACK connection manager)"""
+        prefix = client + ':'
+        return lambda: self._jack is None or any(port.startswith(prefix) for port in self._jack.ports)
 
     def run(self):
+        if self._runtime:
+            return self._run_async()
+
         try:
             self._osc_server.start()
             self._osc_server._thread.join()
         except KeyboardInterrupt:
             self._log.warn('KeyboardInterrupt: shutting down')
             self._osc_server.stop()
-            self._notifier.close()
+            self._shutdown()
+
+    def _run_async(self):
+        """Serve OSC inputs and klick responses on the AsyncRuntime event loop"""
+        self._runtime.add_osc_server(self._osc_server.dispatcher, self._osc_server.port)
+        self._runtime.add_osc_server(self._metronome.dispatcher, self._metronome.response_port)
+        self._osc_server.on_stop = self._runtime.stop
+        try:
+            self._runtime.run()
+        except KeyboardInterrupt:
+            self._log.warn('KeyboardInterrupt: shutting down')
+        self._shutdown()
+
+    def _shutdown(self):
+        if isinstance(self._osc_server.recorder, OscRecorder):
+            self._osc_server.recorder.close()
+        self._preset_watcher.stop()
+        self._presets.close()
+        self._log.info('Preset stats: {!s}'.format(self._presets.stats()))
+        self._slider_scheduler.stop()
+        self._log.info('Slider stats: {!s}'.format(self._slider_scheduler.stats()))
+        self._automation.stop()
+        self._log.info('Automation stats: {!s}'.format(self._automation.stats()))
+        self._state.stop()
+        self._notifier.close()
+        self._midi_out.close()
+        self._log.info('MIDI output stats: {!s}'.format(self._midi_out.stats()))
+        self._supervisor.stop()
+        self._log.info('Helper stats: {!s}'.format(self._supervisor.stats()))
+        if self._jack:
+            self._jack.close()
+        self._log.info('Latency stats:\n{!s}'.format(get_metrics()))
+        if self._stats_file:
+            with open(self._stats_file, 'w') as f:
+                json.dump(self._stats(), f, indent=2)
+
+    def _stats(self):
+        """Latency histograms and the statistics of the components"""
+        return {
+            'latency': get_metrics().snapshot(),
+            'presets': self._presets.stats(),
+            'slider': self._slider_scheduler.stats(),
+            'automation': self._automation.stats(),
+            'midi_out': self._midi_out.stats(),
+            'helpers': self._supervisor.stats(),
+            'osc': self._osc_server.routes.stats(),
+            'log': get_pipeline().stats() if get_pipeline() else None,
+        }
 
     def _set_mode(self, mode):
-        midisend(1, mode.value)
+        self._midi_out.control_change(1, mode.value)
 
         # Action when leaving mode
         if mode != Mode.LOOPER:
@@ -110,150 +278,184 @@ class MusicBox:
         if mode == Mode.PRESET:
             pass
         elif mode == Mode.STOMP:
-            self._activate_preset(0)  # special preset 0 = stompbox mode
+            self._activate_preset(0, bank=0)  # special preset 0 of the default bank = stompbox mode
         elif mode == Mode.LOOPER:
             self._looper.enable(True)
         elif mode == Mode.METRONOME:
             self._metronome.enable(True)
 
+        # Route audio to sooperlooper in looper mode (connections are made once its ports exist)
+        if self._jack:
+            self._jack.reconcile(LOOPER_ROUTES if mode == Mode.LOOPER else set(), managed=LOOPER_PORTS)
+
         self._current_mode = mode
+        if self._midi_to_osc:
+            self._midi_to_osc.mode = mode.name.lower()  # footpedal CC map layer
 
         self._notifier.update("MODE:{:d}".format(int(self._current_mode.value)))
-
-    def _create_graph_from_config(self, filename):
+        self._state.set_mode(int(self._current_mode.value))
+
+    def _publish_state_delta(self, version, changes):
+        """Called by the state model with all changes since the last delta"""
+        self._notifier.publish({enc: lambda enc=enc: encode('DELTA', version, changes, enc) for enc in ENCODINGS})
+
+    def _notifier_snapshot(self, channel):
+        """Messages describing the current state for a client subscribing to a notifier channel"""
+        if channel in ENCODINGS:
+            return [self._state.snapshot(channel)]
+        if channel != LEGACY:
+            return None
+
+        state = self._state.state()
+        messages = []
+        if state['mode'] is not None:
+            messages.append("MODE:{:d}".format(state['mode']))
+        if state['bpm'] is not None:
+            messages.append("BPM:{:d}".format(state['bpm']))
+        if state['preset'] is not None:
+            messages.append("PRESET:" + json.dumps(state['preset']))
+            for i, sb in enumerate(state['preset']['stompboxes']):
+                messages.append("STOMPEN:{:d}:{:d}".format(i, sb['enabled']))
+        if state['sel'] is not None:
+            messages.append("STOMPSEL:{:d}".format(state['sel']))
+        return messages
+
+    def _load_presets(self):
         """
-        Loads a YAML file (could easily support JSON as well) and creates
-        a graph for defined plugins and connections. Also returns
-        other settings separately.
+        Loads the compiled preset bundle if it is up to date (otherwise presets
+        are read from their files when built) and builds the stompbox mode preset.
         """
-        with open(filename, 'r') as f:
-            data = yaml.safe_load(f)
-
-        settings = {
-            'name': data['preset']['name'],
-            'author': data['preset']['author'],
-            'global_parameters': data['preset']['global_parameters']
-        }
-
-        self._log.debug('yaml preset data: ' + str(data['preset']))
-
-        plugins = [Lv2Plugin(sb['lv2'], sb['connections']) for sb in data['preset']['stompboxes']]
-        pb = PedalboardGraph(plugins)
-
-        # Disable stompboxes if configured
-        for i, sb in enumerate(data['preset']['stompboxes']):
-            if 'enabled' in sb:
-                plugins[i].is_enabled = sb['enabled']
-
-        # Assign index to each node
-        for p in pb.nodes:
-            p._index = pb.get_index(p)
-
-        # Add graph edges (connections between effects as index to node - mod_host module will do conversion to "effect_:in" string)
-        for p in pb.nodes:
-            self._log.debug('Adding edges {!s} for node {!s}'.format(p._connections, p))
-            pb.add_edges(p, p._connections)
-
-        self._log.debug("Graph with edges:\n" + str(pb))
-        pb.settings = settings
-        return pb
-
-    def _activate_preset(self, preset_id):
-        # Store current pedalboard in attribute
-        self._pedalboard = self._banks_manager.banks[0].pedalboards[preset_id]
-
-        # Load new pedalboard into mod-host
-        self._modhost.pedalboard = self._pedalboard
-        self._log.info('Activated pedalboard {!s}'.format(self._pedalboard))
+        timer = PhaseTimer('startup')
+
+        with timer.phase('load preset bundle'):
+            bundle = load_bundle(self._presets.filenames())
+        if bundle is not None:
+            get_plugin_cache().preload(bundle['plugins'])
+            self._preset_bundle = {preset['filename']: preset for preset in bundle['presets']}
+
+        with timer.phase('build first preset'):
+            self._presets.get(0, 0)
+        self._presets.prefetch(0, 0)
+        timer.log()
+
+    def _build_preset(self, filename):
+        """Build the pedalboard of a preset file (called by the preset library on first use)"""
+        preset = self._preset_bundle.get(filename)
+        if preset is not None:
+            pedalboard = self._load_preset(filename, preset['data'], preset['plan'], preset['param_values'])
+        else:
+            pedalboard = self._load_preset(filename)
+        get_plugin_cache().save()  # persist newly introspected plugins for next boot
+        return pedalboard
+
+    def _activate_preset(self, preset_id, bank=None):
+        # Preset pedalboard from the bank (built if it isn't cached)
+        bank = self._bank if bank is None else bank
+        pedalboard = self._presets.activate(bank, preset_id)
+        self._automation.clear()  # automation targets are stompboxes of the previous preset
+
+        # Change the live pedalboard in mod-host to match the new preset
+        diff = self._preset_switcher.switch(pedalboard.graph)
+        get_metrics().record('preset.switch', self._preset_switcher.last_switch_time)
+        self._pedalboard = pedalboard
+        self._log.info('Activated pedalboard %s (%d changes in %.1fms)',
+                       self._pedalboard, diff.size, self._preset_switcher.last_switch_time * 1000)
 
         # Notifications
         self._preset_info_notifier_update(preset_id)
 
-        for e in self._pedalboard.effects:
-            e.toggle()
-            self._notifier.update("STOMPEN:{:d}:{:d}".format(e.index, int(e.active)))
-
-    def _load_preset(self, yaml_file, remove_previous=False):
-        # Create graph with effect plugin objects
-        graph = self._create_graph_from_config(yaml_file)
+        for node in self._pedalboard.graph.nodes:
+            self._notifier.update("STOMPEN:{:d}:{:d}".format(node.index, node.is_enabled))
 
-        # Cleanup existing pedalboard in mod-host
-        if remove_previous and self._pedalboard is not None:
-            for e in list(self._pedalboard.effects):
-                for c in list(e.connections):
-                    self._pedalboard.disconnect(c.output, c.input)
-                self._pedalboard.effects.remove(e)
-            self._banks_manager.banks[0] = []
-            del self._pedalboard
+    def _load_preset(self, yaml_file, data=None, plan=None, param_values=None):
+        # Create graph with effect plugin objects (precomputed connection plan and parameter values from the preset bundle)
+        graph = build_graph(data if data is not None else read_preset_file(yaml_file), plan)
+        return self._create_pedalboard(graph, param_values)
 
-        # Create PedalPi pedalboard and add to bank and mod-host
+    def _create_pedalboard(self, graph, param_values=None):
+        """Create PedalPi pedalboard for graph (not added to mod-host, see PresetSwitcher)"""
         pedalboard = Pedalboard(graph.settings['name'])
         pedalboard.graph = graph
-        self._banks_manager.banks[0].append(pedalboard)
 
-        # Add nodes (effects) to mod-host
+        # Add nodes (effects) to the pedalboard, their parameter values are the
+        # initial values of the preset (the live effects in mod-host are managed by PresetSwitcher)
         lv2_builder = Lv2EffectBuilder()
-        for node in graph.nodes:  # loop over Plugin objects
-            self._log.info("mod-host: add effect " + str(node))
-            node.effect = lv2_builder.build(node.uri)
-            pedalboard.effects.append(node.effect)
+        for i, node in enumerate(graph.nodes):  # loop over Plugin objects
+            self._log.info("pedalboard: add effect %s", node)
+            effect = lv2_builder.build(node.uri)
+            pedalboard.effects.append(effect)
+            node.param_values = param_values[i] if param_values else [p.value for p in effect.params]
 
         sys_effect = SystemEffect('system', ['capture_1', 'capture_2'], ['playback_1', 'playback_2'])
 
-        # Connect system capture to first effect
-        pedalboard.connect(sys_effect.outputs[0], pedalboard.effects[0].inputs[0])
-
-        # Add edges (connections) to mod-host
-        for node in graph.nodes:  # looper over Plugin objects
-            incoming = graph.get_incoming_edges(node)
-            outgoing = graph.get_outgoing_edges(node)
-            self._log.info('mod-host: add connection {!s} -> [{:d}] "{:s}" -> {!s}'.format(incoming, node.index, node.name, outgoing))
-
-            # Go through outgoing edges (indices)
-            for e in outgoing:  # loop over edge indices
-                # Connect current effect to effect given by index e
-                neighbor = graph.get_node_from_index(e)
-                if node.has_stereo_output and neighbor.has_stereo_input:  # stereo to stereo
-                    pedalboard.connect(node.effect.outputs[0], neighbor.effect.inputs[0])
-                    pedalboard.connect(node.effect.outputs[1], neighbor.effect.inputs[1])
-                elif not node.has_stereo_output and neighbor.has_stereo_input:  # split mono to stereo
-                    pedalboard.connect(node.effect.outputs[0], neighbor.effect.inputs[0])
-                    pedalboard.connect(node.effect.outputs[0], neighbor.effect.inputs[1])
-                elif node.has_stereo_output and not neighbor.has_stereo_input:  # sum stereo to mono
-                    pedalboard.connect(node.effect.outputs[0], neighbor.effect.inputs[0])
-                    pedalboard.connect(node.effect.outputs[1], neighbor.effect.inputs[0])
-                else:  # mono to mono
-                    pedalboard.connect(node.effect.outputs[0], neighbor.effect.inputs[0])
-
-            if outgoing == []:
-                left_output = node.effect.outputs[0]
-                right_output = node.effect.outputs[1 if node.has_stereo_output else 0]
-                pedalboard.connect(left_output, sys_effect.inputs[0])
-                pedalboard.connect(right_output, sys_effect.inputs[1])
+        # Add edges (connections)
+        for (src, out_idx), (dst, in_idx) in graph.plan:
+            output = sys_effect.outputs[out_idx] if src == SYSTEM else pedalboard.effects[src].outputs[out_idx]
+            input_ = sys_effect.inputs[in_idx] if dst == SYSTEM else pedalboard.effects[dst].inputs[in_idx]
+            pedalboard.connect(output, input_)
+        return pedalboard
+
+    def _on_preset_file_changed(self, filename):
+        """Called by the preset watcher (own thread)"""
+        if self._runtime:
+            self._runtime.submit(self._reload_preset, filename)
+        else:
+            self._reload_preset(filename)
 
-    def _handle_slider_stompbox(self, slider_id, value):
-        stompbox = self._pedalboard.graph.nodes[self._selected_stompbox - 1]  # select by index from list of Plugin objects
-        param_name, param_info = stompbox.get_parameter_info_by_index(slider_id - 1)
-        if param_name is None:
-            self._log.info('{!s} has no parameter for slider {:d}'.format(stompbox, slider_id))
+    def _reload_preset(self, filename):
+        """
+        Re-read a changed preset file and replace its pedalboard. Stompboxes that
+        are still the same plugin at the same position keep their current parameter
+        values (and enable state unless the file sets it). If it is the active
+        preset, only the differences are applied to mod-host (see PresetSwitcher).
+        """
+        start = time.monotonic()
+        self._preset_bundle.pop(filename, None)  # compiled version is outdated
+        old = self._presets.cached(filename)
+        if old is None:
+            self._log.info('{} changed (not built yet, nothing to reload)'.format(filename))
+            return
+        bank, position = self._presets.locate(filename)
+        active = self._pedalboard is old
+        try:
+            data = read_preset_file(filename)
+            graph = build_graph(data)
+        except Exception as e:
+            self._log.error('Not reloading {}: {!s}'.format(filename, e))
             return
 
-        self._log.debug('{:s} param_info {!s}'.format(param_name, param_info))
+        self._presets.replace(filename, self._create_pedalboard(graph))
+        for i, node in enumerate(graph.nodes):
+            if i < len(old.graph.nodes) and old.graph.nodes[i].uri == node.uri:
+                previous = old.graph.nodes[i]
+                node.param_values = [p.value for p in previous.effect.params] if active else previous.param_values
+                if 'enabled' not in data['preset']['stompboxes'][i]:
+                    node.is_enabled = previous.is_enabled
+
+        if active:
+            self._activate_preset(position, bank)
+        self._log.info('Reloaded {} ({}) in {:.1f}ms'.format(
+            filename, 'active, applied live' if active else 'inactive', (time.monotonic() - start) * 1000))
+
+    def _handle_slider_stompbox(self, slider_id, value):
+        stompbox = self._pedalboard.graph.nodes[self._selected_stompbox - 1]  # select by index from list of Plugin objects
 
-        # Convert slider value (0-1023) to parameters (min, max) range
-        min_max_ratio = 1024 / (param_info['Maximum'] - param_info['Minimum'])
-        value /= min_max_ratio
-        value += param_info['Minimum']
+        # Convert slider value (0-1023) to parameter value using the compiled control map
+        mapped = stompbox.control_map.map(slider_id, value)
+        if mapped is None:
+            self._log.info('%s has no parameter for slider %d', stompbox, slider_id)
+            return
 
-        self._log.info('Setting stomp #{:d} param #{:d} "{:s}" [{:s}] to {} (ratio {})'.format(self._selected_stompbox, slider_id, param_name, param_info['Symbol'], value, min_max_ratio))
-        stompbox.effect.params[slider_id - 1].value = value
+        param_index, value = mapped
+        self._automation.clear((self._selected_stompbox - 1, param_index))  # the slider takes over
+        self._log.debug('Setting stomp #%d param #%d to %f', self._selected_stompbox, param_index, value)
+        stompbox.effect.params[param_index].value = value
         self._notifier.update("SLIDER:{:d}:{:f}".format(slider_id - 1, value))
+        self._state.set_param(self._selected_stompbox - 1, param_index, value)
 
-    def cb_mode(self, uri, msg=None):
-        """Handle incoming /mode/... OSC message"""
-        mode = uri.rsplit('/', 1)[-1]
-        assert mode in self.OSC_MODES.keys()
-        self._log.info("MODE {} -> {}".format(mode, self.OSC_MODES[mode]))
+    def cb_mode(self, mode):
+        """Handle incoming /mode/<mode> OSC message"""
+        self._log.info("MODE %s -> %s", mode, self.OSC_MODES[mode])
         self._set_mode(self.OSC_MODES[mode])
 
     def _preset_info_notifier_update(self, preset_id):
@@ -269,6 +471,7 @@ class MusicBox:
         for sb in self._pedalboard.graph.nodes:
             sb_data = {
                 'name': sb.name,
+                'enabled': sb.is_enabled,
                 'parameters': []
             }
 
@@ -288,50 +491,71 @@ class MusicBox:
 
             notifier_data['stompboxes'].append(sb_data)
 
-        self._log.debug("Sending JSON: " + json.dumps(notifier_data))
-        self._notifier.update("PRESET:" + json.dumps(notifier_data))
+        # Serialized once for the legacy clients, versioned clients get it as part of the next delta
+        payload = json.dumps(notifier_data)
+        self._log.debug('Sending preset %d (%d stompboxes, %d bytes)', preset_id, len(notifier_data['stompboxes']),
+                        len(payload))
+        self._notifier.update("PRESET:" + payload)
+        self._state.set_preset(notifier_data)
 
-    def cb_preset(self, uri, msg=None):
+    def cb_preset(self, preset_id):
         """Handle incoming /preset/<N> OSC message"""
-        preset_id = int(uri.rsplit('/', 1)[-1])
-        assert 0 < preset_id < 100
-        self._log.info("PRESET {:d}".format(preset_id))
+        # Preset 0 of the default bank is the stompbox mode preset
+        if not (0 < preset_id or self._bank > 0) or preset_id >= self._presets.bank_size(self._bank):
+            raise ValueError('No preset {:d} in bank {:d}'.format(preset_id, self._bank))
+        self._log.info("PRESET %d", preset_id)
         self._activate_preset(preset_id)
 
-    def cb_stomp_enable(self, uri, msg=None):
-        """Handle incoming /stomp/<N>/enable OSC message"""
-        uri_splits = uri.split('/')[2:]  # throw away leading "/" and "stomp"
-        assert 2 <= len(uri_splits) <= 3, uri_splits
-        stomp_id = int(uri_splits[0])
-        op = uri_splits[1]
-        value = int(uri_splits[2]) if len(uri_splits) == 3 else None
-
-        self._log.debug('cb_stomp_{}: {:d} (value {!s})'.format(op, stomp_id, value))
-        assert 0 < stomp_id < 10
-        assert op in ['enable', 'select']
+    def cb_bank(self, bank):
+        """Handle incoming /bank/<N>, /bank/next and /bank/prev OSC messages"""
+        if bank in ('next', 'prev'):
+            bank = (self._bank + (1 if bank == 'next' else -1)) % len(self._presets.banks)
+        elif not 0 <= bank < len(self._presets.banks):
+            raise ValueError('No bank {:d}'.format(bank))
+        self._bank = bank
+        self._log.info('BANK %d "%s"', bank, self._presets.banks[bank][0])
+        self._presets.prefetch(bank, 0)  # first presets of the bank
+        self._notifier.update("BANK:{:d}".format(bank))
+
+    def cb_stats(self):
+        """Handle incoming /stats OSC message: statistics are sent to the notifier clients"""
+        self._notifier.update("STATS:" + json.dumps(self._stats()))
+
+    def cb_log(self, count=LOG_LINES):
+        """Handle incoming /log[/<N>] OSC message: the latest log lines are sent to the notifier clients"""
+        pipeline = get_pipeline()
+        if pipeline is None:
+            raise ValueError('No log buffer (synchronous logging)')
+        self._notifier.update("LOG:" + json.dumps(pipeline.lines(count)))
+
+    def cb_stomp_enable(self, stomp_id, op, value=None):
+        """Handle incoming /stomp/<N>/enable[/<0|1>] and /stomp/<N>/select OSC messages"""
+        self._log.debug('cb_stomp_%s: %d (value %s)', op, stomp_id, value)
 
         if op == 'select':
             self._selected_stompbox = stomp_id
             self._notifier.update("STOMPSEL:{:d}".format(self._selected_stompbox - 1))
+            self._state.set_selected(self._selected_stompbox - 1)
         elif op == 'enable':
-            assert self._pedalboard
+            if not self._pedalboard:
+                raise ValueError('No active preset')
             p = self._pedalboard.graph.get_node_from_index(stomp_id - 1)
             if p:
-                assert p.index == stomp_id - 1
                 if value is None:  # no value given: toggle internal state
                     p.is_enabled = not p.is_enabled
                 else:
                     p.is_enabled = bool(value)
 
-                self._log.info('STOMP {} "{}" ENABLE {:d}'.format(p.index, p.name, p.is_enabled))
-                p.effect.active = True if not p.is_enabled else False
+                self._log.info('STOMP %d "%s" ENABLE %d', p.index, p.name, p.is_enabled)
+                with get_metrics().time('stomp.toggle'):  # until mod-host answered the bypass command
+                    p.effect.active = True if not p.is_enabled else False
                 self._notifier.update("STOMPEN:{:d}:{:d}".format(p.index, p.is_enabled))
+                self._state.set_enabled(p.index, p.is_enabled)
             else:
-                self._log.warn('cb_stomp_enable: node with index {:d} not in pedalboard'.format(stomp_id - 1))
+                raise ValueError('Stompbox {:d} not in pedalboard'.format(stomp_id))
 
-    def cb_looper(self, uri, msg=None):
-        """Handle incoming /looper OSC messages to be proxied to sooperlooper"""
-        _, command = uri.rsplit('/', 1)
+    def cb_looper(self, command):
+        """Handle incoming /looper/<command> OSC messages to be proxied to sooperlooper"""
         cmd_fn = {
             'undo': self._looper.undo,
             'redo': self._looper.redo,
@@ -342,26 +566,17 @@ class MusicBox:
             'multiply': lambda: self._looper.overdub(multiply=True),
             'pause': self._looper.pause,
         }
-        if command in cmd_fn:
-            cmd_fn[command]()
-            self._log.info("Sent /sl/0/hit s:{:s} to sooperlooper".format(command))
-        else:
-            self._log.error("Invalid sooperlooper command {:s}".format(command))
+        cmd_fn[command]()
+        self._log.info("Sent /sl/0/hit s:%s to sooperlooper", command)
 
-    def cb_metronome(self, uri, msg=None):
-        """Handle incoming /metronome/ OSC messages"""
-        uri_splits = uri.split('/')
-        assert uri_splits[0] == ''
-        assert uri_splits[1] == 'metronome'
-        command = uri_splits[2]
-
-        self._log.info("METRONOME {}".format(command))
+    def cb_metronome(self, command, bpm=None):
+        """Handle incoming /metronome/<command> and /metronome/set_bpm/<BPM> OSC messages"""
+        self._log.info("METRONOME %s", command)
 
         if command == 'pause':
             self._metronome.enable(not self._metronome.is_running)
         elif command == 'set_bpm':
-            assert len(uri_splits) == 4
-            self._metronome.set_bpm(int(uri_splits[3]))
+            self._metronome.set_bpm(bpm)
         elif command == 'inc_bpm':
             self._metronome.set_bpm(self._metronome.bpm + 8)
         elif command == 'dec_bpm':
@@ -370,30 +585,79 @@ class MusicBox:
             self._metronome.tap()
 
         bpm = self._metronome.get_bpm()
-        midisend(2, bpm)
+        self._midi_out.control_change(2, bpm)
         self._notifier.update("BPM:{:d}".format(bpm))
+        self._state.set_bpm(bpm)
 
-    def cb_slider(self, uri, msg=None):
-        """Handle incoming /slider/<N> OSC message"""
-        now = time.time()
-        if now - self._last_slider_update_time < 0.2:
-            return
-        self._last_slider_update_time = now
+    def cb_slider(self, slider_id, value):
+        """Handle incoming /slider/<N>/<V> (or /slider/<N> with value argument) OSC message"""
+        self._log.debug("SLIDER %d = %f", slider_id, value)
 
-        uri_splits = uri.split('/')
-        assert uri_splits[0] == ''
-        assert uri_splits[1] == 'slider'
-        slider_id = int(uri_splits[2])
-        value = float(msg) if msg is not None else float(uri_splits[3])
-        self._log.info("SLIDER {:d} = {:f}".format(slider_id, value))
+        # Only the latest value per slider is applied at the control rate
+        self._slider_scheduler.submit((self._current_mode, slider_id), value)
 
-        if self._current_mode in [Mode.PRESET, Mode.STOMP]:
+    def cb_automation(self, kind, stomp_id=None, param=None, *args):
+        """Handle incoming /automation/<N>/<P>/<kind> and /automation/clear OSC messages"""
+        self._log.info('AUTOMATION %s %s #%s %s', kind, stomp_id, param, args)
+        if stomp_id is None:
+            self._automation.clear()
+            return
+        if not self._pedalboard:
+            raise ValueError('No active preset')
+        node = self._pedalboard.graph.get_node_from_index(stomp_id - 1)
+        if node is None:
+            raise ValueError('Stompbox {:d} not in pedalboard'.format(stomp_id))
+        if param >= len(node.effect.params):
+            raise ValueError('Stompbox {:d} has no parameter {:d}'.format(stomp_id, param))
+        p = node.effect.params[param]
+        target = (stomp_id - 1, param)
+
+        if kind == 'clear':
+            self._automation.clear(target)
+            return
+        values = args[2:] if kind.startswith('lfo') else args[:1]
+        if any(not p.minimum <= v <= p.maximum for v in values):
+            raise ValueError('Values {!s} out of range {!s}-{!s}'.format(values, p.minimum, p.maximum))
+        if kind in ('lfo', 'lfo_sync'):
+            shape, rate, low, high = args
+            if kind == 'lfo':
+                self._automation.lfo(target, shape, low, high, hz=rate)
+            else:
+                self._automation.lfo(target, shape, low, high, beats=rate)
+        elif kind in ('ramp', 'ramp_sync'):
+            value, duration = args
+            self._automation.ramp(target, p.value, value, duration, synced=kind == 'ramp_sync')
+        elif kind == 'envelope':
+            peak, attack, release = args
+            self._automation.envelope(target, p.value, [(attack, peak), (release, p.value)])
+
+    def _apply_automation(self, changes):
+        """Called by the automation engine with all changed (stompbox, parameter) values of a tick"""
+        pedalboard = self._pedalboard
+        if not pedalboard:
+            return
+        applied = []
+        with self._modhost_transport.batch():  # one burst to mod-host per tick
+            for (stomp, param), value in changes:
+                node = pedalboard.graph.get_node_from_index(stomp)
+                if node is not None and param < len(node.effect.params):
+                    node.effect.params[param].value = value
+                    applied.append((stomp, param, value))
+        for stomp, param, value in applied:
+            self._state.set_param(stomp, param, value)
+
+    def _apply_slider(self, key, value):
+        """Called by the slider scheduler with the latest value of a slider"""
+        mode, slider_id = key
+        self._log.info("SLIDER %d = %f", slider_id, value)
+
+        if mode in [Mode.PRESET, Mode.STOMP]:
             # Adjust currently selected stompbox (default 1)
             self._handle_slider_stompbox(slider_id, value)
-        elif self._current_mode == Mode.LOOPER:
+        elif mode == Mode.LOOPER:
             # Adjust looper parameters
             pass
-        elif self._current_mode == Mode.METRONOME:
+        elif mode == Mode.METRONOME:
             if slider_id == 1:
                 self._metronome.set_bpm(value)
             elif slider_id == 2:
@@ -401,4 +665,11 @@ class MusicBox:
 
 
 if __name__ == '__main__':
-    MusicBox().run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--asyncio', action='store_true', help='run all inputs on a single asyncio event loop')
+    parser.add_argument('--stats', metavar='FILE', help='write statistics (JSON) to FILE on shutdown')
+    parser.add_argument('--record', metavar='FILE', help='record all OSC inputs to FILE (see osc_record)')
+    parser.add_argument('--sync-log', action='store_true', help='write log records on the logging thread (debugging)')
+    args = parser.parse_args()
+    setup_logging(synchronous=args.sync_log)
+    MusicBox(runtime=AsyncRuntime() if args.asyncio else None, stats_file=args.stats, record_file=args.record).run()
@@ -1,59 +1,421 @@
+import asyncio
 import logging
-from socket import socket, AF_INET, SOCK_STREAM
-from threading import Thread
+import selectors
+import time
+from collections import deque
+from socket import socket, socketpair, AF_INET, IPPROTO_TCP, SHUT_RDWR, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, TCP_NODELAY
+from threading import Lock, Thread
+
+from metrics import get_metrics
+
+
+PORT = 9955
 
 
 def _open_socket_bind_listen(port, max_con=3):
     s = socket(AF_INET, SOCK_STREAM)
+    s.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
     s.bind(('0.0.0.0', port))
     s.listen(max_con)
     return s
 
 
+def _frame(msg):
+    """
+    Encode a message as datalength packet followed by the data.
+    Binary messages (bytes) are sent as they are, without a trailing newline.
+
+    >>> _frame('BPM:120')
+    b'DATALEN:0008\\nBPM:120\\n'
+    >>> _frame(b'\\x93')
+    b'DATALEN:0001\\n\\x93'
+    """
+    msg_enc = msg if isinstance(msg, bytes) else (msg + '\n').encode()
+    return 'DATALEN:{:04d}\n'.format(len(msg_enc)).encode() + msg_enc
+
+
+INDEXED_MESSAGES = ('SLIDER', 'STOMPEN')  # message types where the first field is an index
+
+
+def _message_key(msg):
+    """
+    Key used to coalesce queued messages: message type (plus index for indexed types).
+
+    >>> _message_key('SLIDER:0:0.5'), _message_key('BPM:120'), _message_key('PRESET:{"a": 1}')
+    ('SLIDER:0', 'BPM', 'PRESET')
+    """
+    parts = msg.split(':', 2)
+    if parts[0] in INDEXED_MESSAGES and len(parts) > 2:
+        return parts[0] + ':' + parts[1]
+    return parts[0]
+
+
+# Channels a client can subscribe to by sending "PROTO:<channel>\n"
+LEGACY = 'legacy'  # one message per change (MODE, PRESET, STOMPEN, ...), the default
+JSON = 'json'  # versioned SNAPSHOT/DELTA messages, JSON encoded
+BINARY = 'binary'  # versioned SNAPSHOT/DELTA messages, msgpack encoded
+
+
+def _channel_key(channel, msg):
+    """Coalescing key of a message on a channel, None for messages that must not be dropped (deltas)"""
+    return _message_key(msg) if channel == LEGACY else None
+
+
+def _parse_commands(buf):
+    """
+    Split received bytes into complete command lines and the remaining bytes.
+
+    >>> _parse_commands(b'PROTO:json\\nQUIT\\nPR')
+    (['PROTO:json', 'QUIT'], b'PR')
+    """
+    *lines, rest = buf.split(b'\n')
+    return [l.decode('utf-8', 'replace').strip() for l in lines], rest
+
+
+OVERFLOW_COALESCE = 'coalesce'  # replace queued message with the same key (or drop the oldest)
+OVERFLOW_DISCONNECT = 'disconnect'  # disconnect clients that can't keep up
+
+
+class _Client:
+    """Connected client with a bounded queue of outgoing messages"""
+    def __init__(self, sock, addr, max_queue, policy):
+        self.sock = sock
+        self.addr = addr
+        self._max_queue = max_queue
+        self._policy = policy
+        self._queue = deque()  # (key, frame)
+        self._partial = b''  # unsent rest of the frame currently being sent
+        self.received = b''  # incomplete command line
+        self.channel = LEGACY
+        self.sent = self.coalesced = self.dropped = self.max_backlog = 0
+        self.closing = False  # set when disconnected for being too slow
+        self.resync = False  # set when queued deltas were dropped, client needs a new snapshot
+
+    @property
+    def backlog(self):
+        return len(self._queue) + (1 if self._partial else 0)
+
+    def push(self, key, frame):
+        """
+        Queue a frame, returns False if the client has to be disconnected.
+        Frames without key can't be coalesced: on overflow the queue is cleared
+        and resync is set instead.
+        """
+        if len(self._queue) >= self._max_queue:
+            if self._policy == OVERFLOW_DISCONNECT:
+                return False
+            if key is None:
+                self.dropped += len(self._queue) + 1
+                self._queue.clear()
+                self.resync = True
+                return True
+            for i, (k, _) in enumerate(self._queue):
+                if k == key:
+                    del self._queue[i]
+                    self.coalesced += 1
+                    break
+            else:
+                self._queue.popleft()
+                self.dropped += 1
+        self._queue.append((key, frame))
+        self.max_backlog = max(self.max_backlog, self.backlog)
+        return True
+
+    def flush(self):
+        """Send as much as possible without blocking"""
+        while self._partial or self._queue:
+            if not self._partial:
+                self._partial = self._queue.popleft()[1]
+            try:
+                n = self.sock.send(self._partial)
+            except BlockingIOError:
+                return
+            self._partial = self._partial[n:]
+            if not self._partial:
+                self.sent += 1
+
+    def stats(self):
+        return {'addr': str(self.addr), 'channel': self.channel, 'backlog': self.backlog, 'max_backlog': self.max_backlog,
+                'sent': self.sent, 'coalesced': self.coalesced, 'dropped': self.dropped}
+
+
 class TcpNotifier:
-    def __init__(self):
+    """
+    Sends notifications to any number of TCP clients.
+
+    update() only puts the message into a bounded queue per client; a single
+    I/O thread accepts clients, reads their commands and sends the queued
+    messages with non-blocking writes, so a slow client never blocks the caller.
+    When a client's queue is full, messages are coalesced by type (or the client
+    is disconnected, depending on the overflow policy).
+
+    Clients get the LEGACY channel unless they send "PROTO:<channel>". When a
+    client connects or changes its channel, on_subscribe(channel) is called for
+    the messages describing the current state (None rejects the channel). A
+    client that missed deltas gets these messages again instead.
+    """
+    def __init__(self, port=PORT, max_queue=64, policy=OVERFLOW_COALESCE):
         self._running = True
-        self._connection = None
         self._log = logging.getLogger('musicbox.TcpNotifier')
+        self.on_subscribe = None  # callable(channel) -> list of messages, or None for unknown channels
+        self._max_queue = max_queue
+        self._policy = policy
+        self._clients = {}  # socket -> _Client
+        self._lock = Lock()
+        self._publish_latency = get_metrics().histogram('notifier.publish')
+
+        self._socket = _open_socket_bind_listen(port)
+        self._socket.setblocking(False)
+        self._wakeup_r, self._wakeup_w = socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._socket, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
 
-        self._socket = _open_socket_bind_listen(9955)
         self._thread = Thread(target=self._serve)
         self._thread.start()
 
     def close(self):
         self._running = False
-        self._socket.close()
+        self._wakeup()
         self._thread.join()
+        for sock in list(self._clients):
+            self._disconnect(sock)
+        self._selector.close()
+        self._socket.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+    def stats(self):
+        """Per-client backlog metrics"""
+        with self._lock:
+            return [c.stats() for c in self._clients.values()]
+
+    def _accept(self):
+        try:
+            connection, addr = self._socket.accept()
+        except BlockingIOError:
+            return
+        self._log.info('Incoming connection from ' + str(addr))
+        connection.setblocking(False)
+        connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        client = _Client(connection, addr, self._max_queue, self._policy)
+        with self._lock:
+            self._clients[connection] = client
+        self._selector.register(connection, selectors.EVENT_READ)
+        self._subscribe(client, LEGACY)
+
+    def _subscribe(self, client, channel):
+        """Switch the client to channel and queue the current state"""
+        messages = self.on_subscribe(channel) if self.on_subscribe else []
+        if messages is None:
+            self._log.warn('Client {} requested unknown channel {!r}'.format(client.addr, channel))
+            return
+        with self._lock:
+            client.channel = channel
+            client.resync = False
+            for msg in messages:
+                client.push(_channel_key(channel, msg), _frame(msg))
+
+    def _disconnect(self, sock):
+        with self._lock:
+            client = self._clients.pop(sock, None)
+        if client is None:
+            return
+        self._log.info('Closing connection {} ({!s})'.format(client.addr, client.stats()))
+        self._selector.unregister(sock)
+        sock.close()
+
+    def _read(self, sock):
+        try:
+            data = sock.recv(128)
+        except BlockingIOError:
+            return
+        except ConnectionResetError:
+            self._log.error('Connection broken')
+            data = b''
+
+        if not data:
+            self._log.warn('recv() returned empty data')
+            self._disconnect(sock)
+            return
+
+        client = self._clients.get(sock)
+        if client is None:
+            return
+        commands, client.received = _parse_commands(client.received + data)
+        for command in commands:
+            if command == 'QUIT':
+                self._disconnect(sock)
+                return
+            elif command.startswith('PROTO:'):
+                self._subscribe(client, command[len('PROTO:'):])
 
     def _serve(self):
+        self._log.info('Ready to accept connections')
         while self._running:
-            self._log.info('Ready to accept connection')
-            self._connection, addr = self._socket.accept()
-            self._log.info('Incoming connection from ' + str(addr))
+            for key, mask in self._selector.select(timeout=1):
+                sock = key.fileobj
+                if sock is self._socket:
+                    self._accept()
+                elif sock is self._wakeup_r:
+                    try:
+                        sock.recv(4096)
+                    except BlockingIOError:
+                        pass
+                elif mask & selectors.EVENT_READ:
+                    self._read(sock)
 
-            while True:
+            # Send queued messages, watch for writability of clients that couldn't take everything
+            with self._lock:
+                clients = list(self._clients.items())
+            for sock, client in clients:
                 try:
-                    data = self._connection.recv(128).decode()
-                except ConnectionResetError:
-                    self._log.error('Connection broken')
-                    break
+                    with self._lock:
+                        client.flush()
+                        pending = client.backlog > 0
+                except OSError as e:
+                    self._log.error('Sending to {} failed: {!s}'.format(client.addr, e))
+                    self._disconnect(sock)
+                    continue
+                events = selectors.EVENT_READ | (selectors.EVENT_WRITE if pending else 0)
+                if self._selector.get_key(sock).events != events:
+                    self._selector.modify(sock, events)
 
-                if not data:
-                    self._log.warn('recv() returned empty data')
-                    break
-                if data == 'QUIT\n':
+    def update(self, msg):
+        """Queue message (datalength packet and data in one write) for all LEGACY clients"""
+        self.publish({LEGACY: msg})
+
+    def publish(self, messages):
+        """
+        Queue a message per channel ({channel: message}) for the clients of that channel.
+        A message can also be a callable returning the message, it is only called
+        (once) if a client subscribed to the channel.
+        """
+        start = time.perf_counter()
+        frames = {}  # channel -> (key, frame)
+        slow, resync = [], []
+        with self._lock:
+            for sock, client in self._clients.items():
+                if client.closing or client.channel not in messages:
+                    continue
+                if client.channel not in frames:
+                    msg = messages[client.channel]
+                    msg = msg() if callable(msg) else msg
+                    frames[client.channel] = (_channel_key(client.channel, msg), _frame(msg))
+                if not client.push(*frames[client.channel]):
+                    client.closing = True
+                    slow.append(client)
+                elif client.resync:
+                    resync.append(client)
+        for client in resync:
+            self._log.warn('Client {} missed updates, sending current state'.format(client.addr))
+            self._subscribe(client, client.channel)
+        for client in slow:
+            self._log.warn('Client {} too slow (backlog {:d}), disconnecting'.format(client.addr, client.backlog))
+            try:
+                client.sock.shutdown(SHUT_RDWR)  # the I/O thread removes it when the socket reports EOF/error
+            except OSError:
+                pass
+        self._wakeup()
+        self._publish_latency.record(time.perf_counter() - start)
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'x')
+        except BlockingIOError:
+            pass  # I/O thread is already woken up
+
+
+class AsyncTcpNotifier:
+    """
+    Notifier for the AsyncRuntime: serves any number of clients on the event loop.
+    update() and publish() can be called from any thread, they never block on
+    client sockets. Channels and on_subscribe work like for TcpNotifier; slow
+    clients are disconnected (and get the current state when reconnecting).
+    """
+    def __init__(self, loop, port=PORT, max_buffer=64 * 1024):
+        self._log = logging.getLogger('musicbox.AsyncTcpNotifier')
+        self._max_buffer = max_buffer  # clients with more unsent bytes are disconnected
+        self._loop = loop
+        self._port = port
+        self._server = None
+        self._clients = {}  # StreamWriter of connected clients -> channel
+        self.on_subscribe = None  # callable(channel) -> list of messages, or None for unknown channels
+        self._publish_latency = get_metrics().histogram('notifier.publish')
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, '0.0.0.0', self._port)
+        self._log.info('Ready to accept connections')
+
+    async def _handle_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        self._log.info('Incoming connection from ' + str(addr))
+        self._subscribe(writer, LEGACY)
+        try:
+            while True:
+                data = await reader.readline()
+                command = data.decode('utf-8', 'replace').strip()
+                if not data or command == 'QUIT':
                     break
-            self._connection.close()
+                elif command.startswith('PROTO:'):
+                    self._subscribe(writer, command[len('PROTO:'):])
+        except ConnectionResetError:
+            self._log.error('Connection broken')
+        finally:
+            self._clients.pop(writer, None)
+            writer.close()
+
+    def _subscribe(self, writer, channel):
+        messages = self.on_subscribe(channel) if self.on_subscribe else []
+        if messages is None:
+            self._log.warn('Client {} requested unknown channel {!r}'.format(writer.get_extra_info('peername'), channel))
+            return
+        self._clients[writer] = channel
+        writer.write(b''.join(_frame(msg) for msg in messages))
 
     def update(self, msg):
-        """Sends datalength packet and as many data packets as required"""
-        msg_enc = (msg + '\n').encode()
-        datalen_msg = 'DATALEN:{:04d}\n'.format(len(msg_enc))
-        self._log.debug('Sending datalen message: ' + datalen_msg)
-        if self._connection:
-            self._connection.send(datalen_msg.encode())
-            self._log.debug('Sending update notification "{:s}..." of length {:d}'.format(msg[:min(20, len(msg))], len(msg_enc)))
-            self._connection.sendall(msg_enc)
+        """Queue message to be sent to all LEGACY clients (thread-safe)"""
+        self.publish({LEGACY: msg})
+
+    def publish(self, messages):
+        """Queue a message per channel ({channel: message or callable}) for the clients of that channel"""
+        self._loop.call_soon_threadsafe(self._broadcast, messages)
+
+    def _broadcast(self, messages):
+        start = time.perf_counter()
+        frames = {}  # channel -> frame
+        for writer, channel in list(self._clients.items()):
+            if channel not in messages:
+                continue
+            if writer.transport.get_write_buffer_size() > self._max_buffer:
+                self._log.warn('Client {} too slow, disconnecting'.format(writer.get_extra_info('peername')))
+                self._clients.pop(writer, None)
+                writer.close()
+                continue
+            if channel not in frames:
+                msg = messages[channel]
+                frames[channel] = _frame(msg() if callable(msg) else msg)
+            writer.write(frames[channel])
+        self._publish_latency.record(time.perf_counter() - start)
+
+    def stats(self):
+        """Per-client backlog metrics (unsent bytes)"""
+        return [{'addr': str(w.get_extra_info('peername')), 'channel': channel,
+                 'backlog_bytes': w.transport.get_write_buffer_size()}
+                for w, channel in list(self._clients.items())]
+
+    def close(self):
+        def _close():
+            if self._server:
+                self._server.close()
+            for writer in list(self._clients):
+                writer.close()
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(_close)
+        else:
+            _close()
 
 
 class Notifier:
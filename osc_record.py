@@ -0,0 +1,173 @@
+import argparse
+import logging
+import queue
+import socket
+import struct
+import threading
+import time
+
+
+LOG_MAGIC = b'MBOSCLOG'
+LOG_VERSION = 1
+_HEADER = struct.Struct('<8sI')  # magic, version
+_RECORD = struct.Struct('<dI')  # seconds since start of the recording, datagram length
+
+
+class OscRecorder:
+    """
+    Writes every inbound OSC datagram (raw bytes) with its arrival time (monotonic,
+    relative to the start of the recording) to a compact binary log.
+
+    record() is called on the receiving thread and only queues the datagram,
+    the file is written by a background thread.
+    """
+    def __init__(self, path):
+        self._log = logging.getLogger('musicbox.OscRecorder')
+        self.path = path
+        self.count = 0
+        self._start = time.monotonic()
+        self._queue = queue.SimpleQueue()
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(LOG_MAGIC, LOG_VERSION))
+        self._thread = threading.Thread(target=self._write, name='musicbox-osc-recorder', daemon=True)
+        self._thread.start()
+
+    def record(self, data):
+        self._queue.put((time.monotonic() - self._start, data))
+
+    def _write(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            t, data = item
+            self._file.write(_RECORD.pack(t, len(data)))
+            self._file.write(data)
+            self.count += 1
+            if self._queue.empty():
+                self._file.flush()
+        self._file.close()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._log.info('Recorded {:d} OSC messages to {}'.format(self.count, self.path))
+
+
+class OscCounter:
+    """Recorder that only counts the datagrams (e.g. to find drops during a replay)"""
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, data):
+        with self._lock:
+            self.count += 1
+
+
+def read_log(path):
+    """
+    List of (seconds since start, datagram) of an OSC log.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'osc.log')
+    >>> recorder = OscRecorder(path)
+    >>> recorder.record(b'/ping\\x00\\x00\\x00,\\x00\\x00\\x00'); recorder.close()
+    >>> [data for t, data in read_log(path)]
+    [b'/ping\\x00\\x00\\x00,\\x00\\x00\\x00']
+    """
+    with open(path, 'rb') as f:
+        buf = f.read()
+    magic, version = _HEADER.unpack_from(buf)
+    if magic != LOG_MAGIC or version != LOG_VERSION:
+        raise ValueError('{} is not an OSC log of version {:d}'.format(path, LOG_VERSION))
+    records, offset = [], _HEADER.size
+    while offset + _RECORD.size <= len(buf):
+        t, length = _RECORD.unpack_from(buf, offset)
+        offset += _RECORD.size
+        records.append((t, buf[offset:offset + length]))
+        offset += length
+    return records
+
+
+def write_log(path, records):
+    """Write (seconds, datagram) records as an OSC log (e.g. generated load)"""
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(LOG_MAGIC, LOG_VERSION))
+        for t, data in records:
+            f.write(_RECORD.pack(t, len(data)))
+            f.write(data)
+
+
+def generate(kind, rate, duration):
+    """
+    Synthetic load as (seconds, datagram) records: 'slider' floods slider 1-3
+    with changing values, 'presets' switches between presets 1-3.
+    """
+    from pythonosc.osc_message_builder import OscMessageBuilder
+
+    def message(address, *args):
+        builder = OscMessageBuilder(address)
+        for arg in args:
+            builder.add_arg(arg)
+        return builder.build().dgram
+
+    records = []
+    for i in range(int(rate * duration)):
+        if kind == 'slider':
+            data = message('/slider/{:d}'.format(i % 3 + 1), float((i * 37) % 1024))
+        elif kind == 'presets':
+            data = message('/preset/{:d}'.format(i % 3 + 1))
+        else:
+            raise ValueError('Unknown load {!r}'.format(kind))
+        records.append((i / rate, data))
+    return records
+
+
+class OscReplayer:
+    """
+    Sends recorded datagrams to an OSC server over UDP, at the recorded timing
+    divided by speed (speed 0: as fast as possible).
+    """
+    def __init__(self, records, host='127.0.0.1', port=5005, speed=1.0):
+        self._records = records
+        self._address = (host, port)
+        self._speed = speed
+        self.sent = 0
+        self.max_lag = 0.0  # seconds the sender was behind the schedule
+
+    def run(self):
+        """Send all records, returns the duration in seconds"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        start = time.monotonic()
+        with sock:
+            for t, data in self._records:
+                if self._speed:
+                    delay = start + t / self._speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        self.max_lag = max(self.max_lag, -delay)
+                sock.sendto(data, self._address)
+                self.sent += 1
+        return time.monotonic() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic OSC logs or replay one to a running musicbox '
+                                                 '(see benchmark.py --replay for measurements)')
+    parser.add_argument('log', help='OSC log file')
+    parser.add_argument('--generate', choices=['slider', 'presets'], help='write synthetic load to the log file')
+    parser.add_argument('--rate', type=float, default=1000, help='messages per second (generated load)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds (generated load)')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed factor (0: as fast as possible)')
+    parser.add_argument('--port', type=int, default=5005, help='OSC port to replay to')
+    args = parser.parse_args()
+
+    if args.generate:
+        write_log(args.log, generate(args.generate, args.rate, args.duration))
+    else:
+        replayer = OscReplayer(read_log(args.log), port=args.port, speed=args.speed)
+        duration = replayer.run()
+        print('Sent {:d} messages in {:.2f}s (max lag {:.1f}ms)'.format(replayer.sent, duration,
+                                                                        replayer.max_lag * 1000))
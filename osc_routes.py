@@ -0,0 +1,194 @@
+import logging
+
+from collections import deque
+
+
+class Rejection:
+    """An OSC message that was not handled: unknown address, invalid argument or failing handler"""
+    __slots__ = ('address', 'reason')
+
+    def __init__(self, address, reason):
+        self.address = address
+        self.reason = reason
+
+    def __repr__(self):
+        return 'Rejection({!r}, {!r})'.format(self.address, self.reason)
+
+    def to_dict(self):
+        return {'address': self.address, 'reason': self.reason}
+
+
+class _Route:
+    def __init__(self, pattern, handler, names, osc_args, converters):
+        self.pattern = pattern
+        self.handler = handler
+        self.names = names  # parameter name per address segment (None for literal segments)
+        self.osc_args = osc_args  # parameter names taken from the OSC arguments
+        self.converters = converters  # parameter name -> callable(str or OSC argument)
+
+
+def _domain(values):
+    """Converter for an enumerable parameter: {address segment: value}"""
+    if isinstance(values, dict):
+        return dict(values)
+    return {str(v): v for v in values}
+
+
+class RouteTable:
+    """
+    OSC address -> handler table compiled once, before any message is dispatched.
+
+    A route is an address pattern with {name} segments and a type per name:
+    a collection of allowed values (a dict maps segments to values) or a
+    converter (e.g. int, float). Types of names that aren't in the pattern
+    are taken from the OSC arguments, in order. The handler is called with the
+    converted values as positional arguments (in pattern order, then OSC arguments).
+
+    Routes with only enumerable segments are expanded into an exact address
+    table, dispatching them is one dict lookup. Other routes are looked up by
+    (first segment, number of segments) and their segments are converted.
+    Messages that can't be handled are returned as Rejection (never raised).
+
+    >>> routes = RouteTable()
+    >>> routes.add('/stomp/{stomp}/{op}', lambda stomp, op: print(stomp, op), stomp=range(1, 9), op=('enable', 'select'))
+    >>> routes.add('/slider/{slider}', lambda slider, value: print(slider, value), slider=range(1, 4), value=float)
+    >>> routes.add('/metronome/set_bpm/{bpm}', lambda bpm: print(bpm), bpm=int)
+    >>> routes.dispatch('/stomp/2/enable')
+    2 enable
+    >>> routes.dispatch('/slider/1', [512])
+    1 512.0
+    >>> routes.dispatch('/metronome/set_bpm/90')
+    90
+    >>> routes.dispatch('/stomp/9/enable'), routes.dispatch('/metronome/set_bpm/x'), routes.dispatch('/slider/1')
+    (Rejection('/stomp/9/enable', 'unknown address'), Rejection('/metronome/set_bpm/x', 'invalid bpm: x'), \
+Rejection('/slider/1', 'missing value'))
+    """
+    def __init__(self, max_rejections=32):
+        self._log = logging.getLogger('musicbox.RouteTable')
+        self._exact = {}  # address -> (route, converted address values)
+        self._parameterised = {}  # (first segment, number of segments) -> route
+        self.handled = 0
+        self.rejected = 0
+        self.rejections = deque(maxlen=max_rejections)  # latest rejections
+
+    def add(self, pattern, handler, **types):
+        segments = pattern.split('/')
+        names = [s[1:-1] if s.startswith('{') and s.endswith('}') else None for s in segments]
+        for name in names:
+            if name is not None and name not in types:
+                raise ValueError('No type for {{{}}} in {}'.format(name, pattern))
+        osc_args = [name for name in types if name not in names]
+        converters = {name: _domain(t) if not callable(t) else t for name, t in types.items()}
+        route = _Route(pattern, handler, names, osc_args, converters)
+
+        if all(isinstance(converters[n], dict) for n in names if n is not None):
+            for address, values in self._expand(segments, names, converters):
+                if address in self._exact:
+                    raise ValueError('{} of {} is already routed'.format(address, pattern))
+                self._exact[address] = (route, values)
+        else:
+            key = (segments[1], len(segments))
+            if key in self._parameterised:
+                raise ValueError('{} conflicts with {}'.format(pattern, self._parameterised[key].pattern))
+            self._parameterised[key] = route
+
+    @staticmethod
+    def _expand(segments, names, converters):
+        """All (address, values) of a route with only enumerable parameters"""
+        expanded = [([], [])]
+        for segment, name in zip(segments, names):
+            if name is None:
+                expanded = [(parts + [segment], values) for parts, values in expanded]
+            else:
+                expanded = [(parts + [s], values + [v]) for parts, values in expanded
+                            for s, v in converters[name].items()]
+        return [('/'.join(parts), tuple(values)) for parts, values in expanded]
+
+    def _match(self, address):
+        """(route, address values) or a Rejection"""
+        match = self._exact.get(address)
+        if match is not None:
+            return match
+        segments = address.split('/')
+        route = self._parameterised.get((segments[1] if len(segments) > 1 else '', len(segments)))
+        if route is None:
+            return Rejection(address, 'unknown address')
+        values = []
+        for segment, name, literal in zip(segments, route.names, route.pattern.split('/')):
+            if name is None:
+                if segment != literal:
+                    return Rejection(address, 'unknown address')
+                continue
+            value = self._convert(route.converters[name], segment)
+            if value is None:
+                return Rejection(address, 'invalid {}: {}'.format(name, segment))
+            values.append(value)
+        return route, tuple(values)
+
+    @staticmethod
+    def _convert(converter, value):
+        """Converted value, None if it is invalid"""
+        if isinstance(converter, dict):
+            return converter.get(str(value))
+        try:
+            return converter(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _arguments(self, address, route, values, osc_args):
+        """All handler arguments (address values and converted OSC arguments) or a Rejection"""
+        if not route.osc_args:
+            return values
+        if len(osc_args) < len(route.osc_args):
+            return Rejection(address, 'missing ' + route.osc_args[len(osc_args)])
+        converted = []
+        for name, arg in zip(route.osc_args, osc_args):
+            value = self._convert(route.converters[name], arg)
+            if value is None:
+                return Rejection(address, 'invalid {}: {!r}'.format(name, arg))
+            converted.append(value)
+        return values + tuple(converted)
+
+    def dispatch(self, address, osc_args=()):
+        """Call the handler of a message, returns None or the Rejection"""
+        match = self._match(address)
+        if not isinstance(match, Rejection):
+            route, values = match
+            match = self._arguments(address, route, values, osc_args)
+            if not isinstance(match, Rejection):
+                return self._call(address, route.handler, match)
+        return self.reject(match)
+
+    def _call(self, address, handler, args):
+        try:
+            handler(*args)
+        except ValueError as e:
+            return self.reject(Rejection(address, str(e)))
+        except Exception as e:
+            self._log.exception('Handler of {} failed'.format(address))
+            return self.reject(Rejection(address, 'error: {!s}'.format(e)))
+        self.handled += 1
+        return None
+
+    def reject(self, rejection):
+        self.rejected += 1
+        self.rejections.append(rejection)
+        self._log.warning('Rejected OSC message {}: {}'.format(rejection.address, rejection.reason))
+        return rejection
+
+    def resolve(self, address):
+        """
+        Handler call of an address without OSC arguments, resolved once (e.g.
+        for the footpedal CC map). Raises ValueError for invalid addresses.
+        """
+        match = self._match(address)
+        if isinstance(match, Rejection):
+            raise ValueError('{}: {}'.format(address, match.reason))
+        route, values = match
+        if route.osc_args:
+            raise ValueError('{}: needs OSC arguments {!s}'.format(address, route.osc_args))
+        return lambda *_: self._call(address, route.handler, values)
+
+    def stats(self):
+        return {'routes': len(self._exact) + len(self._parameterised), 'handled': self.handled,
+                'rejected': self.rejected, 'rejections': [r.to_dict() for r in self.rejections]}
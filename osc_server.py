@@ -1,24 +1,92 @@
+import functools
+
 from threading import Thread
-from pythonosc import dispatcher, osc_server
+from pythonosc import dispatcher, osc_packet, osc_server
+
+from automation import SHAPES
+from osc_routes import Rejection, RouteTable
+
+
+MODES = ('preset', 'stomp', 'looper', 'metronome')
+STOMPBOXES = range(1, 10)
+SLIDERS = range(1, 10)
+PARAMETERS = range(32)  # parameter index of a stompbox (as listed in PRESET notifications)
+LOOPER_COMMANDS = ('undo', 'redo', 'record', 'overdub', 'mute_trigger', 'insert', 'multiply', 'pause')
+
+
+class RouteDispatcher(dispatcher.Dispatcher):
+    """
+    Dispatches messages through a compiled RouteTable (instead of pattern matching
+    every registered address). Every datagram is passed to the recorder (see
+    osc_record) before it is handled.
+    """
+    def __init__(self, routes):
+        dispatcher.Dispatcher.__init__(self)
+        self.routes = routes
+        self.recorder = None  # object with record(data), None: not recording
+
+    def call_handlers_for_packet(self, data, client_address):
+        if self.recorder is not None:
+            self.recorder.record(data)
+        try:
+            packet = osc_packet.OscPacket(data)
+        except osc_packet.ParseError as e:
+            self.routes.reject(Rejection(None, 'invalid packet: {!s}'.format(e)))
+            return []
+        for timed_message in packet.messages:
+            self.routes.dispatch(timed_message.message.address, timed_message.message.params)
+        return []  # no responses to send back
+
+    async def async_call_handlers_for_packet(self, data, client_address):
+        return self.call_handlers_for_packet(data, client_address)
 
 
 class OscServer(object):
     def __init__(self, use_threading=True):
         self._use_threading = use_threading
         self._port = 5005
-        self._dispatcher = dispatcher.Dispatcher()
+        self._routes = RouteTable()
+        self._dispatcher = RouteDispatcher(self._routes)
+        self._server = None
+        self.on_stop = None  # called when the server is stopped (e.g. by /quit)
+
+        self.add_route("/ping", self.cb_ping)
+        self.add_route("/quit", self.cb_quit)
+
+    @property
+    def port(self):
+        return self._port
 
-        self.register_uri("/ping", self.cb_ping)
-        self.register_uri("/quit", self.cb_quit)
+    @property
+    def dispatcher(self):
+        return self._dispatcher
 
-    def register_uri(self, uri, func, *args):
-        self._dispatcher.map(uri, func, *args)
+    @property
+    def routes(self):
+        return self._routes
 
-    def cb_ping(self, *args):
-        print("PING " + str(list(args)))
+    @property
+    def recorder(self):
+        return self._dispatcher.recorder
 
-    def cb_quit(self, *args):
-        print("QUIT " + str(list(args)))
+    @recorder.setter
+    def recorder(self, recorder):
+        """Record all received datagrams (e.g. OscRecorder), None stops recording"""
+        self._dispatcher.recorder = recorder
+
+    def add_route(self, pattern, handler, **types):
+        """Route messages to a handler with typed arguments (see RouteTable.add)"""
+        self._routes.add(pattern, handler, **types)
+
+    def resolve(self, address):
+        """Handler call of an address, resolved once (see RouteTable.resolve)"""
+        return self._routes.resolve(address)
+
+    def cb_ping(self):
+        print("PING")
+
+    def cb_quit(self):
+        print("QUIT")
         self.stop()
 
     def start(self):
@@ -30,31 +98,87 @@ class OscServer(object):
             self._server.serve_forever()
 
     def stop(self):
-        self._server.shutdown()
+        if self._server:
+            self._server.shutdown()
+        if self.on_stop:
+            self.on_stop()
 
 
 class FootpedalOscServer(OscServer):
     """
     Central receiver for OSC messages which can control the program itself, mod-host, sooperlooper.
 
-    Messages (/bank/1 == /bank with message "1"):
+    Messages (handlers get the address parameters as typed arguments, other
+    messages are rejected, see RouteTable):
     - /mode/preset: activates preset mode (load presets, some stompbox control)
     - /mode/stomp: activates stompbox mode (control over 8 stompboxes, no presets)
     - /mode/looper: activates looper mode (all footswitches used for looper control)
-    - /mode/tuner: mute sound and display tuner
+    - /mode/metronome: activates metronome mode
     - /preset/<N>: loads a preset (mod-host plugins + optional sooperlooper instance)
-    - /stompbox/<N>/enable: enables/disables (toggles) a stompbox
-    - /stompbox/<N>/select: selects a stompbox for editing
-    - /slider/<N>/<V>: set slider <N> to value <V>
+    - /stomp/<N>/enable, /stomp/<N>/enable/<0|1>: toggles/enables/disables a stompbox
+    - /stomp/<N>/select: selects a stompbox for editing
+    - /slider/<N>/<V>, /slider/<N> with argument <V>: set slider <N> to value <V>
     - /looper/<cmd>: passed through to sooperlooper instance
+    - /metronome/<cmd>, /metronome/set_bpm/<BPM>: metronome commands
+    - /bank/<N>, /bank/next, /bank/prev: selects the bank for /preset/<N>
+    - /stats: sends latency statistics to the notifier clients (STATS:<json>)
+    - /log, /log/<N>: sends the latest (N) log lines to the notifier clients (LOG:<json>)
+    - /automation/<N>/<P>/lfo, /automation/<N>/<P>/lfo_sync with arguments <shape> <rate> <low> <high>:
+      modulate parameter <P> of stompbox <N> (rate in Hz, or beats per cycle synced to the metronome)
+    - /automation/<N>/<P>/ramp, /automation/<N>/<P>/ramp_sync with arguments <value> <duration>:
+      ramp parameter <P> from its current value (duration in seconds, or beats)
+    - /automation/<N>/<P>/envelope with arguments <peak> <attack> <release>: ramp to <peak> and back (seconds)
+    - /automation/<N>/<P>/clear, /automation/clear: stop automation of a parameter (of all parameters)
     """
-    def __init__(self, cb_mode, cb_preset, cb_stomp, cb_looper, cb_metronome, cb_slider):
+    def __init__(self, cb_mode, cb_preset, cb_stomp, cb_looper, cb_metronome, cb_slider, cb_bank=None, cb_stats=None,
+                 cb_log=None, cb_automation=None):
         OscServer.__init__(self)
-        self.register_uri("/mode/*", cb_mode)  # modes as string ("preset", etc)
-        self.register_uri("/preset/*", cb_preset)  # preset number (1-4)
-        self.register_uri("/stomp/*", cb_stomp)  # enable stompbox (1-8)
-        self.register_uri("/looper/*", cb_looper)  # looper commands ("undo", "record", etc)
-        self.register_uri("/metronome/*", cb_metronome)  # Send metronome commands (e.g. a tap (1) or tap tempo value (30-300))
+        if cb_bank:
+            self.add_route("/bank/{bank}", cb_bank, bank=bank_arg)  # bank number or "next"/"prev"
+        if cb_stats:
+            self.add_route("/stats", cb_stats)
+        if cb_log:
+            self.add_route("/log", cb_log)
+            self.add_route("/log/{count}", cb_log, count=int)
+        if cb_automation:
+            automation = functools.partial(self.add_route, stomp=STOMPBOXES, param=PARAMETERS)
+            automation("/automation/{stomp}/{param}/lfo", functools.partial(cb_automation, 'lfo'), shape=SHAPES,
+                       rate=float, low=float, high=float)
+            automation("/automation/{stomp}/{param}/lfo_sync", functools.partial(cb_automation, 'lfo_sync'),
+                       shape=SHAPES, rate=float, low=float, high=float)
+            automation("/automation/{stomp}/{param}/ramp", functools.partial(cb_automation, 'ramp'), value=float,
+                       duration=float)
+            automation("/automation/{stomp}/{param}/ramp_sync", functools.partial(cb_automation, 'ramp_sync'),
+                       value=float, duration=float)
+            automation("/automation/{stomp}/{param}/envelope", functools.partial(cb_automation, 'envelope'),
+                       peak=float, attack=float, release=float)
+            automation("/automation/{stomp}/{param}/clear", functools.partial(cb_automation, 'clear'))
+            self.add_route("/automation/clear", functools.partial(cb_automation, 'clear'))
+        self.add_route("/mode/{mode}", cb_mode, mode=MODES)  # modes as string ("preset", etc)
+        self.add_route("/preset/{preset}", cb_preset, preset=range(128))  # preset number
+        self.add_route("/stomp/{stomp}/{op}", cb_stomp, stomp=STOMPBOXES, op=('enable', 'select'))
+        self.add_route("/stomp/{stomp}/enable/{value}", functools.partial(_enable, cb_stomp), stomp=STOMPBOXES,
+                       value=(0, 1))
+        self.add_route("/looper/{command}", cb_looper, command=LOOPER_COMMANDS)
+        self.add_route("/metronome/{command}", cb_metronome, command=('pause', 'inc_bpm', 'dec_bpm', 'tap'))
+        self.add_route("/metronome/set_bpm/{bpm}", functools.partial(cb_metronome, 'set_bpm'), bpm=int)
 
         # Extra inputs (not on pedal board; e.g. OSC app)
-        self.register_uri("/slider/?/*", cb_slider)  # slider value (0-1023)
+        self.add_route("/slider/{slider}", cb_slider, slider=SLIDERS, value=float)  # slider value (0-1023) as argument
+        self.add_route("/slider/{slider}/{value}", cb_slider, slider=SLIDERS, value=float)
+
+
+def bank_arg(segment):
+    """
+    Bank number or relative bank ("next"/"prev").
+
+    >>> bank_arg('2'), bank_arg('next')
+    (2, 'next')
+    """
+    if segment in ('next', 'prev'):
+        return segment
+    return int(segment)
+
+
+def _enable(cb_stomp, stomp, value):
+    cb_stomp(stomp, 'enable', value)
@@ -1,4 +1,8 @@
-from collections import OrderedDict
+import heapq
+
+
+class GraphError(ValueError):
+    pass
 
 
 class PedalboardGraph:
@@ -10,6 +14,10 @@ class PedalboardGraph:
     the last node won't have any outgoing connections: this implies connection
     to system_playback.
 
+    Nodes are stored in an array (node index = position), with a dict for the
+    reverse lookup and forward/reverse adjacency lists, so all lookups are O(1).
+    The topological order is computed on demand and cached until edges change.
+
     >>> g = PedalboardGraph(['a', 'b', 'c'])
     >>> g.add_edges('a', [1, 2])
     >>> g.add_edges('b', [2])
@@ -22,69 +30,137 @@ class PedalboardGraph:
     0
     >>> g.get_index('c')
     2
+    >>> g.dangling_edges()
+    [(2, 3)]
+    >>> g.add_edges('c', [])
+    >>> g.topological_order()
+    [0, 1, 2]
+    >>> g.add_edges('c', [0])
+    >>> g.topological_order()
+    Traceback (most recent call last):
+    ...
+    pedalboard_graph.GraphError: cycle between nodes [0, 1, 2]
     """
     def __init__(self, nodes):
-        self._graph = OrderedDict.fromkeys(nodes, value=[])
+        self._nodes = tuple(nodes)
+        self._index = {node: i for i, node in enumerate(self._nodes)}
+        self._outgoing = [[] for _ in self._nodes]  # node index -> outgoing edge indices
+        self._incoming = [[] for _ in self._nodes]  # node index -> incoming edge indices (sorted)
+        self._dangling = {}  # node index -> edges pointing to non-existing nodes
+        self._topological_order = None  # cached, reset when edges change
 
     def draw(self):
+        """
+        Draw the graph in topological order, one line per connection.
+
+        >>> g = PedalboardGraph(['a', 'b', 'c'])
+        >>> g.add_edges('a', [1, 2])
+        >>> g.add_edges('b', [2])
+        >>> print(g.draw())
+        [0] a
+          +-> [1] b
+          +-> [2] c
+        [1] b
+          +-> [2] c
+        [2] c
+          +-> (out)
+        """
         lines = []
-        cur_node_index = 0
-
-        # Start at node 0
-        cur_node = list(self._graph.keys())[cur_node_index]
-        lines.append(str(cur_node))
-
-        cur_edges = self.get_outgoing_edges(cur_node)
-
-        while cur_edges:
-            # Draw vertical lines according to number of edges
-            lines.append('    '.join(' | ' * len(cur_edges)))
-
-            # Draw next node
-            lines.append(' '.join(str(self.get_node_from_index(i)) for i in cur_edges))
-
-            cur_node_index += 1
-            cur_node = list(self._graph.keys())[cur_node_index]
-            cur_edges = self.get_outgoing_edges(cur_node)
-
+        for i in self.topological_order():
+            lines.append('[{:d}] {!s}'.format(i, self._nodes[i]))
+            for e in self._outgoing[i]:
+                lines.append('  +-> [{:d}] {!s}'.format(e, self._nodes[e]) if 0 <= e < len(self._nodes)
+                             else '  +-> [{:d}] (missing)'.format(e))
+            if not self._outgoing[i]:
+                lines.append('  +-> (out)')
         return '\n'.join(lines)
 
     def __str__(self):
-        return '\n'.join(['{} -> {}'.format(str(n), str(e)) for n, e in self._graph.items()])
+        return '\n'.join(['{} -> {}'.format(str(n), str(e)) for n, e in zip(self._nodes, self._outgoing)])
 
     @property
     def nodes(self):
-        return list(self._graph.keys())
+        """Tuple of all nodes in index order (read-only)"""
+        return self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
 
     def add_edges(self, node, edges):
         """Add a list of edge indices (index to another node) to a node"""
-        self._graph[node] = edges
+        self.add_edges_to_index(self._index[node], edges)
 
     def add_edges_to_index(self, node_index, edges):
         """Add a list of edge indices (index to another node) to a node (by index)"""
-        self._graph[self.get_node_from_index(node_index)] = edges
+        for e in edges:
+            assert type(e) == int, type(e)
+
+        # Remove previous edges of this node from the reverse adjacency lists
+        for e in self._outgoing[node_index]:
+            if 0 <= e < len(self._nodes) and node_index in self._incoming[e]:
+                self._incoming[e].remove(node_index)
+        self._dangling.pop(node_index, None)
+
+        self._outgoing[node_index] = list(edges)
+        for e in self._outgoing[node_index]:
+            if 0 <= e < len(self._nodes):
+                if node_index not in self._incoming[e]:
+                    self._incoming[e].append(node_index)
+                    self._incoming[e].sort()
+            else:
+                self._dangling.setdefault(node_index, []).append(e)
+
+        self._topological_order = None
 
     def get_outgoing_edges(self, node):
         """Return all the edges by index leaving the node"""
-        return self._graph[node]
+        return self._outgoing[self._index[node]]
 
     def get_incoming_edges(self, node):
         """Return all the edges by index going into the node"""
-        r = []
-        for n, edges in self._graph.items():
-            for e in edges:
-                assert type(e) == int, type(e)
-                if e == self.get_index(node):
-                    r.append(self.get_index(n))
-        return list(set(r))
+        return list(self._incoming[self._index[node]])
 
     def get_index(self, node):
         """Find the index of a node object"""
-        return list(self._graph.keys()).index(node)
+        return self._index[node]
 
     def get_node_from_index(self, node_index):
         """Find the node object that is at the given index"""
-        for i, node in enumerate(self._graph.keys()):
-            if i == node_index:
-                return node
+        if 0 <= node_index < len(self._nodes):
+            return self._nodes[node_index]
         return None
+
+    def dangling_edges(self):
+        """Return list of (node index, edge) for edges pointing to non-existing nodes"""
+        return sorted((i, e) for i, edges in self._dangling.items() for e in edges)
+
+    def topological_order(self):
+        """
+        Return node indices in topological order (ties broken by lowest index).
+        Raises GraphError if the graph contains a cycle.
+        """
+        if self._topological_order is None:
+            in_degree = [len(incoming) for incoming in self._incoming]
+            ready = [i for i, d in enumerate(in_degree) if d == 0]
+            heapq.heapify(ready)
+            order = []
+            while ready:
+                i = heapq.heappop(ready)
+                order.append(i)
+                for e in set(self._outgoing[i]):
+                    if 0 <= e < len(self._nodes):
+                        in_degree[e] -= 1
+                        if in_degree[e] == 0:
+                            heapq.heappush(ready, e)
+
+            if len(order) != len(self._nodes):
+                raise GraphError('cycle between nodes {!s}'.format([i for i, d in enumerate(in_degree) if d > 0]))
+            self._topological_order = order
+        return list(self._topological_order)
+
+    def validate(self):
+        """Raise GraphError if the graph has dangling edges or cycles"""
+        dangling = self.dangling_edges()
+        if dangling:
+            raise GraphError('edges to non-existing nodes (node, edge): {!s}'.format(dangling))
+        self.topological_order()
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+CACHE_VERSION = 2
+
+
+def default_cache_path():
+    cache_dir = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(cache_dir, 'musicbox', 'lv2-plugins.json')
+
+
+def bundle_fingerprint(bundle_path):
+    """
+    Fingerprint of an LV2 bundle directory (names, mtimes and sizes of all
+    files in it). Returns None if the bundle can't be read.
+    """
+    if not bundle_path:
+        return None
+    h = hashlib.sha1()
+    try:
+        with os.scandir(bundle_path) as it:
+            entries = sorted((e.name, e.stat().st_mtime_ns, e.stat().st_size) for e in it)
+    except OSError:
+        return None
+    for entry in entries:
+        h.update(repr(entry).encode('utf-8'))
+    return h.hexdigest()
+
+
+class PluginInfoCache:
+    """
+    Persistent cache of LV2 plugin information (name, class, stereo in/out,
+    control ports) keyed by plugin URI.
+
+    Entries are stored on disk together with a fingerprint of the plugin's
+    bundle directory and are reloaded with `loader` when the bundle changed.
+    Each URI is validated/loaded at most once per process (in-memory memo).
+    """
+    def __init__(self, loader, path=None):
+        self._log = logging.getLogger('musicbox.PluginInfoCache')
+        self._loader = loader  # callable(uri) -> info dict (must contain 'bundle')
+        self._path = path or default_cache_path()
+        self._memo = {}  # uri -> info, valid for this run
+        self._entries = {}  # uri -> {'fingerprint': ..., 'info': ...} as stored on disk
+        self._lock = threading.Lock()
+        self._uri_locks = {}
+        self._dirty = False
+        self._read()
+
+    def _read(self):
+        try:
+            with open(self._path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self._log.warning('Ignoring unreadable plugin cache {}: {!s}'.format(self._path, e))
+            return
+
+        if data.get('version') != CACHE_VERSION:
+            self._log.info('Plugin cache {} has old version, discarding'.format(self._path))
+            return
+        self._entries = data.get('plugins', {})
+        self._log.info('Read {:d} cached plugins from {}'.format(len(self._entries), self._path))
+
+    def save(self):
+        """Write cache to disk if anything changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {'version': CACHE_VERSION, 'plugins': dict(self._entries)}
+            self._dirty = False
+
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            tmp_path = self._path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            self._log.warning('Failed to write plugin cache {}: {!s}'.format(self._path, e))
+
+    def _uri_lock(self, uri):
+        with self._lock:
+            return self._uri_locks.setdefault(uri, threading.Lock())
+
+    def get(self, uri):
+        """Return info dict for a plugin URI (from memo, disk cache or loader)"""
+        info = self._memo.get(uri)
+        if info is not None:
+            return info
+
+        # Only one thread loads a given URI, others wait for its result
+        with self._uri_lock(uri):
+            info = self._memo.get(uri)
+            if info is not None:
+                return info
+
+            entry = self._entries.get(uri)
+            if entry and entry['fingerprint'] is not None \
+                    and entry['fingerprint'] == bundle_fingerprint(entry['info'].get('bundle')):
+                self._log.debug('Cache hit for {}'.format(uri))
+                info = entry['info']
+            else:
+                self._log.debug('Cache miss for {}'.format(uri))
+                info = self._loader(uri)
+                with self._lock:
+                    self._entries[uri] = {'fingerprint': bundle_fingerprint(info.get('bundle')), 'info': info}
+                    self._dirty = True
+
+            self._memo[uri] = info
+            return info
+
+    def preload(self, infos):
+        """Use already known plugin infos ({uri: info}, e.g. from a compiled preset bundle) for this run"""
+        self._memo.update(infos)
+
+    def invalidate(self, uri=None):
+        """Forget a single URI or (if None) the whole cache"""
+        with self._lock:
+            if uri is None:
+                self._memo.clear()
+                self._entries.clear()
+            else:
+                self._memo.pop(uri, None)
+                self._entries.pop(uri, None)
+            self._dirty = True
@@ -0,0 +1,58 @@
+import logging
+import yaml
+
+from control_map import ControlMap
+from pedalboard_graph import PedalboardGraph
+from plugin import Lv2Plugin
+from preset_switch import connection_plan
+
+
+_log = logging.getLogger('musicbox.preset')
+
+# LibYAML based loader is a lot faster, if PyYAML was built with it
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def read_preset_file(filename):
+    """Load a YAML preset file and return its data"""
+    with open(filename, 'r') as f:
+        return yaml.load(f, Loader=_Loader)
+
+
+def build_graph(data, plan=None):
+    """
+    Creates a graph for the plugins and connections defined in preset data
+    (see read_preset_file). Other settings are stored in graph.settings, the
+    connection plan (precomputed one if given) in graph.plan.
+    """
+    settings = {
+        'name': data['preset']['name'],
+        'author': data['preset']['author'],
+        'global_parameters': data['preset']['global_parameters']
+    }
+
+    _log.debug('yaml preset data: %s', data['preset'])
+
+    plugins = [Lv2Plugin(sb['lv2'], sb['connections']) for sb in data['preset']['stompboxes']]
+    pb = PedalboardGraph(plugins)
+
+    # Disable stompboxes if configured, compile slider mapping (optional "sliders" list of parameter symbols)
+    for i, sb in enumerate(data['preset']['stompboxes']):
+        if 'enabled' in sb:
+            plugins[i].is_enabled = sb['enabled']
+        plugins[i].control_map = ControlMap(plugins[i].ports, sb.get('sliders'))
+
+    # Assign index to each node
+    for p in pb.nodes:
+        p._index = pb.get_index(p)
+
+    # Add graph edges (connections between effects as index to node - mod_host module will do conversion to "effect_:in" string)
+    for p in pb.nodes:
+        _log.debug('Adding edges %s for node %s', p._connections, p)
+        pb.add_edges(p, p._connections)
+    pb.validate()  # raises GraphError for cycles and connections to non-existing stompboxes
+
+    _log.debug("Graph with edges:\n%s", pb)
+    pb.settings = settings
+    pb.plan = plan if plan is not None else connection_plan(pb)
+    return pb
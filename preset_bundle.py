@@ -0,0 +1,119 @@
+import argparse
+import logging
+import mmap
+import os
+import pickle
+import struct
+
+
+BUNDLE_FILE = 'presets.bundle'
+BUNDLE_MAGIC = b'MBPRESET'
+BUNDLE_VERSION = 1  # increase when the contents change
+_HEADER = struct.Struct('<8sI')  # magic, version
+
+_log = logging.getLogger('musicbox.preset_bundle')
+
+
+def _source_mtimes(filenames):
+    return [(f, os.stat(f).st_mtime_ns) for f in filenames]
+
+
+def write_bundle(path, contents):
+    """Write bundle contents (header + pickle) atomically"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION))
+        pickle.dump(contents, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def read_bundle(path):
+    """
+    Read bundle contents (memory mapped, one read of the file), None if the
+    file doesn't exist or isn't a bundle of the current version.
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if len(mm) < _HEADER.size:
+            return None
+        magic, version = _HEADER.unpack_from(mm)
+        if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+            _log.info('Ignoring preset bundle {} (version {:d}, expected {:d})'.format(path, version, BUNDLE_VERSION))
+            return None
+        view = memoryview(mm)
+        try:
+            return pickle.loads(view[_HEADER.size:])
+        finally:
+            view.release()
+
+
+def compile_bundle(filenames, path=BUNDLE_FILE):
+    """
+    Compile preset files into a bundle: preset data, metadata of all used
+    plugins, connection plans and initial parameter values, so loading the
+    presets needs neither YAML parsing nor plugin introspection.
+    """
+    from plugin import get_plugin_cache
+    from preset import build_graph, read_preset_file
+
+    cache = get_plugin_cache()
+    contents = {'sources': _source_mtimes(filenames), 'plugins': {}, 'presets': []}
+    for filename in filenames:
+        data = read_preset_file(filename)
+        graph = build_graph(data)
+        for node in graph.nodes:
+            contents['plugins'][node.uri] = cache.get(node.uri)
+        contents['presets'].append({
+            'filename': filename,
+            'data': data,
+            'plan': graph.plan,
+            'param_values': [initial_param_values(node.ports) for node in graph.nodes],
+        })
+    write_bundle(path, contents)
+    cache.save()
+    _log.info('Compiled {:d} presets ({:d} plugins) into {}'.format(
+        len(contents['presets']), len(contents['plugins']), path))
+    return contents
+
+
+def initial_param_values(ports):
+    """
+    Default values of the control input ports (the parameters of the effect).
+
+    >>> initial_param_values([{'type': 'control', 'direction': 'input', 'default': 0.5, 'minimum': 0.0},
+    ...                       {'type': 'audio', 'direction': 'input'},
+    ...                       {'type': 'control', 'direction': 'input', 'default': None, 'minimum': 2.0}])
+    [0.5, 2.0]
+    """
+    return [p['default'] if p.get('default') is not None else (p.get('minimum') or 0.0)
+            for p in ports if p.get('type') == 'control' and p.get('direction') == 'input']
+
+
+def load_bundle(filenames, path=BUNDLE_FILE):
+    """
+    Bundle contents for the given preset files, None if there is no bundle or
+    it is stale (compiled from other files, or a file changed since).
+    """
+    contents = read_bundle(path)
+    if contents is None:
+        return None
+    try:
+        sources = _source_mtimes(filenames)
+    except OSError:
+        sources = None
+    if sources != contents['sources']:
+        _log.info('Preset bundle {} is stale, loading preset files'.format(path))
+        return None
+    return contents
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile preset files into a bundle for fast startup')
+    parser.add_argument('presets', nargs='+', help='preset YAML files (in bank order)')
+    parser.add_argument('-o', '--output', default=BUNDLE_FILE, help='bundle file')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    compile_bundle(args.presets, args.output)
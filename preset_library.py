@@ -0,0 +1,154 @@
+import glob
+import logging
+import os
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_BANK_PATTERN = 'preset*.yaml'  # presets of the default bank (position 0 is the stompbox mode preset)
+BANKS_DIR = 'banks'  # further banks: one directory of preset files per bank
+
+
+def index_banks(default_pattern=DEFAULT_BANK_PATTERN, banks_dir=BANKS_DIR):
+    """List of (bank name, [preset files]) found on disk, sorted by name. No file is read."""
+    banks = [('Default', sorted(glob.glob(default_pattern)))]
+    if os.path.isdir(banks_dir):
+        for name in sorted(os.listdir(banks_dir)):
+            files = sorted(glob.glob(os.path.join(banks_dir, name, '*.yaml')))
+            if files:
+                banks.append((name, files))
+    return banks
+
+
+class PresetLibrary:
+    """
+    Banks of presets that are built on first use and kept in an LRU cache.
+
+    The cache is bounded by a budget of plugin instances (stompboxes of all
+    built presets); least recently used presets are dropped first, the active
+    preset never. Neighbours of the active preset are built in the background.
+
+    >>> from types import SimpleNamespace
+    >>> build = lambda f: SimpleNamespace(graph=SimpleNamespace(nodes=[f] * 2))
+    >>> lib = PresetLibrary([('A', ['a0', 'a1', 'a2', 'a3'])], build, budget=4, prefetch=0)
+    >>> _ = lib.activate(0, 1); _ = lib.get(0, 2); _ = lib.get(0, 3)
+    >>> lib.cached_files(), lib.stats()['evictions']
+    (['a1', 'a3'], 1)
+    """
+    def __init__(self, banks, build, budget=64, prefetch=1):
+        self._log = logging.getLogger('musicbox.PresetLibrary')
+        self.banks = banks  # list of (name, [filenames])
+        self._build = build  # callable(filename) -> pedalboard (with graph)
+        self._budget = budget  # max. plugin instances of all cached presets
+        self._prefetch = prefetch  # number of neighbours on each side built in the background
+        self._cache = OrderedDict()  # filename -> pedalboard, least recently used first
+        self._building = {}  # filename -> Future of a running background build
+        self._active = None  # filename of the active preset
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='musicbox-prefetch')
+        self.hits = self.misses = self.evictions = 0
+
+    def filename(self, bank, position):
+        return self.banks[bank][1][position]
+
+    def bank_size(self, bank):
+        return len(self.banks[bank][1])
+
+    def filenames(self):
+        return [f for _, files in self.banks for f in files]
+
+    def locate(self, filename):
+        """(bank, position) of a preset file, None if it isn't indexed"""
+        for bank, (_, files) in enumerate(self.banks):
+            if filename in files:
+                return bank, files.index(filename)
+        return None
+
+    def cached(self, filename):
+        """Built pedalboard of a preset file, None if it isn't cached"""
+        with self._lock:
+            return self._cache.get(filename)
+
+    def cached_files(self):
+        with self._lock:
+            return list(self._cache)
+
+    def get(self, bank, position):
+        """Pedalboard of a preset, built now (or waiting for a running background build) if not cached"""
+        filename = self.filename(bank, position)
+        with self._lock:
+            if filename in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(filename)
+                return self._cache[filename]
+            self.misses += 1
+            future = self._building.get(filename)
+        if future is not None:
+            future.result()
+            with self._lock:
+                if filename in self._cache:
+                    return self._cache[filename]
+        return self._add(filename, self._build(filename))
+
+    def activate(self, bank, position):
+        """Get a preset as the active one (never evicted) and prefetch its neighbours"""
+        pedalboard = self.get(bank, position)
+        with self._lock:
+            self._active = self.filename(bank, position)
+        self.prefetch(bank, position)
+        return pedalboard
+
+    def prefetch(self, bank, position):
+        """Build the neighbours of a preset in the background"""
+        for offset in range(1, self._prefetch + 1):
+            for p in (position + offset, position - offset):
+                if 0 <= p < self.bank_size(bank):
+                    filename = self.filename(bank, p)
+                    with self._lock:
+                        if filename in self._cache or filename in self._building:
+                            continue
+                        self._building[filename] = self._executor.submit(self._build_in_background, filename)
+
+    def _build_in_background(self, filename):
+        try:
+            self._add(filename, self._build(filename))
+        except Exception:
+            self._log.exception('Prefetching {} failed'.format(filename))
+        finally:
+            with self._lock:
+                self._building.pop(filename, None)
+
+    def replace(self, filename, pedalboard):
+        """Replace the cached pedalboard of a preset (e.g. after the file changed)"""
+        self._add(filename, pedalboard)
+
+    def _add(self, filename, pedalboard):
+        with self._lock:
+            self._cache[filename] = pedalboard
+            self._cache.move_to_end(filename)
+            self._evict()
+            return pedalboard
+
+    def _cost(self):
+        return sum(len(pb.graph.nodes) for pb in self._cache.values())
+
+    def _evict(self):
+        cost = self._cost()
+        for filename in list(self._cache):
+            if cost <= self._budget:
+                break
+            if filename == self._active or filename == next(reversed(self._cache)):
+                continue  # keep the active and the newest preset
+            cost -= len(self._cache.pop(filename).graph.nodes)
+            self.evictions += 1
+            self._log.debug('Evicted {}'.format(filename))
+
+    def stats(self):
+        with self._lock:
+            return {'presets': len(self.filenames()), 'cached': len(self._cache), 'instances': self._cost(),
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,206 @@
+import logging
+import time
+
+from contextlib import nullcontext
+
+from pluginsmanager.model.bank import Bank
+from pluginsmanager.model.pedalboard import Pedalboard
+from pluginsmanager.model.lv2.lv2_effect_builder import Lv2EffectBuilder
+from pluginsmanager.model.system.system_effect import SystemEffect
+
+
+SYSTEM = 'system'  # endpoint in a connection plan meaning system capture/playback
+
+
+def connection_plan(graph):
+    """
+    Returns the list of audio connections needed for a pedalboard graph as
+    ((source node index, output port index), (destination node index, input port index)),
+    where SYSTEM as node index means system capture (source) or system playback (destination).
+
+    Mono/stereo is decided here: stereo to stereo, split mono to stereo, sum stereo to mono.
+    """
+    plan = []
+    if not graph.nodes:
+        return plan
+
+    # Connect system capture to first effect
+    plan.append(((SYSTEM, 0), (0, 0)))
+
+    for node in graph.nodes:
+        i = graph.get_index(node)
+        outgoing = graph.get_outgoing_edges(node)
+
+        # Go through outgoing edges (indices)
+        for e in outgoing:
+            neighbor = graph.get_node_from_index(e)
+            if node.has_stereo_output and neighbor.has_stereo_input:  # stereo to stereo
+                plan += [((i, 0), (e, 0)), ((i, 1), (e, 1))]
+            elif not node.has_stereo_output and neighbor.has_stereo_input:  # split mono to stereo
+                plan += [((i, 0), (e, 0)), ((i, 0), (e, 1))]
+            elif node.has_stereo_output and not neighbor.has_stereo_input:  # sum stereo to mono
+                plan += [((i, 0), (e, 0)), ((i, 1), (e, 0))]
+            else:  # mono to mono
+                plan.append(((i, 0), (e, 0)))
+
+        if not outgoing:
+            plan += [((i, 0), (SYSTEM, 0)), ((i, 1 if node.has_stereo_output else 0), (SYSTEM, 1))]
+    return plan
+
+
+def effect_active(node):
+    """mod-host effect state for a stompbox (same convention as MusicBox.cb_stomp_enable)"""
+    return not node.is_enabled
+
+
+class PresetDiff:
+    """Changes needed to turn the live pedalboard into a target graph"""
+    def __init__(self):
+        self.reused = {}  # target node index -> live effect
+        self.added = []  # target node indices needing a new effect instance
+        self.removed = []  # live effects not used by the target graph
+        self.connect = []  # connection keys to add
+        self.disconnect = []  # connection keys to remove
+        self.params = []  # (node index, param index, value)
+        self.status = []  # (node index, active)
+
+    @property
+    def size(self):
+        """Number of mod-host operations needed for this switch"""
+        return len(self.added) + len(self.removed) + len(self.connect) + len(self.disconnect) \
+            + len(self.params) + len(self.status)
+
+    def __str__(self):
+        return 'reuse {:d}, add {:d}, remove {:d}, connect {:d}, disconnect {:d}, params {:d}, status {:d}'.format(
+            len(self.reused), len(self.added), len(self.removed), len(self.connect), len(self.disconnect),
+            len(self.params), len(self.status))
+
+
+class PresetSwitcher:
+    """
+    Keeps a single live pedalboard in mod-host and switches presets by
+    changing only what differs between the live pedalboard and the target
+    graph. Effect instances with the same URI are reused, only differing
+    effects, connections, parameter values and enable states are changed.
+
+    After a switch the nodes of the target graph refer to the live effects
+    (node.effect). Parameter values of a preset are kept in node.param_values
+    while the preset isn't active.
+    """
+    def __init__(self, banks_manager, modhost, transport=None):
+        self._log = logging.getLogger('musicbox.PresetSwitcher')
+        self._transport = transport  # ModHostTransport: all commands of a switch are sent as one batch
+        self._builder = Lv2EffectBuilder()
+        self._sys_effect = SystemEffect('system', ['capture_1', 'capture_2'], ['playback_1', 'playback_2'])
+
+        # The live pedalboard has to be in a bank of the banks manager, otherwise
+        # changes to it aren't propagated to the mod-host observer
+        self._live = Pedalboard('live')
+        banks_manager.append(Bank('Live'))
+        banks_manager.banks[-1].append(self._live)
+        modhost.pedalboard = self._live
+
+        self._instances = []  # list of (uri, effect) in the live pedalboard
+        self._connections = {}  # connection key -> (output port, input port)
+        self._graph = None  # currently applied graph
+
+        self.last_diff = None
+        self.last_switch_time = None  # seconds
+
+    @property
+    def graph(self):
+        return self._graph
+
+    def _connection_key(self, entry, effects):
+        (src, out_idx), (dst, in_idx) = entry
+        return (SYSTEM if src == SYSTEM else effects[src], out_idx, SYSTEM if dst == SYSTEM else effects[dst], in_idx)
+
+    def diff(self, graph):
+        """Compute the structural changes (effects and connections) for switching to graph"""
+        d = PresetDiff()
+        unused = list(self._instances)
+
+        # Reuse live effects with the same URI, preferably at the same position
+        for i, node in enumerate(graph.nodes):
+            candidates = [x for x in unused if x[0] == node.uri]
+            if not candidates:
+                d.added.append(i)
+                continue
+            same_position = [x for x in candidates if self._graph is not None and i < len(self._graph.nodes)
+                             and self._graph.nodes[i].effect is x[1]]
+            match = (same_position or candidates)[0]
+            unused.remove(match)
+            d.reused[i] = match[1]
+        d.removed = [effect for _, effect in unused]
+
+        # Connections as keys of effect identity (or placeholder for new effects) and port index
+        effects = {i: id(effect) for i, effect in d.reused.items()}
+        effects.update({i: ('new', i) for i in d.added})
+        plan = graph.plan if getattr(graph, 'plan', None) is not None else connection_plan(graph)
+        desired = [self._connection_key(entry, effects) for entry in plan]
+        d.connect = [k for k in desired if k not in self._connections]
+        d.disconnect = [k for k in self._connections if k not in desired]
+        return d
+
+    def switch(self, graph):
+        """Make the live pedalboard match graph, returns the PresetDiff"""
+        start = time.monotonic()
+
+        # Remember the parameter values of the outgoing preset for when it is activated again
+        if self._graph is not None:
+            for node in self._graph.nodes:
+                node.param_values = [p.value for p in node.effect.params]
+
+        d = self.diff(graph)
+        with self._transport.batch() if self._transport else nullcontext():
+            self._apply(graph, d)
+        self._graph = graph
+
+        self.last_diff = d
+        self.last_switch_time = time.monotonic() - start
+        self._log.info('Switched preset in %.1fms (%d changes: %s)', self.last_switch_time * 1000, d.size, d)
+        return d
+
+    def _apply(self, graph, d):
+        # 1. Add new effect instances
+        effects = dict(d.reused)
+        for i in d.added:
+            node = graph.nodes[i]
+            effect = self._builder.build(node.uri)
+            self._live.effects.append(effect)
+            self._instances.append((node.uri, effect))
+            effects[i] = effect
+
+        # 2. Parameter values and enable state
+        for i, node in enumerate(graph.nodes):
+            effect = effects[i]
+            node.effect = effect
+            if node.param_values is not None:
+                for k, (param, value) in enumerate(zip(effect.params, node.param_values)):
+                    if param.value != value:
+                        param.value = value
+                        d.params.append((i, k, value))
+            if effect.active != effect_active(node):
+                effect.active = effect_active(node)
+                d.status.append((i, effect.active))
+
+        # 3. Rewire: make the new connections first, then remove the old ones
+        new_ids = {('new', i): id(effects[i]) for i in d.added}
+        by_id = {id(effect): effect for effect in effects.values()}
+        for key in d.connect:
+            src, out_idx, dst, in_idx = key
+            src, dst = new_ids.get(src, src), new_ids.get(dst, dst)
+            out_port = self._sys_effect.outputs[out_idx] if src == SYSTEM else by_id[src].outputs[out_idx]
+            in_port = self._sys_effect.inputs[in_idx] if dst == SYSTEM else by_id[dst].inputs[in_idx]
+            self._live.connect(out_port, in_port)
+            self._connections[(src, out_idx, dst, in_idx)] = (out_port, in_port)
+        for key in d.disconnect:
+            out_port, in_port = self._connections.pop(key)
+            self._live.disconnect(out_port, in_port)
+
+        # 4. Remove effects that are not needed anymore
+        for effect in d.removed:
+            for c in list(effect.connections):
+                self._live.disconnect(c.output, c.input)
+            self._live.effects.remove(effect)
+            self._instances = [x for x in self._instances if x[1] is not effect]
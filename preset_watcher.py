@@ -0,0 +1,61 @@
+import logging
+import os
+import threading
+
+
+def _stat(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class PresetWatcher:
+    """
+    Watches preset files for changes (modification time and size) by polling in
+    a background thread. A change is reported with on_change(filename) once the
+    file didn't change for one more poll, so half-written files aren't loaded.
+    """
+    def __init__(self, filenames, on_change, interval=0.5):
+        self._log = logging.getLogger('musicbox.PresetWatcher')
+        self._on_change = on_change
+        self.interval = interval
+        self._known = {f: _stat(f) for f in filenames}  # filename -> stat of the loaded version
+        self._pending = {}  # filename -> stat of a change seen in the last poll
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        """Check all files once, returns the list of changed (and settled) files"""
+        changed = []
+        for filename, known in self._known.items():
+            current = _stat(filename)
+            if current == known or current is None:
+                self._pending.pop(filename, None)
+            elif self._pending.get(filename) == current:
+                del self._pending[filename]
+                self._known[filename] = current
+                changed.append(filename)
+            else:
+                self._pending[filename] = current
+        return changed
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='musicbox-preset-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for filename in self.poll():
+                self._log.info('{} changed'.format(filename))
+                try:
+                    self._on_change(filename)
+                except Exception:
+                    self._log.exception('Handling change of {} failed'.format(filename))
@@ -0,0 +1,188 @@
+import logging
+import socket
+import threading
+import time
+
+from contextlib import contextmanager
+
+from metrics import get_metrics
+
+
+class PhaseTimer:
+    """
+    Records wall-clock durations of named phases (e.g. of the startup), also
+    as metrics "<name>.<phase>".
+
+    >>> t = PhaseTimer('test')
+    >>> with t.phase('a'):
+    ...     pass
+    >>> [name for name, _ in t.phases]
+    ['a']
+    """
+    def __init__(self, name):
+        self._log = logging.getLogger('musicbox.PhaseTimer')
+        self._name = name
+        self._start = time.monotonic()
+        self.phases = []  # list of (name, duration in seconds)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start
+            self.phases.append((name, duration))
+            get_metrics().record('{}.{}'.format(self._name, name), duration)
+
+    @property
+    def total(self):
+        return time.monotonic() - self._start
+
+    def __str__(self):
+        return '{}: '.format(self._name) + ', '.join('{} {:.1f}ms'.format(n, d * 1000) for n, d in self.phases) \
+            + ' (total {:.1f}ms)'.format(self.total * 1000)
+
+    def log(self):
+        self._log.info(str(self))
+
+
+class StartupError(Exception):
+    pass
+
+
+class _Component:
+    def __init__(self, name, start, probe, after, timeout, required):
+        self.name = name
+        self.start = start
+        self.probe = probe
+        self.after = after
+        self.timeout = timeout
+        self.required = required
+        self.started = self.ready = None  # seconds since the orchestrator started
+        self.status = 'waiting'
+        self.done = threading.Event()
+
+
+class StartupOrchestrator:
+    """
+    Starts components concurrently, each as soon as the components it depends on are ready.
+
+    A component has an optional start function (run in its own thread) and an
+    optional readiness probe, polled after start until it returns True. run()
+    waits for the required components and raises StartupError if one of them
+    failed; other components finish in the background. The timeline records
+    when each component was started and became ready.
+
+    >>> s = StartupOrchestrator('test')
+    >>> s.add('a', probe=lambda: True)
+    >>> s.add('b', start=lambda: None, after=['a'])
+    >>> s.run()
+    >>> [(name, status) for name, status, _, _ in s.timeline()]
+    [('a', 'ready'), ('b', 'ready')]
+    """
+    def __init__(self, name='startup', poll_interval=0.02):
+        self._log = logging.getLogger('musicbox.StartupOrchestrator')
+        self._name = name
+        self._poll_interval = poll_interval
+        self._components = {}  # name -> _Component (in order of adding)
+        self._start = None
+
+    def add(self, name, start=None, probe=None, after=(), timeout=30, required=True):
+        for dependency in after:
+            if dependency not in self._components:
+                raise ValueError('{} depends on unknown component {}'.format(name, dependency))
+        self._components[name] = _Component(name, start, probe, after, timeout, required)
+
+    def run(self):
+        self._start = time.monotonic()
+        for component in self._components.values():
+            threading.Thread(target=self._run_component, args=(component,), name='startup-' + component.name,
+                             daemon=True).start()
+
+        failed = []
+        for component in self._components.values():
+            if component.required:
+                component.done.wait()
+                if component.status != 'ready':
+                    failed.append(component)
+        self.log()
+        if failed:
+            raise StartupError(', '.join('{} {}'.format(c.name, c.status) for c in failed))
+
+    def _elapsed(self):
+        return time.monotonic() - self._start
+
+    def _run_component(self, component):
+        try:
+            for dependency in component.after:
+                dependency = self._components[dependency]
+                dependency.done.wait()
+                if dependency.status != 'ready':
+                    component.status = 'skipped ({} {})'.format(dependency.name, dependency.status)
+                    return
+
+            component.started = self._elapsed()
+            component.status = 'starting'
+            if component.start:
+                component.start()
+            if component.probe:
+                deadline = time.monotonic() + component.timeout
+                while not component.probe():
+                    if time.monotonic() > deadline:
+                        component.status = 'timeout'
+                        return
+                    time.sleep(self._poll_interval)
+            component.ready = self._elapsed()
+            component.status = 'ready'
+        except Exception as e:
+            component.status = 'failed: {!s}'.format(e)
+            self._log.exception('Starting {} failed'.format(component.name))
+        finally:
+            component.done.set()
+            if not component.required:
+                self._log.info('{}: {} {}'.format(self._name, component.name, component.status))
+
+    def timeline(self):
+        """List of (component, status, started, ready), times in seconds since run() (None if not reached)"""
+        return [(c.name, c.status, c.started, c.ready) for c in self._components.values()]
+
+    def __str__(self):
+        def ms(t):
+            return '-' if t is None else '+{:.1f}ms'.format(t * 1000)
+        return '{} timeline:\n'.format(self._name) + '\n'.join(
+            '  {:<20} start {:>10} ready {:>10}  {}'.format(name, ms(started), ms(ready), status)
+            for name, status, started, ready in self.timeline())
+
+    def log(self):
+        self._log.info(str(self))
+
+
+def probe_tcp(host, port, request=None, response=None, timeout=0.5):
+    """
+    Readiness probe for a TCP service: connects (and optionally sends request and
+    waits for a reply starting with response, e.g. a mod-host command and b'resp').
+    """
+    def probe():
+        try:
+            with socket.create_connection((host, port), timeout) as s:
+                if request is None:
+                    return True
+                s.sendall(request)
+                return s.recv(64).startswith(response or b'')
+        except OSError:
+            return False
+    return probe
+
+
+def probe_jack(name='musicbox-probe'):
+    """Readiness probe for the JACK server (opens and closes a client, never starts a server)"""
+    def probe():
+        import jack
+        try:
+            client = jack.Client(name, no_start_server=True)
+        except jack.JackError:
+            return False
+        client.close()
+        return True
+    return probe
@@ -0,0 +1,136 @@
+import copy
+import json
+import logging
+import threading
+
+try:
+    import msgpack  # optional, for the compact binary encoding
+except ImportError:
+    msgpack = None
+
+
+ENCODINGS = ('json', 'binary') if msgpack else ('json',)
+
+
+def encode(kind, version, data, encoding):
+    """
+    Encode a SNAPSHOT or DELTA message.
+
+    >>> encode('DELTA', 3, [['bpm', 120]], 'json')
+    'DELTA:3:[["bpm",120]]'
+    """
+    if encoding == 'binary':
+        return msgpack.packb([kind, version, data])
+    return '{}:{:d}:{}'.format(kind, version, json.dumps(data, separators=(',', ':')))
+
+
+class StateModel:
+    """
+    State shown by display clients, with a version that increases with every change.
+
+    Clients get a full snapshot when they subscribe and afterwards only deltas:
+    all changes since the last tick, as a list of [key, value] with the keys
+    'mode', 'bpm', 'sel' (selected stompbox), 'preset' (full preset document),
+    'en:<stomp>' (enabled flag) and 'p:<stomp>:<param>' (parameter value).
+    Several changes of the same key within one tick are sent once. Deltas with
+    a version not newer than the client's snapshot are already contained in it.
+
+    >>> published = []
+    >>> s = StateModel(lambda version, changes: published.append((version, changes)))
+    >>> s.set_bpm(120); s.set_param(0, 1, 0.5); s.set_param(0, 1, 0.7)
+    >>> s.tick()
+    >>> published
+    [(3, [['bpm', 120], ['p:0:1', 0.7]])]
+    >>> s.snapshot('json')
+    'SNAPSHOT:3:{"mode":null,"bpm":120,"sel":null,"preset":null}'
+    """
+    def __init__(self, publish, rate=30):
+        self._log = logging.getLogger('musicbox.StateModel')
+        self._publish = publish  # callable(version, changes)
+        self.interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._state = {'mode': None, 'bpm': None, 'sel': None, 'preset': None}
+        self._pending = {}  # key -> value, changes since last tick
+        self._snapshots = {}  # encoding -> encoded snapshot of the current version
+        self.version = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _set(self, key, value, update_state=None):
+        """Record change of key, update_state (called with the lock held) changes the snapshot state"""
+        with self._lock:
+            if update_state:
+                update_state(self._state)
+            self.version += 1
+            self._pending[key] = value
+            self._snapshots = {}
+
+    def set_mode(self, mode):
+        self._set('mode', mode, lambda s: s.update(mode=mode))
+
+    def set_bpm(self, bpm):
+        self._set('bpm', bpm, lambda s: s.update(bpm=bpm))
+
+    def set_selected(self, stomp):
+        self._set('sel', stomp, lambda s: s.update(sel=stomp))
+
+    def set_preset(self, preset):
+        """Replace the preset document (see MusicBox._preset_info_notifier_update)"""
+        def update(s):
+            s['preset'] = preset
+            # A new preset supersedes all pending stompbox changes
+            for k in [k for k in self._pending if k.startswith(('en:', 'p:'))]:
+                del self._pending[k]
+        self._set('preset', preset, update)
+
+    def set_enabled(self, stomp, enabled):
+        def update(s):
+            if s['preset'] and stomp < len(s['preset']['stompboxes']):
+                s['preset']['stompboxes'][stomp]['enabled'] = bool(enabled)
+        self._set('en:{:d}'.format(stomp), bool(enabled), update)
+
+    def set_param(self, stomp, param, value):
+        def update(s):
+            if s['preset'] and stomp < len(s['preset']['stompboxes']):
+                parameters = s['preset']['stompboxes'][stomp]['parameters']
+                if param < len(parameters):
+                    parameters[param]['value'] = value
+        self._set('p:{:d}:{:d}'.format(stomp, param), value, update)
+
+    def snapshot(self, encoding='json'):
+        """Full state of the current version (encoded once per version and encoding)"""
+        with self._lock:
+            if encoding not in self._snapshots:
+                self._snapshots[encoding] = encode('SNAPSHOT', self.version, self._state, encoding)
+            return self._snapshots[encoding]
+
+    def state(self):
+        """Copy of the current state"""
+        with self._lock:
+            return copy.deepcopy(self._state)
+
+    def tick(self):
+        """Publish all changes since the last tick as one delta"""
+        with self._lock:
+            if not self._pending:
+                return
+            changes = [[k, v] for k, v in self._pending.items()]
+            self._pending = {}
+            version = self.version
+        self._publish(version, changes)
+
+    def start(self):
+        """Run ticks in a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.tick()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.tick()
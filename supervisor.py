@@ -0,0 +1,166 @@
+import logging
+import subprocess
+import threading
+import time
+
+
+# Helper states
+STOPPED = 'stopped'  # not started yet
+STARTING = 'starting'  # process started, waiting for the readiness check
+READY = 'ready'
+BACKOFF = 'backoff'  # exited or failed to start, waiting before the next start
+
+
+class Helper:
+    """
+    A helper process (sooperlooper, klick) kept running by the Supervisor.
+
+    `ready` is a callable checking whether the started process is usable (e.g.
+    its JACK ports exist), without it the helper is ready when started.
+    `on_ready` is called every time the helper became ready (also after a
+    restart), e.g. to send its configuration.
+    """
+    def __init__(self, name, command, ready=None, on_ready=None, ready_timeout=10, kill_existing=True):
+        self.name = name
+        self.command = command
+        self._ready = ready
+        self.on_ready = on_ready
+        self.ready_timeout = ready_timeout  # seconds until a process that isn't ready is killed
+        self.kill_existing = kill_existing  # kill instances left over from a previous run before the first start
+        self.state = STOPPED
+        self.process = None
+        self.restarts = 0
+        self.failures = 0  # consecutive failures (for the backoff)
+        self.next_start = 0.0
+        self.state_since = time.monotonic()
+        self._ready_event = threading.Event()
+
+    @property
+    def is_ready(self):
+        return self.state == READY
+
+    def wait_ready(self, timeout=None):
+        """Block until the helper is ready, returns False on timeout"""
+        return self._ready_event.wait(timeout)
+
+    def check_ready(self):
+        return self._ready is None or self._ready()
+
+    def set_state(self, state):
+        self.state = state
+        self.state_since = time.monotonic()
+        if state == READY:
+            self._ready_event.set()
+        else:
+            self._ready_event.clear()
+
+
+class Supervisor:
+    """
+    Keeps helper processes running ("warm") in a background thread.
+
+    Each helper goes through STOPPED -> STARTING -> READY. A helper that exits
+    or doesn't get ready in time is restarted after a backoff that doubles
+    with every consecutive failure (reset once it ran stable for a while).
+    Callers never block: they only look at the state or request a restart.
+    """
+    def __init__(self, poll_interval=0.1, min_backoff=0.5, max_backoff=30, stable_time=60):
+        self._log = logging.getLogger('musicbox.Supervisor')
+        self._poll_interval = poll_interval
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._stable_time = stable_time  # seconds a helper has to run to reset its failure count
+        self._helpers = {}  # name -> Helper
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, helper):
+        with self._lock:
+            self._helpers[helper.name] = helper
+        return helper
+
+    def __getitem__(self, name):
+        return self._helpers[name]
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='musicbox-supervisor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop supervising and terminate all helpers"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for helper in self._helpers.values():
+            if helper.process and helper.process.poll() is None:
+                helper.process.terminate()
+                try:
+                    helper.process.wait(2)
+                except subprocess.TimeoutExpired:
+                    helper.process.kill()
+            helper.set_state(STOPPED)
+
+    def restart(self, name):
+        """Restart a helper (e.g. if it hangs) without waiting for it"""
+        helper = self._helpers[name]
+        helper.failures = 0
+        if helper.process and helper.process.poll() is None:
+            helper.process.kill()  # the supervisor thread notices the exit
+
+    def stats(self):
+        return {h.name: {'state': h.state, 'restarts': h.restarts, 'failures': h.failures}
+                for h in self._helpers.values()}
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            with self._lock:
+                helpers = list(self._helpers.values())
+            for helper in helpers:
+                try:
+                    self._step(helper, now)
+                except Exception:
+                    self._log.exception('Supervising {} failed'.format(helper.name))
+            self._stop.wait(self._poll_interval)
+
+    def _step(self, helper, now):
+        if helper.process is not None and helper.process.poll() is not None:
+            self._failed(helper, now, 'exited with {:d}'.format(helper.process.returncode))
+
+        if helper.process is None:
+            if helper.state in (STOPPED, BACKOFF) and now >= helper.next_start:
+                self._spawn(helper, now)
+        elif helper.state == STARTING:
+            if helper.check_ready():
+                self._log.info('{} ready after {:.2f}s'.format(helper.name, now - helper.state_since))
+                helper.set_state(READY)
+                if helper.on_ready:
+                    helper.on_ready()
+            elif now - helper.state_since > helper.ready_timeout:
+                self._log.error('{} not ready after {:.0f}s, killing it'.format(helper.name, helper.ready_timeout))
+                helper.process.kill()
+        elif helper.state == READY and helper.failures and now - helper.state_since > self._stable_time:
+            helper.failures = 0
+
+    def _spawn(self, helper, now):
+        if helper.state == STOPPED and helper.kill_existing:
+            subprocess.call(['killall', '-q', helper.command[0]])
+        elif helper.state == BACKOFF:
+            helper.restarts += 1
+        try:
+            helper.process = subprocess.Popen(helper.command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            self._failed(helper, now, 'failed to start: {!s}'.format(e))
+            return
+        self._log.info('Started {} (pid {:d})'.format(helper.name, helper.process.pid))
+        helper.set_state(STARTING)
+
+    def _failed(self, helper, now, reason):
+        helper.process = None
+        helper.failures += 1
+        backoff = min(self._min_backoff * 2 ** (helper.failures - 1), self._max_backoff)
+        helper.next_start = now + backoff
+        helper.set_state(BACKOFF)
+        self._log.error('{} {}, restarting in {:.1f}s'.format(helper.name, reason, backoff))